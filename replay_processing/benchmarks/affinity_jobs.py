@@ -0,0 +1,76 @@
+"""Affinity matrix time of build_order_clustering at several --jobs.
+
+Runs offline on synthetic builds:
+
+    $ python -m replay_processing.benchmarks.affinity_jobs --builds 2000
+"""
+import argparse
+import random
+import sys
+import time
+
+from replay_processing import build_order_clustering
+from replay_processing.benchmarks.synthetic import ARMY, STRUCTURES, WORKERS
+from replay_processing.distance import BLOCK_SIZE, affinity_matrix
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--builds",
+                        help="Number of synthetic builds.",
+                        type=int,
+                        default=2000)
+    parser.add_argument("--events",
+                        help="Build order events per build.",
+                        type=int,
+                        default=150)
+    parser.add_argument("--jobs",
+                        help="Process counts to time.",
+                        type=int,
+                        nargs='+',
+                        default=[1, 4, 16])
+    parser.add_argument("--block-size",
+                        help="Builds per tile side.",
+                        type=int,
+                        default=BLOCK_SIZE)
+
+    return parser.parse_args(args)
+
+
+def synthetic_builds(count, events, seed=0):
+    rand = random.Random(seed)
+    builds = build_order_clustering.PlayerBuilds()
+    for i in range(count):
+        race = rand.choice(sorted(WORKERS))
+        names = ([('worker', WORKERS[race])] * 4 +
+                 [('building', name) for name in STRUCTURES[race]] +
+                 [('army', name) for name in ARMY[race]])
+        build = builds.next_build('map%d.SC2Replay' % (i // 2), i % 2)
+        ev_time = 0
+        for ev_ndx in range(events):
+            ev_time += rand.randint(1, 10)
+            build.add_build_item(build_order_clustering.BuildItem(
+                ev_ndx, ev_time,
+                build_order_clustering.Unit(*rand.choice(names))))
+    return [builds.get_by_player_id(i) for i in range(len(builds))], \
+        builds.unit_build_popularity_counts()
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    builds, unit_popularity = synthetic_builds(args.builds, args.events)
+
+    print("%6s %10s %10s" % ('jobs', 'seconds', 'speedup'))
+    single = None
+    for jobs in args.jobs:
+        start = time.perf_counter()
+        affinity_matrix(builds, unit_popularity, block_size=args.block_size,
+                        jobs=jobs)
+        seconds = time.perf_counter() - start
+        if single is None:
+            single = seconds
+        print("%6d %10.2f %9.2fx" % (jobs, seconds, single / seconds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+"""Feature-extraction hot path on synthetic spawningtool results.
+
+Runs offline, no replay files needed:
+
+    $ python -m replay_processing.benchmarks.hotpath
+    $ python -m replay_processing.benchmarks.hotpath --save-baseline new.json
+    $ python -m replay_processing.benchmarks.hotpath --compare \
+        replay_processing/benchmarks/baselines/hotpath.json
+"""
+import argparse
+import collections
+import csv
+import io
+import json
+import logging
+import platform
+import sys
+import time
+
+from replay_processing.benchmarks.synthetic import synthetic_results
+from replay_processing.sc2files import (extract_player_data, print_results,
+                                        row_values)
+from replay_processing.sc2scan import map_process, populate_build_data
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes",
+                        help="Numbers of replays to run each benchmark on.",
+                        type=int,
+                        nargs='+',
+                        default=[1000, 10000, 100000])
+    parser.add_argument("--pool",
+                        help="Distinct synthetic replays, reused in turn.",
+                        type=int,
+                        default=1000)
+    parser.add_argument("--events",
+                        help="buildOrder events per player.",
+                        type=int,
+                        default=300)
+    parser.add_argument("--only",
+                        help="Benchmarks to run.",
+                        nargs='+')
+    parser.add_argument("--save-baseline",
+                        help="Write the results as a baseline JSON file.",
+                        type=str)
+    parser.add_argument("--compare",
+                        help="Baseline JSON file to compare against.",
+                        type=str)
+    parser.add_argument("--threshold",
+                        help="Slowdown ratio reported as a regression.",
+                        type=float,
+                        default=1.25)
+
+    return parser.parse_args(args)
+
+
+def bench_map_process(results, size, logger):
+    for i in range(size):
+        map_process(results[i % len(results)]['map'], logger)
+
+
+def bench_populate_build_data(results, size, logger):
+    for i in range(size):
+        result = results[i % len(results)]
+        populate_build_data(result['players'][1], logger)
+        populate_build_data(result['players'][2], logger)
+
+
+def bench_extract_player_data(results, size, logger):
+    for i in range(size):
+        result = results[i % len(results)]
+        extract_player_data(result, 1, logger)
+        extract_player_data(result, 2, logger)
+
+
+def bench_row_path(results, size, logger):
+    # What a worker and the CSV writer do per replay once spawningtool is done
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator='\n')
+    for i in range(size):
+        result = results[i % len(results)]
+        sides = print_results(result, logger)
+        for side in sides:
+            side.replay_file = 'replay%d.SC2Replay' % i
+        writer.writerows(row_values(side) for side in sides)
+        if out.tell() > 1024 * 1024:
+            out.seek(0)
+            out.truncate()
+
+
+BENCHMARKS = collections.OrderedDict([
+    ('map_process', bench_map_process),
+    ('populate_build_data', bench_populate_build_data),
+    ('extract_player_data', bench_extract_player_data),
+    ('row_path', bench_row_path),
+])
+
+
+def run(names, sizes, results, logger):
+    timings = collections.OrderedDict()
+    for name in names:
+        timings[name] = collections.OrderedDict()
+        for size in sizes:
+            start = time.perf_counter()
+            BENCHMARKS[name](results, size, logger)
+            timings[name][str(size)] = time.perf_counter() - start
+    return timings
+
+
+def compare(timings, baseline, threshold):
+    regressions = []
+    for name, sizes in timings.items():
+        for size, seconds in sizes.items():
+            try:
+                before = baseline['results'][name][size]
+            except KeyError:
+                continue
+            ratio = seconds / before if before else float('inf')
+            print("%-20s %8s %10.3fs -> %10.3fs %6.2fx%s" % (
+                name, size, before, seconds, ratio,
+                '  REGRESSION' if ratio > threshold else ''))
+            if ratio > threshold:
+                regressions.append((name, size, ratio))
+    return regressions
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    names = args.only or list(BENCHMARKS)
+
+    logger = logging.getLogger("replayParser.benchmark")
+    logger.setLevel(logging.WARNING)
+
+    results = synthetic_results(args.pool, events_per_player=args.events)
+    timings = run(names, args.sizes, results, logger)
+
+    print("%-20s %8s %10s %12s" % ('benchmark', 'replays', 'seconds',
+                                   'us/replay'))
+    for name, sizes in timings.items():
+        for size, seconds in sizes.items():
+            print("%-20s %8s %10.3f %12.1f" % (name, size, seconds,
+                                               seconds / int(size) * 1e6))
+
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as fh:
+            json.dump({
+                'python': platform.python_version(),
+                'machine': platform.machine(),
+                'pool': args.pool,
+                'events_per_player': args.events,
+                'results': timings,
+            }, fh, indent=4, separators=(',', ': '))
+            fh.write('\n')
+
+    if args.compare:
+        with open(args.compare) as fh:
+            baseline = json.load(fh)
+        print()
+        if compare(timings, baseline, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
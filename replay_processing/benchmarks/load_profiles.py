@@ -0,0 +1,88 @@
+"""Parse time and memory per replay of every model.Replay load profile.
+
+    $ python -m replay_processing.benchmarks.load_profiles replays/ -M 50
+
+Time and memory are measured in separate passes, tracemalloc slows the
+parse down too much to time it in the same pass.
+"""
+import argparse
+import gc
+import itertools
+import sys
+import time
+import tracemalloc
+
+from replay_processing import model
+from replay_processing.walk import iter_replay_files
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("replay_path",
+                        help="Path to replay directory.",
+                        type=str)
+    parser.add_argument("-M", "--max_replays",
+                        help="Number of replays loaded per profile.",
+                        type=int,
+                        default=50)
+    parser.add_argument("--profiles",
+                        help="Load profiles to measure.",
+                        choices=sorted(model.LOAD_PROFILES),
+                        nargs='+',
+                        default=['full', 'tracker_only', 'metadata'])
+
+    return parser.parse_args(args)
+
+
+def load(path, profile):
+    replay = model.Replay(path, profile=profile)
+    # Touching the players and events forces the parse
+    replay.players
+    return replay, len(replay.events)
+
+
+def time_profile(paths, profile):
+    start = time.perf_counter()
+    events = 0
+    for path in paths:
+        events += load(path, profile)[1]
+    return time.perf_counter() - start, events
+
+
+def memory_profile(paths, profile):
+    # Peak traced memory while each replay is loaded and held
+    peaks = []
+    for path in paths:
+        gc.collect()
+        tracemalloc.start()
+        replay = load(path, profile)
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        del replay
+    return sum(peaks) / len(peaks) if peaks else 0.
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    paths = list(itertools.islice(iter_replay_files(args.replay_path),
+                                  args.max_replays))
+    if not paths:
+        sys.exit("No replays found under %s" % args.replay_path)
+
+    print("%-13s %8s %12s %12s %10s %10s" % ('profile', 'replays',
+                                             'ms/replay', 'events',
+                                             'peak MB', 'vs full'))
+    full = None
+    for profile in args.profiles:
+        seconds, events = time_profile(paths, profile)
+        peak = memory_profile(paths, profile)
+        ms = seconds / len(paths) * 1e3
+        if profile == 'full':
+            full = ms
+        print("%-13s %8d %12.1f %12d %10.1f %10s" % (
+            profile, len(paths), ms, events // len(paths), peak / 2 ** 20,
+            '%.2fx' % (ms / full) if full else '-'))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Throughput of parse_replays per executor and worker count.
+
+    $ python -m replay_processing.benchmarks.parse_replays replays/ \
+        -M 200 --workers 1 2 4 8 16 32
+"""
+import argparse
+import logging
+import os
+import sys
+import time
+
+from replay_processing.sc2files import EXECUTORS, parse_replays
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("replay_path",
+                        help="Path to replay directory.",
+                        type=str)
+    parser.add_argument("-M", "--max_replays",
+                        help="Number of replays parsed per run.",
+                        type=int,
+                        default=200)
+    parser.add_argument("--workers",
+                        help="Worker counts to measure.",
+                        type=int,
+                        nargs='+',
+                        default=[1, 2, 4, 8])
+    parser.add_argument("--executors",
+                        help="Executors to measure.",
+                        choices=sorted(EXECUTORS),
+                        nargs='+',
+                        default=sorted(EXECUTORS))
+
+    return parser.parse_args(args)
+
+
+def run(replay_path, executor, workers, max_replays):
+    logger = logging.getLogger("replayParser.benchmark")
+    with open(os.devnull, 'w') as devnull:
+        start = time.perf_counter()
+        stats = parse_replays(replay_path, workers,
+                              logger=logger,
+                              max_replays=max_replays,
+                              outfile=devnull,
+                              executor=executor,
+                              stream=True)
+        elapsed = time.perf_counter() - start
+    return stats.count, elapsed
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+
+    print("%-8s %7s %8s %10s %12s %8s" % ('executor', 'workers', 'replays',
+                                          'seconds', 'replays/sec',
+                                          'speedup'))
+    for executor in args.executors:
+        baseline = None
+        for workers in args.workers:
+            count, elapsed = run(args.replay_path, executor, workers,
+                                 args.max_replays)
+            rate = count / elapsed if elapsed else 0
+            if baseline is None:
+                baseline = rate
+            print("%-8s %7d %8d %10.2f %12.2f %7.2fx" % (
+                executor, workers, count, elapsed, rate,
+                rate / baseline if baseline else 0))
+
+
+if __name__ == '__main__':
+    main()
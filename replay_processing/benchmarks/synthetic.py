@@ -0,0 +1,134 @@
+import random
+
+
+# Frames per second spawningtool uses for LotV build order times
+FRAMES_PER_SECOND = 22.4
+
+WORKERS = {
+    'Protoss': 'Probe',
+    'Terran': 'SCV',
+    'Zerg': 'Drone',
+}
+
+STRUCTURES = {
+    'Protoss': ['Pylon', 'Gateway', 'Assimilator', 'Nexus', 'CyberneticsCore',
+                'Forge', 'PhotonCannon', 'TwilightCouncil', 'Stargate',
+                'RoboticsFacility', 'RoboticsBay', 'FleetBeacon',
+                'TemplarArchive', 'DarkShrine', 'WarpGateResearch',
+                'Charge', 'Blink', 'ProtossGroundWeaponsLevel1'],
+    'Terran': ['SupplyDepot', 'Barracks', 'Refinery', 'OrbitalCommand',
+               'CommandCenter', 'Factory', 'Starport', 'EngineeringBay',
+               'BarracksReactor', 'FactoryTechLab', 'Armory', 'Bunker',
+               'Stimpack', 'ShieldWall', 'TerranInfantryWeaponsLevel1',
+               'TerranVehicleWeaponsLevel1', 'TerranShipWeaponsLevel1',
+               'TerranVehicleAndShipArmorsLevel1'],
+    'Zerg': ['Hatchery', 'Extractor', 'SpawningPool', 'Queen', 'Overlord',
+             'Lair', 'RoachWarren', 'BanelingNest', 'EvolutionChamber',
+             'HydraliskDen', 'Spire', 'InfestationPit', 'Hive',
+             'zerglingmovementspeed', 'GlialReconstitution',
+             'ZergMissileWeaponsLevel1'],
+}
+
+ARMY = {
+    'Protoss': ['Zealot', 'Stalker', 'Sentry', 'Adept', 'Immortal',
+                'Colossus', 'Observer', 'WarpPrism', 'Phoenix', 'VoidRay',
+                'Oracle', 'Carrier', 'Tempest', 'HighTemplar', 'Archon',
+                'DarkTemplar', 'Disruptor'],
+    'Terran': ['Marine', 'Marauder', 'Reaper', 'Hellion', 'WidowMine',
+               'SiegeTank', 'Cyclone', 'Thor', 'VikingFighter', 'Medivac',
+               'Liberator', 'Raven', 'Banshee', 'Battlecruiser', 'Ghost'],
+    'Zerg': ['Zergling', 'Roach', 'Baneling', 'Hydralisk', 'Mutalisk',
+             'Corruptor', 'Infestor', 'SwarmHost', 'Ultralisk', 'Viper',
+             'BroodLord', 'Overseer', 'Ravager', 'Lurker'],
+}
+
+MAPS = [
+    'Echo LE',
+    'Overgrowth LE',
+    'Whirlwind LE',
+    'Newkirk Precinct TE',
+    'Habitation Station LE',
+    'Daybreak LE',
+    'Vaani Research Station',
+    'Abyssal Reef LE (Void)',
+    u'回聲 - 天梯版',
+    u'密林濕地 - 天梯版',
+    u'旋風之境 - 天梯版',
+    u'紐科克管轄區 - 聯賽版',
+    u'殖民站 - 天梯版',
+    u'破曉黎明 - 天梯版',
+]
+
+REGIONS = ['us', 'eu', 'kr', 'cn']
+
+
+def _time(frame):
+    seconds = int(frame // FRAMES_PER_SECOND)
+    return '{0}:{1:02d}'.format(seconds // 60, seconds % 60)
+
+
+def build_order(rng, race, events, frames):
+    """A spawningtool-shaped buildOrder of events sorted by frame."""
+    worker = WORKERS[race]
+    structures = STRUCTURES[race]
+    army = ARMY[race]
+    # Ladder games are mostly workers and a handful of mass produced units
+    favourites = rng.sample(army, 3)
+
+    order = []
+    for frame in sorted(rng.randrange(frames) for _ in range(events)):
+        roll = rng.random()
+        if roll < 0.35:
+            name = worker
+        elif roll < 0.5:
+            name = rng.choice(structures)
+        elif roll < 0.85:
+            name = rng.choice(favourites)
+        else:
+            name = rng.choice(army)
+        order.append({
+            'frame': frame,
+            'time': _time(frame),
+            'name': name,
+            'supply': min(200, 12 + len(order) // 2),
+            'is_worker': name == worker,
+            'clock_position': None,
+            'is_chronoboosted': race == 'Protoss' and roll < 0.05,
+        })
+    return order
+
+
+def synthetic_result(rng, events_per_player=300):
+    """A parsed 1v1 replay dict shaped like spawningtool.parser output."""
+    seconds = rng.randrange(300, 1800)
+    frames = int(seconds * FRAMES_PER_SECOND)
+    winner = rng.choice([1, 2])
+    players = {}
+    for key in (1, 2):
+        race = rng.choice(sorted(WORKERS))
+        players[key] = {
+            'name': 'player%d' % rng.randrange(100000),
+            'pick_race': race,
+            'race': race,
+            'is_winner': key == winner,
+            'result': 'Win' if key == winner else 'Loss',
+            'is_human': True,
+            'buildOrder': build_order(rng, race, events_per_player, frames),
+        }
+    return {
+        'build': 39576,
+        'baseBuild': 39576,
+        'category': 'Ladder',
+        'expansion': 'LotV',
+        'unix_timestamp': 1480000000 + rng.randrange(10000000),
+        'frames': frames,
+        'game_type': '1v1',
+        'region': rng.choice(REGIONS),
+        'map': rng.choice(MAPS),
+        'players': players,
+    }
+
+
+def synthetic_results(count, events_per_player=300, seed=0):
+    rng = random.Random(seed)
+    return [synthetic_result(rng, events_per_player) for _ in range(count)]
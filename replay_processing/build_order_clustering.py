@@ -12,12 +12,25 @@ import numpy as np
 from sklearn.preprocessing import scale
 from sklearn.decomposition import PCA
 
-from sklearn.cluster import AffinityPropagation
+from sklearn.cluster import AffinityPropagation, MiniBatchKMeans
+from sklearn.metrics.pairwise import euclidean_distances
+
+from replay_processing.buildstore import BuildOrderStore, is_build_order_store
+from replay_processing.distance import (TIME_SCALE, EncodedBuilds,
+                                        affinity_matrix, center_affinities)
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError('%s is not at least 1' % value)
+    return number
+
 
 def parse_args(args):
     parser = argparse.ArgumentParser()
     parser.add_argument("csv_dir",
-                        help="Path to directory of build order csvs.",
+                        help="Path to directory of build order csvs, or "
+                             "to a packed build order store.",
                         type=str)
     parser.add_argument("output_path",
                         help="Path to json clustering output destination.",
@@ -26,6 +39,30 @@ def parse_args(args):
                         help="Seconds to stop considering data.",
                         type=int,
                         default=0)
+    parser.add_argument("--distance-file",
+                        help="Keep the affinity matrix in this memory "
+                             "mapped file instead of in memory.",
+                        type=str)
+    parser.add_argument("-j", "--jobs",
+                        help="Processes computing the affinity matrix, 1 "
+                             "computes it in this process.",
+                        type=int,
+                        default=1)
+    parser.add_argument("--algorithm",
+                        help="affinity-propagation clusters the full "
+                             "affinity matrix, minibatch-kmeans clusters "
+                             "fixed length build embeddings and scales to "
+                             "far more builds.",
+                        choices=sorted(CLUSTERING_ALGORITHMS),
+                        default='affinity-propagation')
+    parser.add_argument("--clusters",
+                        help="Number of clusters for minibatch-kmeans.",
+                        type=positive_int,
+                        default=50)
+    parser.add_argument("--batch-size",
+                        help="Builds per minibatch-kmeans step.",
+                        type=int,
+                        default=4096)
 
     return parser.parse_args(args)
 
@@ -114,33 +151,40 @@ class PlayerBuild(object):
         gamma = 0.5772156649
         return gamma + log(n) + 0.5 / n - 1. / (12 * n**2) + 1. / (120 * n**4)
 
-    def unit_events_affinity(self, my_events, other_events, pdb=False):
-        score = 0
+    def unit_events_affinity(self, my_events, other_events):
+        """Greedy nearest matching of two builds' events of one unit.
+
+        Each of my events, in time order, takes the closest other event
+        not taken yet, the earlier one on a tie. Both lists are time
+        sorted, so the untaken events before the other list's cursor are
+        a stack whose top is the closest one from below, and the cursor
+        is the closest one from above.
+        """
         max_score = max(len(my_events), len(other_events))
-        used_events = set()
-        for my_event in my_events:
-            closest = None
-            closest_dist = 0
-            for other_event in other_events:
-                if other_event in used_events:
-                    continue
-                if (closest is None or
-                    abs(closest.time - my_event.time) < closest_dist):
-                    closest = other_event
-                    closest_dist = abs(closest.time - my_event.time)
-                
-            if closest != None:
-                used_events.add(closest)
-                ev_score = 1 / max(1, closest_dist / 600)
-                if pdb and ev_score != 1:
-                    import pdb;pdb.set_trace()
-                score += ev_score
-
-        if max_score is 0:
+        if max_score == 0:
             return 0
 
-        if pdb and score / max_score != 1:
-            import pdb;pdb.set_trace()
+        other_times = sorted(ev.time for ev in other_events)
+        score = 0
+        cursor = 0
+        below = []
+        for my_time in sorted(ev.time for ev in my_events):
+            while (cursor < len(other_times) and
+                   other_times[cursor] <= my_time):
+                below.append(other_times[cursor])
+                cursor += 1
+            if below and (cursor == len(other_times) or
+                          my_time - below[-1] <=
+                          other_times[cursor] - my_time):
+                closest_dist = my_time - below.pop()
+            elif cursor < len(other_times):
+                closest_dist = other_times[cursor] - my_time
+                cursor += 1
+            else:
+                break
+
+            score += 1 / max(1, closest_dist / TIME_SCALE)
+
         return score / max_score
 
     def unit_type_ratios(self, other_build, unit_popularity):
@@ -161,11 +205,6 @@ class PlayerBuild(object):
             unit_score = self.unit_events_affinity(cur_events,
                                                    other_cur_events)
 
-            if other_build.map_id == self.map_id and self.map_player == other_build.map_player and unit_score != 0:
-                unit_score = self.unit_events_affinity(cur_events,
-                                                       other_cur_events,
-                                                       pdb=True)
-
             score += unit_score / weight
             max_score += 1 / weight
 
@@ -173,8 +212,6 @@ class PlayerBuild(object):
             return 0
 
         score = score / max_score
-        if score == 1 and self.map_id != other_build.map_id:
-            import pdb;pdb.set_trace
         return score
 
 
@@ -205,12 +242,24 @@ class PlayerBuilds(object):
         return counts
 
 
-def main():
-    args = parse_args(sys.argv[1:])
+def add_build_rows(builds, map_path, rows, time_cutoff, source):
+    # rows are (time, team, event_type, event_name) as gen_csv writes them
+    players = (builds.next_build(map_path, 0),
+               builds.next_build(map_path, 1))
+    for ev_ndx, row in enumerate(rows):
+        ev_time = int(row[0])
+        if ev_time > 0 and (time_cutoff == 0 or ev_time <= int(time_cutoff)):
+            try:
+                player = players[int(row[1]) - 1]
+            except (ValueError, IndexError):
+                print('Invalid row in %s' % source)
+            unit = Unit(row[2], row[3])
+            build_item = BuildItem(ev_ndx, ev_time, unit)
+            player.add_build_item(build_item)
 
-    builds = PlayerBuilds()
 
-    for path in glob.glob('%s/**/*.csv' % args.csv_dir, recursive=True):
+def load_csv_builds(csv_dir, builds, time_cutoff):
+    for path in glob.glob('%s/**/*.csv' % csv_dir, recursive=True):
         with open(path, newline='') as infile:
             csvfile = csv.reader(infile, delimiter=' ', quotechar='|')
             try:
@@ -219,48 +268,89 @@ def main():
             except StopIteration:
                 continue
             map_path = firstline.split('"', 1)[1][:-1]
-            players = (builds.next_build(map_path, 0),
-                       builds.next_build(map_path, 1))
-            for ev_ndx, row in enumerate(csvfile):
-                ev_time = int(row[0])
-                if ev_time > 0 and (args.time_cutoff == 0 or ev_time <= int(args.time_cutoff)):
-                    try:
-                        player = players[int(row[1]) - 1]
-                    except (ValueError, IndexError):
-                        print('Invalid row in %s' % path)
-                    unit = Unit(row[2], row[3])
-                    build_item = BuildItem(ev_ndx, ev_time, unit)
-                    player.add_build_item(build_item)
+            add_build_rows(builds, map_path, csvfile, time_cutoff, path)
 
-    unit_popularity = builds.unit_build_popularity_counts()
 
-    dist_matrix = np.empty(shape=(len(builds), len(builds)))
+def load_packed_builds(store_path, builds, time_cutoff):
+    # The events are memory mapped, only one replay's rows are decoded at
+    # a time
+    with BuildOrderStore(store_path) as store:
+        for replay in store:
+            add_build_rows(builds, replay, store.rows(replay), time_cutoff,
+                           replay)
 
-    # Distance from a->b == distance from b->a
-    distance_cache = {}
 
-    for player, build in builds.items():
-        for other_player, other_build in builds.items():
-            try:
-                dist = distance_cache[(build.player_id, other_build.player_id)]
-            except KeyError:
-                try:
-                    dist = distance_cache[(other_build.player_id,
-                                           build.player_id)]
-                except KeyError:
-                    dist = build.unit_type_ratios(other_build, unit_popularity)
-                    distance_cache[(build.player_id,
-                                    other_build.player_id)] = dist
-            dist_matrix.itemset((player, other_player), dist)
-
-    scaled_dist = dist_matrix
+def print_progress(done, total):
+    print('Affinity tiles %d/%d' % (done, total), file=sys.stderr)
+
+
+def cluster_affinity_propagation(builds, unit_popularity, args):
+    """Cluster labels, center build per label and affinity to it per build."""
+    dist_matrix = affinity_matrix(builds, unit_popularity,
+                                  path=args.distance_file, jobs=args.jobs,
+                                  progress=print_progress)
 
     ap = AffinityPropagation(affinity='precomputed',
                              damping=.5)
-    ap.fit(scaled_dist)
+    ap.fit(dist_matrix.square())
+
+    centers = ap.cluster_centers_indices_
+    affinities = [dist_matrix[i, centers[label]]
+                  for i, label in enumerate(ap.labels_)]
+    return ap.labels_, centers, affinities
+
+
+def cluster_minibatch_kmeans(builds, unit_popularity, args):
+    # The center of a cluster is the build closest to its centroid, the
+    # affinities are only computed between builds and their center
+    if not builds:
+        raise ValueError('No builds to cluster')
+    embeddings = EncodedBuilds(builds, unit_popularity).embeddings()
+    kmeans = MiniBatchKMeans(n_clusters=min(args.clusters, len(builds)),
+                             batch_size=args.batch_size, random_state=0,
+                             n_init=3)
+    labels = kmeans.fit_predict(embeddings)
+
+    centers = {}
+    affinities = np.zeros(len(builds))
+    for label in np.unique(labels):
+        members = np.nonzero(labels == label)[0]
+        centroid = kmeans.cluster_centers_[label][None, :]
+        center = members[np.argmin(
+            euclidean_distances(embeddings[members], centroid)[:, 0])]
+        centers[label] = center
+        affinities[members] = center_affinities(builds, unit_popularity,
+                                                center, members)
+    return labels, centers, affinities
+
+
+CLUSTERING_ALGORITHMS = {
+    'affinity-propagation': cluster_affinity_propagation,
+    'minibatch-kmeans': cluster_minibatch_kmeans,
+}
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+
+    builds = PlayerBuilds()
+
+    if is_build_order_store(args.csv_dir):
+        load_packed_builds(args.csv_dir, builds, args.time_cutoff)
+    else:
+        load_csv_builds(args.csv_dir, builds, args.time_cutoff)
+
+    if not len(builds):
+        sys.exit('No build orders found in %s' % args.csv_dir)
+
+    unit_popularity = builds.unit_build_popularity_counts()
+
+    labels, centers, affinities = CLUSTERING_ALGORITHMS[args.algorithm](
+        [builds.get_by_player_id(i) for i in range(len(builds))],
+        unit_popularity, args)
 
     builds_by_label = collections.defaultdict(list)
-    for i, label in enumerate(ap.labels_):
+    for i, label in enumerate(labels):
         builds_by_label[label].append(builds.get_by_player_id(i))
 
     with open(args.output_path, 'w') as fh:
@@ -268,14 +358,9 @@ def main():
         for label, _builds in builds_by_label.items():
             _builds_out = {}
             for _build in _builds:
-                center_build_id = ap.cluster_centers_indices_[label]
+                center_build_id = centers[label]
                 center_build = builds.get_by_player_id(center_build_id)
-                try:
-                    dist = distance_cache[(_build.player_id,
-                                           center_build.player_id)]
-                except KeyError:
-                    dist = distance_cache[(center_build.player_id,
-                                           _build.player_id)]
+                dist = float(affinities[_build.player_id])
                 _builds_out[_build.map_player_key] = { 'affinity': dist }
             labels_output[str(label)] = {
                 'builds': _builds_out,
@@ -309,14 +394,14 @@ def main():
 
 
     label_popularity = collections.defaultdict(int)
-    for label in ap.labels_:
+    for label in labels:
         label_popularity[label] += 1
     popular_labels = sorted(label_popularity.items(),
                             key=lambda x: x[1],
                             reverse=True)
 
     for label, popularity in popular_labels:
-        center_build_id = ap.cluster_centers_indices_[label]
+        center_build_id = centers[label]
         center_build = builds.get_by_player_id(center_build_id)
         print("Label ID %d with popularity %d" % (label, popularity))
         print("\tCenter build:")
@@ -334,12 +419,7 @@ def main():
         except KeyError:
             pass
         for build in label_builds:
-            try:
-                dist = distance_cache[(build.player_id,
-                                       center_build.player_id)]
-            except KeyError:
-                dist = distance_cache[(center_build.player_id,
-                                       build.player_id)]
+            dist = affinities[build.player_id]
             print("\t\tAffinity: %f Player ID: %d, Map %s" % (
                 dist, (build.map_player + 1), build.map_id)
             )
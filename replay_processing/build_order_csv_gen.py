@@ -1,11 +1,33 @@
 import argparse
+from concurrent.futures import ProcessPoolExecutor
+import collections
 import csv
-import glob
-import logging
+import hashlib
+import json
 import os
 import sys
 
 from replay_processing import model
+from replay_processing.buildstore import BuildOrderStore
+from replay_processing.pools import bounded_results
+from replay_processing.walk import iter_replay_files
+
+# gen_csv outcomes
+GENERATED = 'generated'
+TOO_SHORT = 'too_short'
+NOT_TWO_PLAYERS = 'non_2_player'
+FAILED = 'failed'
+# The output was up to date, gen_csv wasn't run
+SKIPPED = 'skipped'
+# Outcomes that leave no output to compare a replay's mtime with, so they
+# are kept in the manifest with either check
+REJECTED = (TOO_SHORT, NOT_TWO_PLAYERS)
+
+MIN_SECONDS = 600
+
+# Replay hashes and outcomes of earlier runs, in the output directory
+MANIFEST_FILE = '.build_order_manifest.json'
+
 
 def parse_args(args):
     parser = argparse.ArgumentParser()
@@ -13,120 +35,317 @@ def parse_args(args):
                         help="Path to replay directory.",
                         type=str)
     parser.add_argument("output_path",
-                        help="Path to directory to place csv files.",
+                        help="Path to directory to place csv files, or of "
+                             "the packed build order store.",
                         type=str)
+    parser.add_argument("-f", "--format",
+                        help="One csv per replay, or every build order in "
+                             "a single packed store.",
+                        choices=['csv', 'packed'],
+                        default='csv')
+    parser.add_argument("-w", "--workers",
+                        help="Worker processes, 1 runs everything in this "
+                             "process.",
+                        type=int,
+                        default=os.cpu_count() or 1)
+    parser.add_argument("--check",
+                        help="How to tell a csv is up to date: it is newer "
+                             "than its replay (mtime), or the replay's "
+                             "content hash matches the last run (hash).",
+                        choices=['mtime', 'hash'],
+                        default='mtime')
+    parser.add_argument("--force",
+                        help="Regenerate every csv.",
+                        action="store_true")
 
     return parser.parse_args(args)
 
 
+def output_csv_path(output_path, replay_path):
+    out_name = os.path.basename(replay_path).split('.', 1)[0]
+    return os.path.join(output_path, out_name[0],
+                        '.'.join((out_name, 'csv')))
+
+
+def file_hash(path):
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for block in iter(lambda: fh.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def load_manifest(output_path):
+    try:
+        with open(os.path.join(output_path, MANIFEST_FILE)) as fh:
+            return json.load(fh)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(output_path, manifest):
+    os.makedirs(output_path, exist_ok=True)
+    manifest_path = os.path.join(output_path, MANIFEST_FILE)
+    with open(manifest_path + '.tmp', 'w') as fh:
+        json.dump(manifest, fh)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+
+def up_to_date(replay_path, check, entry, output_mtime):
+    """Whether the last run's outcome for replay_path still holds.
+
+    output_mtime is when the replay's output was made, None without one.
+    A rejected replay has none, for it the mtime check compares the
+    replay's mtime to the one in its manifest entry. Returns the replay
+    hash as well when check is hash, so it can be recorded without reading
+    the replay again.
+    """
+    stat = os.stat(replay_path)
+    if check == 'mtime':
+        if entry is not None and entry['outcome'] in REJECTED:
+            return entry['stat'][1] == stat.st_mtime, None
+        return output_mtime is not None and output_mtime >= stat.st_mtime, None
+
+    if entry is not None and entry['outcome'] == GENERATED and \
+            output_mtime is None:
+        entry = None
+    # Unchanged size and mtime are taken as unchanged content
+    if entry is not None and [stat.st_size, stat.st_mtime] == entry['stat']:
+        return True, entry['hash']
+    digest = file_hash(replay_path)
+    return entry is not None and entry['hash'] == digest, digest
+
+
+def gen_job(replay_path, out_path):
+    # Returns the rows to append to the packed store when out_path is None
+    try:
+        if out_path is None:
+            return (replay_path, ) + gen_rows(replay_path)
+        return replay_path, gen_csv(replay_path, out_path), None
+    except model.ReplayParseError as e:
+        print('Replay parse error: %s' % e)
+        return replay_path, FAILED, None
+    except Exception as e:
+        # Whatever else sc2reader or the file system raise fails this
+        # replay alone, not the whole run
+        print('Unable to generate a build order of %s: %r' % (replay_path, e))
+        return replay_path, FAILED, None
+
+
 def main():
     args = parse_args(sys.argv[1:])
-    replays = glob.glob('%s/**/*.SC2Replay' % args.replay_path,
-                        recursive=True)
-    for path in replays:
-        out_name = os.path.basename(path).split('.', 1)[0]
-        out_dir = os.path.join(args.output_path, out_name[0])
+    manifest = load_manifest(args.output_path)
+    store = None
+    if args.format == 'packed':
+        # Only this process writes the store, workers hand back rows
+        store = BuildOrderStore(args.output_path, mode='a')
+    outcomes = collections.Counter()
+    hashes = {}
+    out_dirs = set()
+
+    def output_mtime(path, out_path):
+        if store is not None:
+            # The replay's mtime when it was packed
+            return store.index.get(path, {}).get('mtime')
         try:
-            os.mkdir(out_dir)
+            return os.path.getmtime(out_path)
         except OSError:
-            pass
-        out_path = os.path.join(out_dir, '.'.join((out_name, 'csv')))
-        try:
-            gen_csv(path, out_path)
-        except model.ReplayParseError as e:
-            print('Replay parse error: %s' % e)
-            continue
-
+            return None
 
-def gen_csv(replay_path, output_path):
-    ignore_units = set([
-        'AdeptPhaseShift',
-        'AutoTurret',
-        'BroodlingEscort',
-        'CreepTumorBurrowed',
-        'CreepTumorQueen',
-        'DisruptorPhased',
-        'Egg',
-        'ForceField',
-        'InfestedTerransEgg',
-        'KD8Charge',
-        'Larva',
-        'LiberatorAG',
-        'LocustMPPrecursor',
-        'LocustMPFlying',
-        'LurkerBurrowed',
-        'LurkerEgg',
-        'MULE',
-        'OracleStasisTrap',
-        'Overlord',
-        'OverlordTransport',
-        'ParasiticBombDummy',
-        'PointDefenseDrone',
-        'Pylon',
-        'PylonOvercharged',
-        'RavagerBurrowed',
-        'RavagerCocoon',
-        'SprayProtoss',
-        'SprayTerran',
-        'SprayZerg',
-        'SupplyDepotLowered',
-        'ThorAP',
-        'TransportOverlordCocoon'
-    ])
-
-    with open(output_path, 'w', newline='') as csvfile:
-        csvwriter = csv.writer(csvfile, delimiter=' ',
-                               quotechar='|', quoting=csv.QUOTE_MINIMAL)
-
-        replay = model.Replay(replay_path)
+    def jobs():
+        for path in iter_replay_files(args.replay_path):
+            out_path = None
+            if store is None:
+                out_path = output_csv_path(args.output_path, path)
+            if not args.force:
+                fresh, digest = up_to_date(path, args.check,
+                                           manifest.get(path),
+                                           output_mtime(path, out_path))
+                if fresh:
+                    outcomes[SKIPPED] += 1
+                    continue
+                hashes[path] = digest
+            if out_path is not None:
+                out_dir = os.path.dirname(out_path)
+                if out_dir not in out_dirs:
+                    os.makedirs(out_dir, exist_ok=True)
+                    out_dirs.add(out_dir)
+            yield path, out_path
 
-        try:
-            if replay.seconds < 600:
-                print("Replay too short (under 600 seconds): %s" % replay_path)
-                return
-        except model.ReplayParseError as e:
-            print(e)
+    def record(path, outcome, rows):
+        outcomes[outcome] += 1
+        if outcome == FAILED:
             return
+        stat = os.stat(path)
+        if rows is not None:
+            store.append(path, rows, mtime=stat.st_mtime)
+        if args.check == 'hash':
+            manifest[path] = {
+                'hash': hashes.get(path) or file_hash(path),
+                'stat': [stat.st_size, stat.st_mtime],
+                'outcome': outcome,
+            }
+        elif outcome in REJECTED:
+            # Hashed by the first hash check that needs it
+            manifest[path] = {
+                'hash': None,
+                'stat': [stat.st_size, stat.st_mtime],
+                'outcome': outcome,
+            }
+        else:
+            manifest.pop(path, None)
 
-        if len(replay.players) != 2:
-            print("Non 2 player game %s" % replay_path)
-            return
+    try:
+        if args.workers <= 1:
+            for path, out_path in jobs():
+                record(*gen_job(path, out_path))
+        else:
+            with ProcessPoolExecutor(max_workers=args.workers) as pool:
+                for result in bounded_results(
+                        lambda job: pool.submit(gen_job, *job), jobs(),
+                        args.workers * 2):
+                    record(*result)
+    finally:
+        save_manifest(args.output_path, manifest)
+        if store is not None:
+            store.close()
 
-        csvfile.write('# generated from replay file "%s"\n' % replay_path)
-        csvwriter.writerow(('time', 'team', 'event_type', 'event_name'))
-        events = list(replay.events)
-        for unit_event in model.unit_events(events):
-            if unit_event.unit.title in ignore_units or unit_event.unit.is_worker:
-                continue
-            time = unit_event.second
-            team = unit_event.unit.owner.team_id
+    print('Generated %d, skipped %d, too short %d, non 2 player %d, '
+          'failed %d' % (outcomes[GENERATED], outcomes[SKIPPED],
+                         outcomes[TOO_SHORT], outcomes[NOT_TWO_PLAYERS],
+                         outcomes[FAILED]))
+
+
+IGNORE_UNITS = set([
+    'AdeptPhaseShift',
+    'AutoTurret',
+    'BroodlingEscort',
+    'CreepTumorBurrowed',
+    'CreepTumorQueen',
+    'DisruptorPhased',
+    'Egg',
+    'ForceField',
+    'InfestedTerransEgg',
+    'KD8Charge',
+    'Larva',
+    'LiberatorAG',
+    'LocustMPPrecursor',
+    'LocustMPFlying',
+    'LurkerBurrowed',
+    'LurkerEgg',
+    'MULE',
+    'OracleStasisTrap',
+    'Overlord',
+    'OverlordTransport',
+    'ParasiticBombDummy',
+    'PointDefenseDrone',
+    'Pylon',
+    'PylonOvercharged',
+    'RavagerBurrowed',
+    'RavagerCocoon',
+    'SprayProtoss',
+    'SprayTerran',
+    'SprayZerg',
+    'SupplyDepotLowered',
+    'ThorAP',
+    'TransportOverlordCocoon'
+])
+
+
+def check_replay(replay_path):
+    """Outcome of a replay that gets no build order, None for the rest."""
+    # Reject from the header alone before loading any events
+    try:
+        header = model.load_header(replay_path)
+    except model.ReplayParseError as e:
+        print(e)
+        return FAILED
+
+    if header.seconds < MIN_SECONDS:
+        print("Replay too short (under %d seconds): %s" % (MIN_SECONDS,
+                                                             replay_path))
+        return TOO_SHORT
+
+    if header.num_players != 2:
+        print("Non 2 player game %s" % replay_path)
+        return NOT_TWO_PLAYERS
+
+    return None
+
+
+def build_order_rows(replay_path):
+    """Yield the (time, team, event_type, event_name) rows of a replay."""
+    # Unit and upgrade events are all in the tracker events
+    replay = model.Replay(replay_path, profile='tracker_only')
+    events = replay.event_index
+    for unit_event in model.unit_events(events):
+        if unit_event.unit.title in IGNORE_UNITS or unit_event.unit.is_worker:
+            continue
+        time = unit_event.second
+        team = unit_event.unit.owner.team_id
+        try:
+            ev_type = model.unit_to_type_string(unit_event.unit)
+        except ValueError:
             try:
-                ev_type = model.unit_to_type_string(unit_event.unit)
-            except ValueError:
-                try:
-                    if (unit_event.unit.title in ignore_units or
-                        unit_event.unit.title.startswith('Changeling') or
-                        unit_event.unit.title.startswith('Shape')):
-                        continue
-                    else:
-                        import pdb;pdb.set_trace()
-                except AttributeError:
+                if (unit_event.unit.title in IGNORE_UNITS or
+                    unit_event.unit.title.startswith('Changeling') or
+                    unit_event.unit.title.startswith('Shape')):
+                    continue
+                else:
+                    # Can't stop at a debugger inside a worker process
+                    print("Unknown unit type %s in %s" % (
+                        unit_event.unit.title, replay_path))
                     continue
-            ev_name = unit_event.unit.title
+            except AttributeError:
+                continue
+        ev_name = unit_event.unit.title
 
-            csvwriter.writerow((time, team, ev_type, ev_name))
+        yield time, team, ev_type, ev_name
+
+    upgrade_events = model.events_by_type(events, ('UpgradeCompleteEvent', ))
+    for upgrade_event in upgrade_events:
+        if upgrade_event.upgrade_type_name in IGNORE_UNITS:
+            continue
+        time = upgrade_event.second
+        team = upgrade_event.player.team_id
+        ev_type = 'upgrade'
+        ev_name = upgrade_event.upgrade_type_name
+
+        yield time, team, ev_type, ev_name
+
+
+def gen_csv(replay_path, output_path):
+    outcome = check_replay(replay_path)
+    if outcome is not None:
+        return outcome
+
+    # Written aside and renamed, so a killed run never leaves a partial csv
+    # that looks up to date
+    tmp_path = output_path + '.tmp'
+    try:
+        with open(tmp_path, 'w', newline='') as csvfile:
+            csvwriter = csv.writer(csvfile, delimiter=' ',
+                                   quotechar='|', quoting=csv.QUOTE_MINIMAL)
+            csvfile.write('# generated from replay file "%s"\n' % replay_path)
+            csvwriter.writerow(('time', 'team', 'event_type', 'event_name'))
+            csvwriter.writerows(build_order_rows(replay_path))
+        os.replace(tmp_path, output_path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+    return GENERATED
 
-        upgrade_events = model.events_by_type(events,
-                                              ('UpgradeCompleteEvent', ))
-        for upgrade_event in upgrade_events:
-            if upgrade_event.upgrade_type_name in ignore_units:
-                continue
-            time = upgrade_event.second
-            team = upgrade_event.player.team_id
-            ev_type = 'upgrade'
-            ev_name = upgrade_event.upgrade_type_name
 
-            csvwriter.writerow((time, team, ev_type, ev_name))
+def gen_rows(replay_path):
+    """gen_csv for a packed store: the outcome and the rows to append."""
+    outcome = check_replay(replay_path)
+    if outcome is not None:
+        return outcome, None
+    return GENERATED, list(build_order_rows(replay_path))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,183 @@
+import io
+import json
+import os
+
+import numpy as np
+
+
+EVENTS_FILE = 'events.bin'
+NAMES_FILE = 'names.jsonl'
+INDEX_FILE = 'index.jsonl'
+
+# One build order event, the same columns as a build-order-csv-gen csv.
+# event_type and event_name are codes into the store's interned names.
+EVENT_DTYPE = np.dtype([('time', '<i4'),
+                        ('team', '<i2'),
+                        ('event_type', '<i2'),
+                        ('event_name', '<i4')])
+
+
+def is_build_order_store(path):
+    return os.path.isfile(os.path.join(path, INDEX_FILE))
+
+
+class BuildOrderStore(object):
+    """Build orders of many replays packed in one directory.
+
+    events.bin holds the events of every replay back to back as
+    EVENT_DTYPE records. names.jsonl is the interned unit, upgrade and
+    event type names, one per line in code order. index.jsonl has a line
+    per replay with the offset and count of its events.
+
+    All three files are append only. A replay's index line is written
+    last, so a killed writer at worst leaves a torn last line and events
+    nothing points at, which the next writer cuts off. A corrupt line
+    elsewhere only loses its own replay, or name. Appending a replay again
+    makes the newer record the one the index points at.
+    """
+
+    def __init__(self, path, mode='r'):
+        self.path = path
+        self.mode = mode
+        self.names = []
+        self.index = {}
+        self._codes = {}
+        self.events = None
+        self._events_fh = None
+        self._names_fh = None
+        self._index_fh = None
+        if mode == 'a':
+            os.makedirs(path, exist_ok=True)
+            # Before reading, so a torn last line isn't read
+            self._names_fh = self._open_lines(NAMES_FILE)
+            self._index_fh = self._open_lines(INDEX_FILE)
+        self._read_names()
+        self._read_index()
+        if mode == 'a':
+            self._open_events()
+        else:
+            self._map_events()
+
+    def _lines(self, name):
+        # Lines that aren't valid json, e.g. torn by a killed writer, are
+        # None, so line numbers stay what they were
+        try:
+            with open(os.path.join(self.path, name), 'rb') as fh:
+                for line in fh:
+                    try:
+                        yield json.loads(line.decode('utf-8'))
+                    except ValueError:
+                        yield None
+        except FileNotFoundError:
+            return
+
+    def _read_names(self):
+        # A name's code is its line number, a corrupt line keeps its code
+        for name in self._lines(NAMES_FILE):
+            if name is not None:
+                self._codes[name] = len(self.names)
+            self.names.append(name)
+
+    def _read_index(self):
+        self._end = 0
+        for entry in self._lines(INDEX_FILE):
+            try:
+                end = entry['offset'] + entry['count']
+                replay = entry['replay']
+            except (TypeError, KeyError):
+                continue
+            self.index[replay] = entry
+            self._end = max(self._end, end)
+
+    def _map_events(self):
+        events_path = os.path.join(self.path, EVENTS_FILE)
+        if self._end:
+            self.events = np.memmap(events_path, dtype=EVENT_DTYPE, mode='r',
+                                    shape=(self._end, ))
+        else:
+            self.events = np.empty(0, dtype=EVENT_DTYPE)
+
+    def _open_events(self):
+        events_path = os.path.join(self.path, EVENTS_FILE)
+        self._events_fh = open(events_path, 'ab')
+        # Drop events a killed writer left behind the last replay any
+        # index line points at
+        self._events_fh.truncate(self._end * EVENT_DTYPE.itemsize)
+
+    def _open_lines(self, name):
+        # Cut a torn last line so new lines don't continue it
+        fh = open(os.path.join(self.path, name), 'a+b')
+        fh.seek(0, os.SEEK_END)
+        size = fh.tell()
+        keep = size
+        while keep > 0:
+            fh.seek(max(0, keep - 4096))
+            chunk = fh.read(keep - max(0, keep - 4096))
+            newline = chunk.rfind(b'\n')
+            if newline != -1:
+                keep = keep - len(chunk) + newline + 1
+                break
+            keep -= len(chunk)
+        if keep != size:
+            fh.truncate(keep)
+        fh.seek(0, os.SEEK_END)
+        return io.TextIOWrapper(fh, encoding='utf-8')
+
+    def close(self):
+        for fh in (self._events_fh, self._names_fh, self._index_fh):
+            if fh is not None:
+                fh.close()
+        self._events_fh = self._names_fh = self._index_fh = None
+        self.events = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, replay):
+        return replay in self.index
+
+    def code(self, name):
+        code = self._codes.get(name)
+        if code is None:
+            code = self._codes[name] = len(self.names)
+            self.names.append(name)
+            self._names_fh.write(json.dumps(name) + '\n')
+        return code
+
+    def append(self, replay, rows, **info):
+        """Add the (time, team, event_type, event_name) rows of a replay.
+
+        info, e.g. the replay's size and mtime, is kept in its index entry.
+        """
+        events = np.array([(time, team, self.code(ev_type), self.code(name))
+                           for time, team, ev_type, name in rows],
+                          dtype=EVENT_DTYPE)
+        events.tofile(self._events_fh)
+        entry = dict(info, replay=replay, offset=self._end, count=len(events))
+        self._end += len(events)
+        # Everything the index line points at has to be on disk first
+        self._events_fh.flush()
+        self._names_fh.flush()
+        self._index_fh.write(json.dumps(entry) + '\n')
+        self._index_fh.flush()
+        self.index[replay] = entry
+
+    def replay_events(self, replay):
+        entry = self.index[replay]
+        return self.events[entry['offset']:entry['offset'] + entry['count']]
+
+    def rows(self, replay):
+        """The events of a replay as (time, team, event_type, event_name)."""
+        names = self.names
+        return [(int(time), int(team), names[ev_type], names[name])
+                for time, team, ev_type, name in
+                self.replay_events(replay).tolist()]
+
+    def __iter__(self):
+        return iter(self.index)
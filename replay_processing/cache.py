@@ -0,0 +1,134 @@
+from importlib import metadata
+import functools
+import hashlib
+import logging
+import os
+import pickle
+import tempfile
+
+from replay_processing import maps
+from replay_processing import sc2scan
+
+
+# Bump whenever the shape of the cached worker results changes so stale
+# entries stop matching instead of being served back.
+CACHE_FORMAT_VERSION = 4
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'replay_processing')
+DEFAULT_CACHE_SIZE = 1024 * 1024 * 1024
+
+
+def package_version(name):
+    try:
+        return metadata.version(name)
+    except metadata.PackageNotFoundError:
+        return 'unknown'
+
+
+def file_digest(path):
+    with open(path, 'rb') as fh:
+        return hashlib.sha1(fh.read()).hexdigest()
+
+
+@functools.lru_cache(maxsize=None)
+def _version_salt():
+    # Everything besides the replay that decides what a worker returns:
+    # the parsers, the feature extraction and the map table
+    features = ','.join(cls.__name__ for cls in sc2scan.FEATURES)
+    return ';'.join((str(CACHE_FORMAT_VERSION),
+                     package_version('spawningtool'),
+                     package_version('sc2reader'),
+                     str(sc2scan.FEATURES_VERSION),
+                     features,
+                     file_digest(maps.DEFAULT_TABLE))).encode('utf-8')
+
+
+def content_key(content, salt=''):
+    digest = hashlib.sha1(content)
+    digest.update(_version_salt())
+    digest.update(salt.encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ReplayCache(object):
+    """On-disk cache of worker results keyed by replay content.
+
+    Entries are single pickle files sharded by the first two characters of
+    their key. Reading an entry bumps its mtime, so prune() can evict the
+    least recently used entries once the cache grows past max_bytes.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_DIR, max_bytes=DEFAULT_CACHE_SIZE):
+        self.path = path
+        self.max_bytes = max_bytes
+
+    def _entry_path(self, key):
+        return os.path.join(self.path, key[:2], key + '.pickle')
+
+    def get(self, key):
+        entry_path = self._entry_path(key)
+        try:
+            with open(entry_path, 'rb') as fh:
+                value = pickle.load(fh)
+        except FileNotFoundError:
+            return None
+        except (OSError, EOFError, pickle.UnpicklingError, AttributeError,
+                ImportError):
+            # Truncated or unreadable entries are treated as misses and
+            # overwritten by the next put
+            return None
+        try:
+            os.utime(entry_path)
+        except OSError:
+            pass
+        return value
+
+    def put(self, key, value):
+        entry_path = self._entry_path(key)
+        entry_dir = os.path.dirname(entry_path)
+        os.makedirs(entry_dir, exist_ok=True)
+        # Write then rename so concurrent workers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=entry_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as fh:
+                pickle.dump(value, fh, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, entry_path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    def _entries(self):
+        try:
+            shards = list(os.scandir(self.path))
+        except FileNotFoundError:
+            return
+        for shard in shards:
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if entry.name.endswith('.pickle'):
+                    stat = entry.stat()
+                    yield stat.st_mtime, stat.st_size, entry.path
+
+    def prune(self, logger=logging.getLogger("replayParser")):
+        entries = list(self._entries())
+        total = sum(size for _, size, _ in entries)
+        if total <= self.max_bytes:
+            return 0
+
+        evicted = 0
+        for _, size, entry_path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(entry_path)
+            except OSError:
+                continue
+            total -= size
+            evicted += 1
+        logger.debug("Evicted %d cache entries from %s", evicted, self.path)
+        return evicted
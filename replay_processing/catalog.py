@@ -0,0 +1,330 @@
+"""Replay catalog, the facts of every replay in a SQLite index.
+
+    $ replay-index replays/
+    $ replay-index replays/ --matchup PvZ --map Echo --min-seconds 600
+
+Only replays that are new or changed since the last run are read, so
+reindexing a growing archive is cheap. Queries never parse a replay.
+"""
+import argparse
+import collections
+import hashlib
+import io
+import logging
+import os
+import sqlite3
+import sys
+import time
+
+import sc2reader
+
+from replay_processing import model
+from replay_processing.maps import default_table
+from replay_processing.walk import iter_replay_files
+
+
+DEFAULT_CATALOG = os.path.join(os.path.expanduser('~'), '.cache',
+                               'replay_processing', 'catalog.sqlite')
+
+# Bump when the tables change, older catalogs are rebuilt from scratch
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS replays (
+    path TEXT PRIMARY KEY,
+    content_hash TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    map TEXT,
+    map_name TEXT,
+    game_type TEXT,
+    num_players INTEGER,
+    matchup TEXT,
+    seconds INTEGER,
+    build INTEGER,
+    base_build INTEGER,
+    region TEXT,
+    unix_timestamp INTEGER
+);
+CREATE INDEX IF NOT EXISTS replays_hash ON replays (content_hash);
+CREATE INDEX IF NOT EXISTS replays_matchup_map ON replays (matchup, map);
+CREATE INDEX IF NOT EXISTS replays_seconds ON replays (seconds);
+CREATE TABLE IF NOT EXISTS players (
+    path TEXT NOT NULL REFERENCES replays (path) ON DELETE CASCADE,
+    pid INTEGER NOT NULL,
+    name TEXT,
+    race TEXT,
+    result TEXT,
+    PRIMARY KEY (path, pid)
+);
+CREATE INDEX IF NOT EXISTS players_name ON players (name);
+"""
+
+REPLAY_COLUMNS = ['path', 'content_hash', 'size', 'mtime', 'map', 'map_name',
+                  'game_type', 'num_players', 'matchup', 'seconds', 'build',
+                  'base_build', 'region', 'unix_timestamp']
+
+CatalogEntry = collections.namedtuple('CatalogEntry', REPLAY_COLUMNS)
+
+CatalogPlayer = collections.namedtuple('CatalogPlayer', ['pid', 'name',
+                                                         'race', 'result'])
+
+# What an update did. duplicate replays had their content indexed under
+# another path already and weren't parsed again.
+UpdateStats = collections.namedtuple('UpdateStats', ['unchanged', 'indexed',
+                                                     'duplicate', 'failed',
+                                                     'removed'])
+
+
+def matchup(races):
+    # The same "PvZ" form as sc2files.classify_matchup
+    return "v".join(race[0] for race in sorted(races) if race)
+
+
+def content_hash(content):
+    return hashlib.sha1(content).hexdigest()
+
+
+def read_replay_facts(path, content):
+    """The catalog row values and players of one replay, from its bytes."""
+    profile = model.LOAD_PROFILES['metadata']
+    try:
+        replay = sc2reader.load_replay(io.BytesIO(content),
+                                       load_level=profile.load_level,
+                                       engine=profile.engine)
+        players = [CatalogPlayer(player.pid, player.name, player.play_race,
+                                 player.result)
+                   for player in replay.players]
+        facts = {
+            'map': default_table().canonical(replay.map_name),
+            'map_name': replay.map_name,
+            'game_type': replay.real_type,
+            'num_players': len(players),
+            'matchup': matchup([player.race for player in players]),
+            'seconds': replay.real_length.seconds,
+            'build': replay.build,
+            'base_build': replay.base_build,
+            'region': replay.region,
+            'unix_timestamp': replay.unix_timestamp,
+        }
+    except (sc2reader.exceptions.SC2ReaderError, IndexError, AttributeError,
+            KeyError, TypeError) as e:
+        raise model.ReplayParseError(path, e)
+    return facts, players
+
+
+class ReplayCatalog(object):
+    """SQLite index of replay facts keyed by path and content hash.
+
+    update() brings the index in line with a replay directory. query()
+    selects replays by those facts without touching the replay files.
+    """
+
+    def __init__(self, path=DEFAULT_CATALOG):
+        self.path = path
+        if path != ':memory:':
+            os.makedirs(os.path.dirname(os.path.abspath(path)),
+                        exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.execute('PRAGMA foreign_keys = ON')
+        version = self.db.execute('PRAGMA user_version').fetchone()[0]
+        if version != SCHEMA_VERSION:
+            self.db.executescript('DROP TABLE IF EXISTS players;'
+                                  'DROP TABLE IF EXISTS replays;')
+        self.db.executescript(SCHEMA)
+        self.db.execute('PRAGMA user_version = %d' % SCHEMA_VERSION)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __len__(self):
+        return self.db.execute('SELECT COUNT(*) FROM replays').fetchone()[0]
+
+    def _stored(self, root_dir):
+        prefix = os.path.join(root_dir, '')
+        rows = self.db.execute(
+            'SELECT path, size, mtime FROM replays '
+            'WHERE substr(path, 1, ?) = ?', (len(prefix), prefix))
+        return {path: (size, mtime) for path, size, mtime in rows}
+
+    def _insert(self, path, digest, stat, facts, players):
+        values = dict(facts, path=path, content_hash=digest,
+                      size=stat.st_size, mtime=stat.st_mtime)
+        self.db.execute('DELETE FROM replays WHERE path = ?', (path, ))
+        self.db.execute(
+            'INSERT INTO replays (%s) VALUES (%s)' % (
+                ', '.join(REPLAY_COLUMNS), ', '.join('?' * len(REPLAY_COLUMNS))),
+            [values[column] for column in REPLAY_COLUMNS])
+        self.db.executemany(
+            'INSERT INTO players (path, pid, name, race, result) '
+            'VALUES (?, ?, ?, ?, ?)',
+            [(path, ) + tuple(player) for player in players])
+
+    def _copy(self, digest):
+        # Facts of a replay already indexed under another path
+        row = self.db.execute('SELECT %s FROM replays WHERE content_hash = ? '
+                              'LIMIT 1' % ', '.join(REPLAY_COLUMNS),
+                              (digest, )).fetchone()
+        if row is None:
+            return None
+        entry = CatalogEntry(*row)
+        facts = {column: getattr(entry, column) for column in REPLAY_COLUMNS}
+        return facts, self.players(entry.path)
+
+    def update(self, root_dir, logger=logging.getLogger("replayParser"),
+               commit_every=500):
+        """Index the new and changed replays under root_dir.
+
+        A replay is only read when its size or mtime changed, and only
+        parsed when its content hash isn't in the catalog already. Rows of
+        replays that are gone from root_dir are dropped.
+        """
+        root_dir = os.path.abspath(root_dir)
+        stored = self._stored(root_dir)
+        counts = collections.Counter()
+        pending = 0
+        for path in iter_replay_files(root_dir):
+            try:
+                stat = os.stat(path)
+            except OSError:
+                counts['failed'] += 1
+                continue
+            known = stored.pop(path, None)
+            if known == (stat.st_size, stat.st_mtime):
+                counts['unchanged'] += 1
+                continue
+
+            try:
+                with open(path, 'rb') as fh:
+                    content = fh.read()
+            except OSError:
+                counts['failed'] += 1
+                continue
+            digest = content_hash(content)
+            copied = self._copy(digest)
+            if copied is not None:
+                facts, players = copied
+                counts['duplicate'] += 1
+            else:
+                try:
+                    facts, players = read_replay_facts(path, content)
+                except model.ReplayParseError as e:
+                    logger.warning("Unable to index {0}: {1}".format(
+                        path, e.exc))
+                    counts['failed'] += 1
+                    continue
+                counts['indexed'] += 1
+            self._insert(path, digest, stat, facts, players)
+
+            pending += 1
+            if pending >= commit_every:
+                # A killed run keeps everything indexed up to here
+                self.db.commit()
+                pending = 0
+
+        self.db.executemany('DELETE FROM replays WHERE path = ?',
+                            [(path, ) for path in stored])
+        self.db.commit()
+        return UpdateStats(counts['unchanged'], counts['indexed'],
+                           counts['duplicate'], counts['failed'], len(stored))
+
+    def query(self, root_dir=None, matchup=None, map=None, min_seconds=None,
+              max_seconds=None, region=None, player=None, game_type=None,
+              min_timestamp=None, max_timestamp=None):
+        """CatalogEntries of the replays matching every given filter."""
+        where = []
+        params = []
+        if root_dir is not None:
+            prefix = os.path.join(os.path.abspath(root_dir), '')
+            where.append('substr(path, 1, ?) = ?')
+            params.extend((len(prefix), prefix))
+        for column, value in (('matchup', matchup), ('map', map),
+                              ('region', region), ('game_type', game_type)):
+            if value is not None:
+                where.append('%s = ?' % column)
+                params.append(value)
+        for column, op, value in (('seconds', '>=', min_seconds),
+                                  ('seconds', '<=', max_seconds),
+                                  ('unix_timestamp', '>=', min_timestamp),
+                                  ('unix_timestamp', '<=', max_timestamp)):
+            if value is not None:
+                where.append('%s %s ?' % (column, op))
+                params.append(value)
+        if player is not None:
+            where.append('path IN (SELECT path FROM players WHERE name = ?)')
+            params.append(player)
+
+        sql = 'SELECT %s FROM replays' % ', '.join(REPLAY_COLUMNS)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(where)
+        sql += ' ORDER BY path'
+        return [CatalogEntry(*row) for row in self.db.execute(sql, params)]
+
+    def players(self, path):
+        return [CatalogPlayer(*row) for row in self.db.execute(
+            'SELECT pid, name, race, result FROM players WHERE path = ? '
+            'ORDER BY pid', (path, ))]
+
+
+def parse_args(args):
+    parser = argparse.ArgumentParser()
+    parser.add_argument("replay_path",
+                        help="Path to replay directory.",
+                        type=str)
+    parser.add_argument("--catalog",
+                        help="Catalog file.",
+                        type=str,
+                        default=DEFAULT_CATALOG)
+    parser.add_argument("--no-update",
+                        help="Query the catalog as it is, without indexing.",
+                        action="store_true")
+    parser.add_argument("--matchup",
+                        help="Only list replays of this matchup, e.g. PvZ.",
+                        type=str)
+    parser.add_argument("--map",
+                        help="Only list replays on this (canonical) map.",
+                        type=str)
+    parser.add_argument("--min-seconds",
+                        help="Only list replays at least this long.",
+                        type=int)
+    parser.add_argument("--max-seconds",
+                        help="Only list replays at most this long.",
+                        type=int)
+    parser.add_argument("--region",
+                        help="Only list replays from this region.",
+                        type=str)
+    parser.add_argument("--player",
+                        help="Only list replays with this player.",
+                        type=str)
+
+    return parser.parse_args(args)
+
+
+def main():
+    args = parse_args(sys.argv[1:])
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    logger = logging.getLogger("replayParser")
+
+    catalog = ReplayCatalog(args.catalog)
+    try:
+        if not args.no_update:
+            start = time.perf_counter()
+            stats = catalog.update(args.replay_path, logger)
+            logger.info("Indexed in %.1fs: %d unchanged, %d indexed, "
+                        "%d duplicate, %d failed, %d removed",
+                        time.perf_counter() - start, *stats)
+
+        filters = dict(matchup=args.matchup, map=args.map,
+                       min_seconds=args.min_seconds,
+                       max_seconds=args.max_seconds, region=args.region,
+                       player=args.player)
+        if any(value is not None for value in filters.values()):
+            for entry in catalog.query(args.replay_path, **filters):
+                print(entry.path)
+    finally:
+        catalog.close()
+
+
+if __name__ == '__main__':
+    main()
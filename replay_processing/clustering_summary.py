@@ -12,6 +12,10 @@ def parse_args(args):
     parser.add_argument("clustering_name",
                         help="Name of clustering sample",
                         type=str)
+    parser.add_argument("--write-compact",
+                        help="Also save the clustering in the compact .npz "
+                             "form, which later runs load instead.",
+                        action="store_true")
 
     return parser.parse_args(args)
 
@@ -20,6 +24,8 @@ def main():
     args = parse_args(sys.argv[1:])
 
     cluster_dir = model.ClusteringDataDir(args.clustering_dir)
+    if args.write_compact:
+        cluster_dir.write_compact(args.clustering_name)
     clustering = cluster_dir.clustering_data(args.clustering_name)
     labels = clustering.labels
 
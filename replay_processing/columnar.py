@@ -0,0 +1,272 @@
+import json
+import os
+import re
+
+import numpy as np
+
+from replay_processing.writer import WriterStage
+
+
+SCHEMA_FILE = 'schema.json'
+SCHEMA_VERSION = 2
+# Version 1 had no text columns, it reads the same otherwise
+READABLE_VERSIONS = (1, 2)
+
+# Null marker for every column kind but float, which uses NaN
+NULL = -1
+
+# Storage kind and numpy dtype of every replayscan column. Strings with few
+# distinct values are dictionary encoded, the column holds int32 codes
+# into the dictionary. Near unique strings are text: the column holds the
+# int64 end offset of each row's utf-8 bytes in a separate data file, so
+# neither memory nor the schema grow with the number of distinct values.
+# Null text rows store the bitwise not (~) of their end offset.
+COLUMN_TYPES = {
+    'map': ('str', '<i4'),
+    'map_id': ('int', '<i4'),
+    'first_army_unit_supply': ('int', '<i4'),
+    'Game Length(seconds)': ('float', '<f8'),
+    'baseBuild': ('int', '<i4'),
+    'region': ('str', '<i4'),
+    'Winner': ('bool', '<i1'),
+    'first_army_unit': ('str', '<i4'),
+    'first_army_unit_time': ('int', '<i4'),
+    'player': ('text', '<i8'),
+    'game_category': ('str', '<i4'),
+    'build': ('int', '<i4'),
+    'unix_timestamp': ('int', '<i8'),
+    'player_race': ('str', '<i4'),
+    'matchup': ('str', '<i4'),
+    'opponent_race': ('str', '<i4'),
+    'opponent': ('text', '<i8'),
+    'first_tech_path': ('str', '<i4'),
+    'Carriers count': ('int', '<i4'),
+    'Carrier timing': ('int', '<i4'),
+    'Carriers': ('bool', '<i1'),
+    'replay_file': ('text', '<i8'),
+}
+
+
+def _column_file(index, name, suffix='bin'):
+    name = re.sub(r'[^0-9A-Za-z]+', '_', name).strip('_')
+    return '%02d_%s.%s' % (index, name, suffix)
+
+
+def _to_int(value):
+    return NULL if value is None else int(value)
+
+
+def _to_float(value):
+    return float('nan') if value is None else float(value)
+
+
+def _to_bool(value):
+    if value is True or value == 'True':
+        return 1
+    if value is False or value == 'False':
+        return 0
+    return NULL
+
+
+_CONVERTERS = {
+    'int': _to_int,
+    'float': _to_float,
+    'bool': _to_bool,
+}
+
+
+class ColumnarWriterStage(WriterStage):
+    """Writes rows as one raw little-endian file per column plus a schema.
+
+    Values are buffered per column and appended to the column files on
+    every flush. The schema, holding the row count and string dictionaries,
+    is written once all rows are in. dictionaries optionally seeds the
+    codes of string columns, e.g. {'map': MapTable.ids}.
+    """
+
+    def __init__(self, path, field_names, flush_rows=64 * 1024,
+                 dictionaries=None, **kwargs):
+        super(ColumnarWriterStage, self).__init__(**kwargs)
+        self.path = path
+        self.field_names = field_names
+        self.flush_rows = flush_rows
+        self._columns = []
+        os.makedirs(path, exist_ok=True)
+        for index, name in enumerate(field_names):
+            kind, dtype = COLUMN_TYPES[name]
+            file_name = _column_file(index, name)
+            column = {
+                'name': name,
+                'file': file_name,
+                'kind': kind,
+                'dtype': dtype,
+                'values': [],
+                'dictionary': (dict((dictionaries or {}).get(name, {}))
+                               if kind == 'str' else None),
+                'fh': open(os.path.join(path, file_name), 'wb'),
+            }
+            if kind == 'text':
+                column['data_file'] = _column_file(index, name, 'txt')
+                column['data_fh'] = open(
+                    os.path.join(path, column['data_file']), 'wb')
+                column['data'] = []
+                column['end'] = 0
+            self._columns.append(column)
+        self._buffered = 0
+
+    def write_batch(self, rows):
+        for column in self._columns:
+            name = column['name']
+            values = column['values']
+            if column['kind'] == 'str':
+                dictionary = column['dictionary']
+                for row in rows:
+                    value = row[name]
+                    if value is None:
+                        values.append(NULL)
+                    else:
+                        code = dictionary.get(value)
+                        if code is None:
+                            code = dictionary[value] = len(dictionary)
+                        values.append(code)
+            elif column['kind'] == 'text':
+                data = column['data']
+                end = column['end']
+                for row in rows:
+                    value = row[name]
+                    if value is None:
+                        values.append(~end)
+                    else:
+                        encoded = str(value).encode('utf-8')
+                        data.append(encoded)
+                        end += len(encoded)
+                        values.append(end)
+                column['end'] = end
+            else:
+                convert = _CONVERTERS[column['kind']]
+                values.extend(convert(row[name]) for row in rows)
+        self._buffered += len(rows)
+        if self._buffered >= self.flush_rows:
+            self.flush()
+
+    def flush(self):
+        if not self._buffered:
+            return
+        for column in self._columns:
+            block = np.asarray(column['values'], dtype=column['dtype'])
+            block.tofile(column['fh'])
+            self.bytes += block.nbytes
+            column['values'] = []
+            if column['kind'] == 'text':
+                data = b''.join(column['data'])
+                column['data_fh'].write(data)
+                self.bytes += len(data)
+                column['data'] = []
+        self._buffered = 0
+
+    def finish(self):
+        columns = []
+        for column in self._columns:
+            column['fh'].close()
+            if column['kind'] == 'text':
+                column['data_fh'].close()
+            entry = {
+                'name': column['name'],
+                'file': column['file'],
+                'kind': column['kind'],
+                'dtype': column['dtype'],
+            }
+            if column['dictionary'] is not None:
+                entry['dictionary'] = sorted(column['dictionary'],
+                                             key=column['dictionary'].get)
+            if column['kind'] == 'text':
+                entry['data_file'] = column['data_file']
+            columns.append(entry)
+        schema = {
+            'version': SCHEMA_VERSION,
+            'rows': self.rows,
+            'null': NULL,
+            'columns': columns,
+        }
+        tmp_path = os.path.join(self.path, SCHEMA_FILE + '.tmp')
+        with open(tmp_path, 'w') as fh:
+            json.dump(schema, fh)
+        os.replace(tmp_path, os.path.join(self.path, SCHEMA_FILE))
+
+
+class ColumnarTable(object):
+    """Read side of a columnar replayscan output directory.
+
+    Columns are memory mapped, so loading a table costs nothing until
+    values are touched. String columns hold codes into their dictionary,
+    code() and decode() translate between the two. Text columns hold end
+    offsets into their bytes in texts, decode() turns them into strings.
+    """
+
+    def __init__(self, path, mmap=True):
+        self.path = path
+        with open(os.path.join(path, SCHEMA_FILE)) as fh:
+            self.schema = json.load(fh)
+        if self.schema['version'] not in READABLE_VERSIONS:
+            raise ValueError('Unsupported columnar schema version %s' %
+                             self.schema['version'])
+        self.rows = self.schema['rows']
+        self.columns = {}
+        self.dictionaries = {}
+        self.texts = {}
+        self._codes = {}
+        for column in self.schema['columns']:
+            name = column['name']
+            file_path = os.path.join(path, column['file'])
+            if mmap and self.rows:
+                data = np.memmap(file_path, dtype=column['dtype'], mode='r',
+                                 shape=(self.rows,))
+            else:
+                data = np.fromfile(file_path, dtype=column['dtype'],
+                                   count=self.rows)
+            self.columns[name] = data
+            if 'dictionary' in column:
+                self.dictionaries[name] = column['dictionary']
+            if 'data_file' in column:
+                data_path = os.path.join(path, column['data_file'])
+                if mmap and os.path.getsize(data_path):
+                    self.texts[name] = np.memmap(data_path, dtype=np.uint8,
+                                                 mode='r')
+                else:
+                    self.texts[name] = np.fromfile(data_path, dtype=np.uint8)
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def __len__(self):
+        return self.rows
+
+    def code(self, name, value):
+        codes = self._codes.get(name)
+        if codes is None:
+            codes = {v: i for i, v in enumerate(self.dictionaries[name])}
+            self._codes[name] = codes
+        return codes.get(value, NULL)
+
+    def decode(self, name, codes=None):
+        if name in self.texts:
+            return self._decode_text(name, codes)
+        if codes is None:
+            codes = self.columns[name]
+        dictionary = np.array(self.dictionaries[name] + [None], dtype=object)
+        # NULL (-1) indexes the trailing None
+        return dictionary[codes]
+
+    def _decode_text(self, name, rows=None):
+        # rows selects rows by index or mask, like codes does for strings
+        ends = self.columns[name]
+        null = ends < 0
+        ends = np.where(null, ~ends, ends)
+        starts = np.concatenate(([0], ends[:-1]))
+        if rows is not None:
+            starts, ends, null = starts[rows], ends[rows], null[rows]
+        data = self.texts[name]
+        return np.array([None if is_null else
+                         bytes(data[start:end]).decode('utf-8')
+                         for start, end, is_null in zip(starts, ends, null)],
+                        dtype=object)
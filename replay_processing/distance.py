@@ -0,0 +1,333 @@
+"""Build order affinities computed with numpy over blocks of build pairs.
+
+The numbers are those of PlayerBuild.unit_type_ratios: for each unit of
+build a, its events in time order each take the closest event of that
+unit in b not taken yet, every pair scores 1 / max(1, |time difference| /
+600), and the sum is divided by the larger of the two event counts. Unit
+scores are averaged over the units of a, weighted by 1 / how many builds
+have the unit.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import os
+import tempfile
+
+import numpy as np
+from scipy import sparse
+
+from replay_processing.pools import bounded_results
+
+
+# Seconds apart at which a pair of events starts scoring below 1
+TIME_SCALE = 600.
+
+# Builds per block of the matrix, which bounds the per pair matching state
+# to BLOCK_SIZE ** 2 entries per event of the most frequent unit
+BLOCK_SIZE = 128
+
+
+def matched_scores(a_times, a_counts, b_times, b_counts):
+    """Summed pair scores of the greedy matching of every a row to every b row.
+
+    Rows are time sorted and NaN padded. This is the two pointer matching
+    of PlayerBuild.unit_events_affinity run in lockstep over all pairs:
+    per pair a cursor into the b row, and a stack of the untaken b events
+    before it.
+    """
+    a_rows, b_rows = np.divmod(np.arange(len(a_counts) * len(b_counts)),
+                               len(b_counts))
+    m = a_counts[a_rows]
+    n = b_counts[b_rows]
+    cursor = np.zeros(len(a_rows), dtype=np.intp)
+    below = np.zeros((len(a_rows), b_times.shape[1]), dtype=np.int32)
+    depth = np.zeros(len(a_rows), dtype=np.intp)
+    scores = np.zeros(len(a_rows))
+    last = b_times.shape[1] - 1
+
+    for k in range(a_times.shape[1]):
+        # Pairs where a still has events and b untaken ones
+        pairs = np.nonzero((m > k) & (n > k))[0]
+        if not len(pairs):
+            break
+        times = a_times[a_rows[pairs], k]
+
+        moving, moving_times = pairs, times
+        while len(moving):
+            ahead = cursor[moving]
+            step = ((ahead < n[moving]) &
+                    (b_times[b_rows[moving], np.minimum(ahead, last)] <=
+                     moving_times))
+            moving, moving_times = moving[step], moving_times[step]
+            below[moving, depth[moving]] = cursor[moving]
+            depth[moving] += 1
+            cursor[moving] += 1
+
+        b_pairs = b_rows[pairs]
+        has_below = depth[pairs] > 0
+        below_dist = times - b_times[b_pairs,
+                                     below[pairs, np.maximum(depth[pairs] - 1,
+                                                             0)]]
+        has_above = cursor[pairs] < n[pairs]
+        above_dist = b_times[b_pairs,
+                             np.minimum(cursor[pairs], last)] - times
+        take_below = has_below & (~has_above | (below_dist <= above_dist))
+
+        depth[pairs[take_below]] -= 1
+        cursor[pairs[~take_below]] += 1
+        dist = np.where(take_below, below_dist, above_dist)
+        scores[pairs] += 1. / np.maximum(1., dist / TIME_SCALE)
+
+    return scores.reshape(len(a_counts), len(b_counts))
+
+
+class UnitEvents(object):
+    """The event times of one unit across every build that has it.
+
+    rows are the build indexes, sorted. times has a row per build, its
+    event times sorted and padded with NaN up to the largest count.
+    """
+
+    def __init__(self, rows, counts, times):
+        self.rows = rows
+        self.counts = counts
+        self.times = times
+
+    def between(self, start, stop):
+        # Slice of the builds with index in [start, stop)
+        return slice(np.searchsorted(self.rows, start),
+                     np.searchsorted(self.rows, stop))
+
+
+class EncodedBuilds(object):
+    """Builds encoded once into per unit arrays of event times.
+
+    builds is a list of PlayerBuild, their index in it is the index in the
+    matrices computed. unit_popularity is what
+    PlayerBuilds.unit_build_popularity_counts returns.
+    """
+
+    def __init__(self, builds, unit_popularity):
+        self.size = len(builds)
+        self.units = sorted({unit for build in builds for unit in build.units})
+        unit_ids = {unit: i for i, unit in enumerate(self.units)}
+        self.weights = np.array([1. / unit_popularity.get(unit, 1)
+                                 for unit in self.units])
+
+        per_unit = [[] for _ in self.units]
+        # Sum of the weights of each build's units, what its affinities are
+        # divided by
+        self.weight_totals = np.zeros(self.size)
+        for i, build in enumerate(builds):
+            for unit, events in build.events_by_unit.items():
+                unit_id = unit_ids[unit]
+                per_unit[unit_id].append(
+                    (i, sorted(ev.time for ev in events)))
+                self.weight_totals[i] += self.weights[unit_id]
+
+        self.unit_events = []
+        for builds_times in per_unit:
+            counts = np.array([len(times) for _, times in builds_times])
+            times = np.full((len(builds_times), counts.max()), np.nan)
+            for row, (_, build_times) in enumerate(builds_times):
+                times[row, :len(build_times)] = build_times
+            rows = np.array([i for i, _ in builds_times])
+            self.unit_events.append(UnitEvents(rows, counts, times))
+
+    def embeddings(self):
+        """Sparse fixed length vectors of the builds, for clustering
+        without a pairwise matrix.
+
+        Each unit has two columns, log(1 + its event count) and the time
+        of its first event in TIME_SCALE units, both 0 without the unit.
+        """
+        rows, columns, values = [], [], []
+        for unit_id, events in enumerate(self.unit_events):
+            rows.extend((events.rows, events.rows))
+            columns.extend((np.full(len(events.rows), 2 * unit_id),
+                            np.full(len(events.rows), 2 * unit_id + 1)))
+            values.extend((np.log1p(events.counts),
+                           events.times[:, 0] / TIME_SCALE))
+        if not rows:
+            return sparse.csr_matrix((self.size, 0), dtype=np.float32)
+        return sparse.csr_matrix(
+            (np.concatenate(values).astype(np.float32),
+             (np.concatenate(rows), np.concatenate(columns))),
+            shape=(self.size, 2 * len(self.units)))
+
+    def block(self, a_start, a_stop, b_start, b_stop):
+        """Affinities of builds [a_start, a_stop) to [b_start, b_stop)."""
+        scores = np.zeros((a_stop - a_start, b_stop - b_start))
+        for weight, events in zip(self.weights, self.unit_events):
+            a = events.between(a_start, a_stop)
+            b = events.between(b_start, b_stop)
+            if a.start == a.stop or b.start == b.stop:
+                continue
+            a_counts = events.counts[a]
+            b_counts = events.counts[b]
+            unit_scores = matched_scores(
+                events.times[a, :a_counts.max()], a_counts,
+                events.times[b, :b_counts.max()], b_counts)
+            unit_scores /= np.maximum(a_counts[:, None], b_counts[None, :])
+            a_index = events.rows[a] - a_start
+            b_index = events.rows[b] - b_start
+            scores[np.ix_(a_index, b_index)] += weight * unit_scores
+
+        totals = self.weight_totals[a_start:a_stop, None]
+        return np.divide(scores, totals, out=np.zeros_like(scores),
+                         where=totals > 0)
+
+
+class CondensedMatrix(object):
+    """A symmetric matrix kept as its upper triangle, diagonal included.
+
+    Entry (i, j) with i <= j is at i * n - i * (i - 1) / 2 + j - i of a
+    flat float32 array, (j, i) is looked up as (i, j). With a path the
+    array is a memory mapped file, so matrices larger than memory can be
+    built and read back a row at a time.
+    """
+
+    def __init__(self, size, path=None, data=None):
+        self.size = size
+        length = size * (size + 1) // 2
+        if data is not None:
+            self.data = data
+        elif path is not None and length:
+            self.data = np.memmap(path, dtype=np.float32, mode='w+',
+                                  shape=(length, ))
+        else:
+            self.data = np.zeros(length, dtype=np.float32)
+
+    @classmethod
+    def open(cls, path, mode='r'):
+        data = np.memmap(path, dtype=np.float32, mode=mode)
+        # len(data) is n * (n + 1) / 2
+        size = int((np.sqrt(8 * len(data) + 1) - 1) // 2)
+        return cls(size, data=data)
+
+    def index(self, i, j):
+        if i > j:
+            i, j = j, i
+        return i * self.size - i * (i - 1) // 2 + j - i
+
+    def __getitem__(self, key):
+        return float(self.data[self.index(*key)])
+
+    def __len__(self):
+        return self.size
+
+    def row(self, i):
+        """Entries (i, j) for j >= i."""
+        start = self.index(i, i)
+        return self.data[start:start + self.size - i]
+
+    def set_block(self, a_start, a_stop, b_start, block):
+        # Only the entries with a <= b of the block are kept
+        for i in range(a_start, a_stop):
+            first = max(i, b_start)
+            columns = block[i - a_start, first - b_start:]
+            start = self.index(i, first)
+            self.data[start:start + len(columns)] = columns
+
+    def square(self, dtype=np.float64):
+        """The full n x n matrix, for consumers that need one."""
+        matrix = np.empty((self.size, self.size), dtype=dtype)
+        for i in range(self.size):
+            row = self.row(i)
+            matrix[i, i:] = row
+            matrix[i:, i] = row
+        return matrix
+
+    def flush(self):
+        if isinstance(self.data, np.memmap):
+            self.data.flush()
+
+
+def tiles(size, block_size=BLOCK_SIZE):
+    """(a_start, a_stop, b_start, b_stop) of the blocks on or above the
+    diagonal of a size x size matrix."""
+    for a_start in range(0, size, block_size):
+        a_stop = min(a_start + block_size, size)
+        for b_start in range(a_start, size, block_size):
+            yield a_start, a_stop, b_start, min(b_start + block_size, size)
+
+
+# The encoded builds and the shared matrix of a worker process
+_worker = {}
+
+
+def _init_worker(encoded, path):
+    _worker['encoded'] = encoded
+    _worker['matrix'] = CondensedMatrix.open(path, mode='r+')
+
+
+def _compute_tile(tile):
+    a_start, a_stop, b_start, b_stop = tile
+    block = _worker['encoded'].block(a_start, a_stop, b_start, b_stop)
+    _worker['matrix'].set_block(a_start, a_stop, b_start, block)
+    return tile
+
+
+def affinity_matrix(builds, unit_popularity, block_size=BLOCK_SIZE,
+                    path=None, jobs=1, progress=None):
+    """The build_order_clustering affinity matrix of builds.
+
+    Affinities aren't symmetric. Like the scalar code, entry (i, j) and
+    (j, i) both hold the affinity of the lower index build to the other,
+    so only those are computed, into a CondensedMatrix backed by path if
+    given.
+
+    With jobs > 1 the tiles are computed by a pool of processes, each
+    given the encoded builds once, that write into the memory mapped
+    matrix directly. Without a path it is mapped from a temporary file.
+    progress, if given, is called with the number of tiles done and
+    their total after every tile.
+    """
+    encoded = EncodedBuilds(builds, unit_popularity)
+    n = encoded.size
+    all_tiles = list(tiles(n, block_size))
+
+    if jobs <= 1 or len(all_tiles) <= 1:
+        matrix = CondensedMatrix(n, path=path)
+        for done, tile in enumerate(all_tiles, 1):
+            matrix.set_block(tile[0], tile[1], tile[2],
+                             encoded.block(*tile))
+            if progress is not None:
+                progress(done, len(all_tiles))
+        matrix.flush()
+        return matrix
+
+    temporary = path is None
+    if temporary:
+        fd, path = tempfile.mkstemp(suffix='.affinities')
+        os.close(fd)
+    try:
+        matrix = CondensedMatrix(n, path=path)
+        matrix.flush()
+        with ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker,
+                                 initargs=(encoded, path)) as pool:
+            results = bounded_results(
+                lambda tile: pool.submit(_compute_tile, tile), all_tiles,
+                jobs * 2)
+            for done, _ in enumerate(results, 1):
+                if progress is not None:
+                    progress(done, len(all_tiles))
+        matrix.flush()
+    finally:
+        if temporary:
+            # The mapping outlives the file's name
+            os.unlink(path)
+    return matrix
+
+
+def center_affinities(builds, unit_popularity, center, members):
+    """Affinities between each of members and center, indexes into builds.
+
+    Same orientation as affinity_matrix, so without computing the matrix
+    they are its (member, center) entries.
+    """
+    members = np.asarray(members)
+    encoded = EncodedBuilds([builds[center]] +
+                            [builds[i] for i in members], unit_popularity)
+    size = len(members) + 1
+    from_center = encoded.block(0, 1, 1, size)[0]
+    to_center = encoded.block(1, size, 0, 1)[:, 0]
+    return np.where(members >= center, from_center, to_center)
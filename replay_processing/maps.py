@@ -0,0 +1,79 @@
+import functools
+import json
+import os
+
+
+# Translations of localized map names, ladder suffixes stripped from map
+# names and the canonical maps, whose order fixes their IDs
+DEFAULT_TABLE = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             'map_names.json')
+
+
+class MapTable(object):
+    """Turns raw replay map names into canonical names and small int IDs.
+
+    Every raw name is resolved once and then served from a dict, there are
+    only a few hundred distinct names in any replay collection. Canonical
+    names from the table get IDs in table order, others get the next free
+    ID when first seen. Raw names the table doesn't know are collected in
+    unknown so they can be reported once.
+    """
+
+    def __init__(self, translations=(), suffixes=(), maps=()):
+        self.translations = list(translations)
+        self.suffixes = list(suffixes)
+        self.ids = {}
+        for name in maps:
+            self.ids.setdefault(name, len(self.ids))
+        self.known = set(self.ids)
+        self.known.update(name for _, name in self.translations)
+        self.unknown = set()
+        self._canonical = {}
+
+    @classmethod
+    def load(cls, path=DEFAULT_TABLE):
+        with open(path, encoding='utf-8') as fh:
+            table = json.load(fh)
+        return cls(translations=table.get('translations', ()),
+                   suffixes=table.get('suffixes', ()),
+                   maps=table.get('maps', ()))
+
+    def translate(self, raw):
+        for localized, name in self.translations:
+            if localized in raw:
+                return name
+        return raw
+
+    def canonical(self, raw):
+        try:
+            return self._canonical[raw]
+        except KeyError:
+            pass
+        splits = self.translate(raw).split(" ")
+        for suffix in self.suffixes:
+            if suffix in splits:
+                splits.remove(suffix)
+        name = " ".join(splits)
+        if name not in self.known:
+            self.unknown.add(raw)
+        self._canonical[raw] = name
+        return name
+
+    def map_id(self, raw):
+        # Not thread safe, IDs are handed out by whoever consumes results
+        name = self.canonical(raw)
+        map_id = self.ids.get(name)
+        if map_id is None:
+            map_id = self.ids[name] = len(self.ids)
+        return map_id
+
+    def log_unknown(self, logger):
+        if self.unknown:
+            logger.warning("Map names missing from the map table ({0}): "
+                           "{1}".format(len(self.unknown),
+                                        sorted(self.unknown)))
+
+
+@functools.lru_cache(maxsize=None)
+def default_table():
+    return MapTable.load()
@@ -0,0 +1,150 @@
+import array
+import collections
+import contextlib
+import heapq
+import json
+import math
+import time
+
+
+def percentile(sorted_values, pct):
+    # Nearest-rank percentile of an already sorted sequence
+    if not sorted_values:
+        return 0.
+    rank = int(math.ceil(pct / 100. * len(sorted_values)))
+    return sorted_values[max(rank, 1) - 1]
+
+
+def summarize(values, percentiles=(50, 90, 99)):
+    ordered = sorted(values)
+    summary = {'count': len(ordered)}
+    for pct in percentiles:
+        summary['p%d' % pct] = percentile(ordered, pct)
+    summary['max'] = ordered[-1] if ordered else 0.
+    return summary
+
+
+def format_summary(summary):
+    return ' '.join('%s=%.3f' % (key, value) if key != 'count' else
+                    '%s=%d' % (key, value)
+                    for key, value in summary.items())
+
+
+class StageTimer(object):
+    """Wall time per named stage of one replay, summed if a stage repeats."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = (self.timings.get(name, 0.) +
+                                  time.perf_counter() - start)
+
+
+class _NullTimer(object):
+    timings = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        yield
+
+
+# Stand-in for callers that don't collect timings
+NULL_TIMER = _NullTimer()
+
+
+class RunMetrics(object):
+    """Per-stage timings, slowest replays and throughput of a whole run.
+
+    Stage samples are kept in compact arrays, the slowest replays in a
+    bounded heap and completions in counters of interval-second buckets.
+    """
+
+    STAGE_PERCENTILES = (50, 95, 99)
+
+    def __init__(self, slowest=10, interval=10.):
+        self.interval = interval
+        self.max_slowest = slowest
+        self.stages = collections.OrderedDict()
+        self.slowest = []
+        self.replays = 0
+        self._completions = collections.Counter()
+        self._start = time.perf_counter()
+
+    def add_stage(self, name, seconds):
+        try:
+            samples = self.stages[name]
+        except KeyError:
+            samples = self.stages[name] = array.array('d')
+        samples.append(seconds)
+
+    def add_replay(self, filename, seconds, timings=None):
+        self.replays += 1
+        self.add_stage('total', seconds)
+        for name, stage_seconds in (timings or {}).items():
+            self.add_stage(name, stage_seconds)
+
+        entry = (seconds, filename)
+        if len(self.slowest) < self.max_slowest:
+            heapq.heappush(self.slowest, entry)
+        elif entry > self.slowest[0]:
+            heapq.heapreplace(self.slowest, entry)
+
+        bucket = int((time.perf_counter() - self._start) // self.interval)
+        self._completions[bucket] += 1
+
+    def stage_summaries(self):
+        return collections.OrderedDict(
+            (name, summarize(samples, self.STAGE_PERCENTILES))
+            for name, samples in self.stages.items())
+
+    def throughput(self):
+        if not self._completions:
+            return []
+        elapsed = time.perf_counter() - self._start
+        last = max(self._completions)
+        buckets = []
+        for bucket in range(last + 1):
+            start = bucket * self.interval
+            # The last bucket is usually only partly over
+            length = min(self.interval, max(elapsed - start, 1e-9))
+            buckets.append({'start': start,
+                            'replays_per_sec': self._completions[bucket] / length})
+        return buckets
+
+    def report(self):
+        elapsed = time.perf_counter() - self._start
+        return {
+            'replays': self.replays,
+            'elapsed': elapsed,
+            'replays_per_sec': self.replays / elapsed if elapsed else 0.,
+            'stages': self.stage_summaries(),
+            'slowest': [{'seconds': seconds, 'replay': filename}
+                        for seconds, filename in sorted(self.slowest,
+                                                        reverse=True)],
+            'throughput': self.throughput(),
+        }
+
+    def write_json(self, path):
+        with open(path, 'w') as fh:
+            json.dump(self.report(), fh, indent=4, separators=(',', ': '))
+
+    def log_report(self, logger):
+        report = self.report()
+        logger.info("Replays/sec: {0:.2f} over {1:.1f}s".format(
+            report['replays_per_sec'], report['elapsed']))
+        for name, summary in report['stages'].items():
+            logger.info("Stage {0}: {1}".format(name, format_summary(summary)))
+        logger.info("Slowest replays:")
+        for entry in report['slowest']:
+            logger.info("  {0:.3f}s {1}".format(entry['seconds'],
+                                                entry['replay']))
+        logger.info("Replays/sec every {0:.0f}s: {1}".format(
+            self.interval,
+            ' '.join('%.1f' % bucket['replays_per_sec']
+                     for bucket in report['throughput'])))
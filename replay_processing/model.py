@@ -1,10 +1,15 @@
 import collections
 import glob
+import heapq
 import itertools
 import json
+import operator
 import os
+import threading
 
+import numpy as np
 import sc2reader
+import sc2reader.exceptions
 
 
 class ReplayParseError(Exception):
@@ -43,9 +48,63 @@ UNIT_CREATED_EVENT_TYPES = [
 ]
 
 
-def replays_from_dir(root_dir):
-    return map(Replay,
-               glob.glob("%s/**/*.SC2Replay" % root_dir), recursive=True)
+# How much of a replay sc2reader decodes. sc2reader can't skip event types
+# while decoding, so event_types (None for all) trims Replay.events after
+# the load.
+LoadProfile = collections.namedtuple('LoadProfile', ['load_level',
+                                                     'engine',
+                                                     'event_types'])
+
+LOAD_PROFILES = {
+    # Header, details and players, no events and no plugins
+    'metadata': LoadProfile(2, None, ()),
+    # Tracker events only, enough for unit and upgrade build orders
+    'tracker_only': LoadProfile(3, sc2reader.engine,
+                                tuple(UNIT_CREATED_EVENT_TYPES) +
+                                ('UpgradeCompleteEvent', )),
+    # Everything, sc2reader's defaults
+    'full': LoadProfile(4, sc2reader.engine, None),
+}
+
+
+# What a header-only load knows about a replay, enough to reject it before
+# paying for a full parse
+ReplayHeader = collections.namedtuple('ReplayHeader', ['game_type',
+                                                       'num_players',
+                                                       'seconds',
+                                                       'map_name'])
+
+
+def load_header(replay_file):
+    """Load the header, details and player list of a replay, no events.
+
+    replay_file is a path or a file-like object.
+    """
+    path = getattr(replay_file, 'name', replay_file)
+    profile = LOAD_PROFILES['metadata']
+    try:
+        replay = sc2reader.load_replay(replay_file,
+                                       load_level=profile.load_level,
+                                       engine=profile.engine)
+        return ReplayHeader(replay.real_type,
+                            len(replay.players),
+                            replay.real_length.seconds,
+                            replay.map_name)
+    except (sc2reader.exceptions.SC2ReaderError, IndexError, AttributeError,
+            KeyError) as e:
+        raise ReplayParseError(path, e)
+
+
+def replays_from_dir(root_dir, profile='full', pool=None):
+    return (Replay(path, profile, pool)
+            for path in glob.glob("%s/**/*.SC2Replay" % root_dir,
+                                  recursive=True))
+
+
+def replays_from_catalog(catalog, profile='full', pool=None, **filters):
+    """Replays a ReplayCatalog query selects, see ReplayCatalog.query."""
+    return (Replay(entry.path, profile, pool)
+            for entry in catalog.query(**filters))
 
 
 def _replay_parse_guard(fn):
@@ -57,10 +116,109 @@ def _replay_parse_guard(fn):
     return wrapper
 
 
+class ParsedReplay(object):
+    """What parsing a replay produces: the sc2reader replay, its events as
+    trimmed by the load profile and, built on first use, their index.
+    """
+
+    def __init__(self, replay, event_types=None):
+        self.replay = replay
+        if event_types is None:
+            self.events = replay.events
+        else:
+            event_types = set(event_types)
+            self.events = [ev for ev in replay.events
+                           if ev.name in event_types]
+        self._index = None
+
+    @property
+    def index(self):
+        if self._index is None:
+            self._index = EventIndex(list(self.events))
+        return self._index
+
+
+class ReplayPool(object):
+    """LRU pool of parsed replays shared by any number of Replay handles.
+
+    Holds at most max_entries replays and, when max_events is set, at most
+    that many events across them. Events are most of the memory of a
+    parsed replay, so max_events is the memory cap. The least recently
+    used replays are dropped first, the newest one is always kept.
+    """
+
+    def __init__(self, max_entries=16, max_events=None):
+        self.max_entries = max_entries
+        self.max_events = max_events
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.events = 0
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, load):
+        """The ParsedReplay of key, calling load() to parse it on a miss."""
+        with self._lock:
+            parsed = self._entries.get(key)
+            if parsed is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return parsed
+            self.misses += 1
+
+        # Parse without holding the lock, two threads may both parse the
+        # same replay but neither blocks the other's hits
+        parsed = load()
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.events -= len(previous.events)
+            self._entries[key] = parsed
+            self.events += len(parsed.events)
+            self._evict()
+        return parsed
+
+    def _evict(self):
+        while len(self._entries) > 1 and (
+                len(self._entries) > self.max_entries or
+                (self.max_events is not None and
+                 self.events > self.max_events)):
+            _, parsed = self._entries.popitem(last=False)
+            self.events -= len(parsed.events)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.events = 0
+
+    def stats(self):
+        return {'entries': len(self._entries),
+                'events': self.events,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
 class Replay(object):
-    def __init__(self, path):
+    """A replay file, parsed on first access with one of LOAD_PROFILES.
+
+    Without a pool the parsed replay lives as long as this object. With a
+    ReplayPool, Replay is only a handle and the pool decides how long the
+    parsed data stays around, it is parsed again when needed.
+    """
+
+    def __init__(self, path, profile='full', pool=None):
+        if profile not in LOAD_PROFILES:
+            raise ValueError('Unknown load profile %s' % profile)
         self.path = path
-        self._parsed_replay_obj = None
+        self.profile = profile
+        self.pool = pool
+        self._parsed_obj = None
 
     @property
     def name(self):
@@ -71,17 +229,34 @@ class Replay(object):
     def seconds(self):
         return self._parsed_replay.real_length.seconds
 
+    def _load(self):
+        profile = LOAD_PROFILES[self.profile]
+        replay = sc2reader.load_replay(self.path,
+                                       load_level=profile.load_level,
+                                       engine=profile.engine)
+        return ParsedReplay(replay, profile.event_types)
+
+    @property
+    def _parsed(self):
+        if self.pool is not None:
+            return self.pool.get((self.path, self.profile), self._load)
+        if self._parsed_obj is None:
+            self._parsed_obj = self._load()
+        return self._parsed_obj
+
     @property
     def _parsed_replay(self):
-        if self._parsed_replay_obj is None:
-            replay = sc2reader.load_replay(self.path)
-            self._parsed_replay_obj = replay
-        return self._parsed_replay_obj
+        return self._parsed.replay
 
     @property
     @_replay_parse_guard
     def events(self):
-        return self._parsed_replay.events
+        return self._parsed.events
+
+    @property
+    @_replay_parse_guard
+    def event_index(self):
+        return self._parsed.index
 
     @property
     @_replay_parse_guard
@@ -97,18 +272,74 @@ def event_type_names(events):
             yield ev.name
 
 
+class EventIndex(object):
+    """The events of a replay indexed by type name and unit owner.
+
+    The index is built in a single pass on the first query. After that a
+    query costs O(matching events) instead of a scan of every event.
+    Results keep the order of the events list.
+    """
+
+    def __init__(self, events):
+        self.events = events
+        self._by_type = None
+        self._units = None
+        self._units_by_owner = None
+
+    def _type_index(self):
+        if self._by_type is None:
+            by_type = collections.defaultdict(list)
+            for position, ev in enumerate(self.events):
+                by_type[ev.name].append((position, ev))
+            self._by_type = by_type
+        return self._by_type
+
+    def by_type(self, include_types=None, exclude_types=None):
+        by_type = self._type_index()
+        names = set(include_types or []) - set(exclude_types or [])
+        matches = [by_type[name] for name in names if name in by_type]
+        if len(matches) == 1:
+            return [ev for _, ev in matches[0]]
+        merged = heapq.merge(*matches, key=operator.itemgetter(0))
+        return [ev for _, ev in merged]
+
+    def _unit_index(self):
+        if self._units is None:
+            self._units = [ev for ev in self.by_type(UNIT_CREATED_EVENT_TYPES)
+                           if ev.unit.name not in BEACON_UNITS]
+            by_owner = collections.defaultdict(list)
+            for ev in self._units:
+                by_owner[ev.unit.owner].append(ev)
+            self._units_by_owner = by_owner
+        return self._units
+
+    def unit_events(self, include_npc=False):
+        units = self._unit_index()
+        if include_npc:
+            return list(units)
+        return [ev for ev in units if ev.unit.owner is not None]
+
+    def unit_events_of(self, owner):
+        """Unit created events of one owner, None for NPC units."""
+        self._unit_index()
+        return list(self._units_by_owner.get(owner, ()))
+
+
+def event_index(events):
+    # Lets the query functions take an index or a plain list of events.
+    # Passing the list builds a throwaway index, which is no more work than
+    # the single filter pass these functions used to make.
+    if isinstance(events, EventIndex):
+        return events
+    return EventIndex(events)
+
+
 def events_by_type(events, include_types=None, exclude_types=None):
-    incl = set(include_types or [])
-    excl = set(exclude_types or [])
-    return filter(lambda x: x.name in incl and x.name not in excl, events)
+    return event_index(events).by_type(include_types, exclude_types)
 
 
 def unit_events(events, include_npc=False):
-    events = events_by_type(events, UNIT_CREATED_EVENT_TYPES)
-    events = filter(lambda x: x.unit.name not in BEACON_UNITS, events)
-    if not include_npc:
-        return filter(lambda x: x.unit.owner is not None, events)
-    return events
+    return event_index(events).unit_events(include_npc)
 
 
 def all_unit_created_events_by_type(events):
@@ -194,49 +425,176 @@ class ClusteringBuild(object):
                             '.'.join(self.map_id, 'csv'))
 
 
+class ClusteringStore(object):
+    """Compact form of a clustering file.
+
+    Rather than the nested dicts of the JSON, every build is one entry of
+    the keys (UTF-8 bytes), label_ids and affinities arrays, sorted by
+    label so the builds of a label are a slice. Labels are indexes into label_names,
+    centers holds the entry of each label's center.
+    """
+
+    def __init__(self, label_names, centers, keys, label_ids, affinities):
+        self.label_names = list(label_names)
+        self.centers = np.asarray(centers, dtype=np.int64)
+        if len(keys) and not isinstance(keys[0], bytes):
+            keys = [key.encode('utf-8') for key in keys]
+        self.keys = np.asarray(keys, dtype=bytes)
+        self.label_ids = np.asarray(label_ids, dtype=np.int32)
+        self.affinities = np.asarray(affinities, dtype=np.float64)
+        self._offsets = np.searchsorted(
+            self.label_ids, np.arange(len(self.label_names) + 1))
+        self._key_index = None
+
+    @classmethod
+    def from_raw(cls, raw_data):
+        label_names = []
+        centers = []
+        keys = []
+        label_ids = []
+        affinities = []
+        for label, label_data in raw_data['labels'].items():
+            label_id = len(label_names)
+            label_names.append(label)
+            center = None
+            for key, build_data in label_data['builds'].items():
+                if key == label_data['center']:
+                    center = len(keys)
+                keys.append(key)
+                label_ids.append(label_id)
+                affinities.append(build_data['affinity'])
+            if center is None:
+                raise ValueError('Center of label %s is not one of its '
+                                 'builds' % label)
+            centers.append(center)
+        return cls(label_names, centers, keys, label_ids, affinities)
+
+    @classmethod
+    def load(cls, path):
+        if path.endswith('.npz'):
+            with np.load(path, allow_pickle=False) as data:
+                return cls(data['label_names'].tolist(), data['centers'],
+                           data['keys'], data['label_ids'],
+                           data['affinities'])
+        with open(path) as fh:
+            return cls.from_raw(json.load(fh))
+
+    def to_raw(self):
+        """The labels of the clustering in the nested dicts of the JSON."""
+        keys = [key.decode('utf-8') for key in self.keys.tolist()]
+        affinities = self.affinities.tolist()
+        labels = {}
+        for label_id, label in enumerate(self.label_names):
+            entries = self.label_slice(label_id)
+            labels[label] = {
+                'builds': {keys[i]: {'affinity': affinities[i]}
+                           for i in range(entries.start, entries.stop)},
+                'center': keys[self.centers[label_id]],
+            }
+        return {'labels': labels}
+
+    def save(self, path):
+        np.savez(path, label_names=np.asarray(self.label_names, dtype=str),
+                 centers=self.centers, keys=self.keys,
+                 label_ids=self.label_ids, affinities=self.affinities)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def label_slice(self, label_id):
+        return slice(self._offsets[label_id], self._offsets[label_id + 1])
+
+    def index(self, key):
+        """Entry of a build key, None if it isn't in any label."""
+        if self._key_index is None:
+            self._key_index = {key.decode('utf-8'): i for i, key in
+                               enumerate(self.keys.tolist())}
+        return self._key_index.get(key)
+
+    def build(self, i):
+        return ClusteringBuild.from_map_player_key(
+            self.keys[i].decode('utf-8'),
+            {'affinity': float(self.affinities[i])})
+
+
+# Which label a build is in and its affinity there
+BuildLabel = collections.namedtuple('BuildLabel', ['label', 'affinity'])
+
+
 class ClusteringLabel(object):
-    def __init__(self, label, description, data):
+    def __init__(self, label, description, store, label_id):
         self.label = label
         self.description = description
-        self.data = data
+        self.store = store
+        self.label_id = label_id
+        self._center = None
+        self._builds = None
 
     @property
     def center(self):
-        center_key = self.data['center']
-        center_data = self.data['builds'][center_key]
-        return ClusteringBuild.from_map_player_key(center_key,
-                                                   center_data)
+        if self._center is None:
+            self._center = self.store.build(self.store.centers[self.label_id])
+        return self._center
 
     @property
     def builds(self):
-        return [ClusteringBuild.from_map_player_key(key, val) for key, val in
-                self.data['builds'].items()]
+        if self._builds is None:
+            entries = self.store.label_slice(self.label_id)
+            self._builds = [self.store.build(i)
+                            for i in range(entries.start, entries.stop)]
+        return self._builds
 
     def __len__(self):
-        return len(self.data['builds'])
+        entries = self.store.label_slice(self.label_id)
+        return entries.stop - entries.start
 
 
 class ClusteringData(object):
+    """A clustering file, JSON or the compact .npz form of ClusteringStore.
+
+    The file is read once into a ClusteringStore, labels and their builds
+    are only materialized when asked for and then kept.
+    """
+
     def __init__(self, path, label_map):
         self.path = path
         self.label_map = label_map
-        self._raw_data = None
+        self._store = None
+        self._labels = None
 
     @property
     def raw_data(self):
-        if self._raw_data is None:
-            with open(self.path) as fh:
-                self._raw_data = json.load(fh)
-        return self._raw_data
+        # Not kept around, the store holds the same data in a fraction of
+        # the memory. A compact file only has the labels.
+        if self.path.endswith('.npz'):
+            return self.store.to_raw()
+        with open(self.path) as fh:
+            return json.load(fh)
+
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = ClusteringStore.load(self.path)
+        return self._store
 
     @property
     def labels(self):
-        ret = {}
-        for label, label_data in self.raw_data['labels'].items():
-            desc = self.label_map.description(label)
-            c_l = ClusteringLabel(label, desc, label_data)
-            ret[label] = c_l
-        return ret
+        if self._labels is None:
+            labels = {}
+            for label_id, label in enumerate(self.store.label_names):
+                desc = self.label_map.description(label)
+                labels[label] = ClusteringLabel(label, desc, self.store,
+                                                label_id)
+            self._labels = labels
+        return self._labels
+
+    def label_of(self, key):
+        """BuildLabel of a map_player@map_id build key, None if unlabeled."""
+        i = self.store.index(key)
+        if i is None:
+            return None
+        return BuildLabel(self.store.label_names[self.store.label_ids[i]],
+                          float(self.store.affinities[i]))
 
 
 class ClusteringLabelMap(object):
@@ -271,6 +629,26 @@ class ClusteringDataDir(object):
     def __init__(self, path):
         self.path = path
 
+    def _clustering_file(self, name, extension):
+        return os.path.join(self.path, 'clusterings',
+                            '.'.join((name, extension)))
+
+    def clustering_path(self, name):
+        # The compact form wins while it is at least as new as the JSON
+        json_path = self._clustering_file(name, 'json')
+        compact_path = self._clustering_file(name, 'npz')
+        if os.path.exists(compact_path) and (
+                not os.path.exists(json_path) or
+                os.path.getmtime(compact_path) >= os.path.getmtime(json_path)):
+            return compact_path
+        return json_path
+
+    def write_compact(self, name):
+        compact_path = self._clustering_file(name, 'npz')
+        store = ClusteringStore.load(self._clustering_file(name, 'json'))
+        store.save(compact_path)
+        return compact_path
+
     def clustering_data(self, name):
         label_map = ClusteringLabelMap(
             os.path.join(self.path, 'cluster_tag_mappings',
@@ -279,7 +657,4 @@ class ClusteringDataDir(object):
                          '.'.join(('cluster_tags', 'json')))
         )
 
-        return ClusteringData(os.path.join(self.path,
-                                           'clusterings',
-                                           '.'.join((name, 'json'))),
-                              label_map)
+        return ClusteringData(self.clustering_path(name), label_map)
@@ -4,6 +4,9 @@ import logging
 import os
 import sys
 
+from replay_processing.cache import DEFAULT_CACHE_DIR, DEFAULT_CACHE_SIZE
+from replay_processing.quarantine import DEFAULT_QUARANTINE_FILE
+
 
 def verbose_check(args):
     val = args.verbose or os.environ.get("SC2DEBUG")
@@ -39,11 +42,37 @@ def parse_params():
     parser.add_argument("-R", "--replay_folder", help="Path to directory we want to pull data from")
     parser.add_argument("-M", "--max_replays", help="Maximum number of replay files to parse", type=int)
     parser.add_argument("-T", "--worker_threads", help="Size of worker thread pool used in parsing files", default=5, type=int)
+    parser.add_argument("-E", "--executor", choices=("thread", "process"), default="thread",
+                        help="Run workers as threads or as separate processes. Parsing is CPU bound, "
+                             "so process scales with --worker_threads where thread does not")
     parser.add_argument("-v", "--verbose", help="Print all output if set, else only critical logging", action="store_true")
     parser.add_argument("-d", "--debug", help="Enable debugging from application", action="store_true")
     parser.add_argument("-a", "--all_matches", help="Only take into account 1v1 matchups", action="store_true")
     parser.add_argument("-o", "--output_path", type=str,
                         help="Destination to output CSV. Default is stdout.")
+    parser.add_argument("-f", "--format", choices=("csv", "columnar"), default="csv",
+                        help="Output format. columnar writes typed, memory-mappable column files "
+                             "plus a schema.json into the --output_path directory")
+    parser.add_argument("--cache-dir", type=str,
+                        default=os.environ.get("SC2CACHE", DEFAULT_CACHE_DIR),
+                        help="Directory of cached parse results. Default is SC2CACHE or %s" % DEFAULT_CACHE_DIR)
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE // (1024 * 1024),
+                        help="Size cap of the cache in MB, least recently used entries are evicted")
+    parser.add_argument("--metrics", type=str,
+                        help="Write per-stage timings, slowest replays and throughput as JSON to this path")
+    parser.add_argument("--timeout", type=float,
+                        help="Seconds a single replay may take before its worker is killed and the "
+                             "replay quarantined. Needs --executor process")
+    parser.add_argument("--quarantine-file", type=str, default=DEFAULT_QUARANTINE_FILE,
+                        help="Replays that timed out or crashed are recorded here and skipped by "
+                             "later runs. Default is %s" % DEFAULT_QUARANTINE_FILE)
+    parser.add_argument("--retry-quarantined", action="store_true",
+                        help="Parse quarantined replays again instead of skipping them")
+    cache_mode = parser.add_mutually_exclusive_group()
+    cache_mode.add_argument("--no-cache", action="store_true",
+                            help="Parse every replay and neither read nor write the cache")
+    cache_mode.add_argument("--rebuild-cache", action="store_true",
+                            help="Parse every replay and overwrite its cache entry")
 
     tmp = parser.parse_args()
     args["verbose"], args["logger"] = verbose_check(tmp)
@@ -61,7 +90,25 @@ def parse_params():
         if hasattr(tmp, arg):
             args[arg] = getattr(tmp, arg)
 
+    args["format"] = tmp.format
+    if args["format"] == "columnar" and not args["output_path"]:
+        args["logger"].critical("--format columnar needs an --output_path directory. Exiting")
+        exit(errno.EINVAL)
+
     # default thread count is 5
     args["threads"] = tmp.worker_threads if tmp.worker_threads > 0 else 5
+    args["executor"] = tmp.executor
+    if tmp.timeout and args["executor"] != "process":
+        args["logger"].critical("--timeout needs --executor process, a thread can't be stopped. Exiting")
+        exit(errno.EINVAL)
+
+    args["cache_dir"] = None if tmp.no_cache else tmp.cache_dir
+    args["cache_size"] = tmp.cache_size * 1024 * 1024
+    args["rebuild_cache"] = tmp.rebuild_cache
+
+    args["metrics_path"] = tmp.metrics
+    args["timeout"] = tmp.timeout
+    args["quarantine_file"] = tmp.quarantine_file
+    args["retry_quarantined"] = tmp.retry_quarantined
 
     return args
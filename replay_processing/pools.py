@@ -0,0 +1,16 @@
+from concurrent.futures import FIRST_COMPLETED, as_completed, wait
+
+
+def bounded_results(submit, items, max_in_flight):
+    # Only max_in_flight futures exist at any time, so neither the item list
+    # nor the pending futures grow with the amount of work.
+    in_flight = set()
+    for item in items:
+        while len(in_flight) >= max_in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+        in_flight.add(submit(item))
+
+    for future in as_completed(in_flight):
+        yield future.result()
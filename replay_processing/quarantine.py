@@ -0,0 +1,50 @@
+import json
+import os
+import threading
+import time
+
+
+DEFAULT_QUARANTINE_FILE = os.path.join(os.path.expanduser('~'), '.cache',
+                                       'replay_processing',
+                                       'quarantine.jsonl')
+
+
+class Quarantine(object):
+    """Persistent list of replays that timed out or crashed a worker.
+
+    Entries are appended to a JSON lines file as they happen, so a run that
+    is killed half way still keeps what it learned. Later runs skip every
+    path in the file.
+    """
+
+    def __init__(self, path=DEFAULT_QUARANTINE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._paths = set()
+        try:
+            with open(path) as fh:
+                for line in fh:
+                    try:
+                        self._paths.add(json.loads(line)['path'])
+                    except (ValueError, KeyError):
+                        continue
+        except FileNotFoundError:
+            pass
+
+    def __contains__(self, path):
+        return path in self._paths
+
+    def __len__(self):
+        return len(self._paths)
+
+    def add(self, path, reason, seconds=None):
+        with self._lock:
+            if path in self._paths:
+                return
+            self._paths.add(path)
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)),
+                        exist_ok=True)
+            entry = {'path': path, 'reason': reason, 'seconds': seconds,
+                     'time': int(time.time())}
+            with open(self.path, 'a') as fh:
+                fh.write(json.dumps(entry) + '\n')
@@ -1,6 +1,10 @@
 
+from replay_processing.cache import ReplayCache
+from replay_processing.columnar import ColumnarWriterStage
+from replay_processing.maps import default_table
 from replay_processing.parseargs import parse_params
-from replay_processing.sc2files import parse_replays
+from replay_processing.quarantine import Quarantine
+from replay_processing.sc2files import FIELD_NAMES, parse_replays
 
 
 def main():
@@ -10,28 +14,56 @@ def main():
     # Parse replays using params
     logger.info("Parsing Replay Files")
 
+    cache = None
+    if params["cache_dir"] is not None:
+        cache = ReplayCache(params["cache_dir"], params["cache_size"])
+
+    quarantine = Quarantine(params["quarantine_file"])
+
     output_path = params.get("output_path")
     output_file = None
+    writer = None
     try:
-        if output_path is not None:
-            output_file = open(output_path, "w+")
-        ret = parse_replays(params["replay_dir"],
-                            params["threads"],
-                            max_replays=params.get("max_replays"),
-                            logger=logger,
-                            outfile=output_file)
+        if params["format"] == "columnar":
+            # Known maps keep the same code in every output
+            writer = ColumnarWriterStage(output_path, FIELD_NAMES,
+                                         dictionaries={'map': default_table().ids})
+        elif output_path is not None:
+            output_file = open(output_path, "w", newline="")
+        stats = parse_replays(params["replay_dir"],
+                              params["threads"],
+                              max_replays=params.get("max_replays"),
+                              logger=logger,
+                              outfile=output_file,
+                              writer=writer,
+                              executor=params["executor"],
+                              cache=cache,
+                              rebuild_cache=params["rebuild_cache"],
+                              stream=True,
+                              timeout=params["timeout"],
+                              quarantine=quarantine,
+                              retry_quarantined=params["retry_quarantined"])
     finally:
         if output_file is not None:
-            output_file.close
-
-    match_data, count, errors, error_replays, match_stats, korean_replays = ret
+            output_file.close()
 
-    logger.info("Match Stats: {0}".format({k: v for k, v in match_stats.items()}))
-    logger.info("Total Replays: {0}".format(count))
-    logger.info("Error Replays: {0}".format(errors))
-    logger.info("Error Percent: {0}".format(str(errors / float(count))))
-    logger.info("Error Replays: \n  {0}".format(error_replays))
-    logger.info("Korean replays: \n  {0}".format(korean_replays))
+    logger.info("Match Stats: {0}".format({k: v for k, v in stats.match_stats.items()}))
+    logger.info("Total Replays: {0}".format(stats.count))
+    logger.info("Rejected Replays: {0}".format(dict(stats.rejected)))
+    logger.info("Error Replays: {0}".format(stats.errors))
+    logger.info("Quarantined this run: {0}".format(dict(stats.failures)))
+    logger.info("Error Percent: {0}".format(str(stats.error_percent)))
+    logger.info("Error Replays (first {0}): \n  {1}".format(stats.max_error_samples,
+                                                         stats.error_replays))
+    logger.info("Korean replays: \n  {0}".format(dict(stats.korean_replays)))
+    stats.maps.log_unknown(logger)
+    stats.metrics.log_report(logger)
+    if params["metrics_path"] is not None:
+        stats.metrics.write_json(params["metrics_path"])
+    logger.info("Rows written: {0} ({1:.0f} rows/sec, {2:.0f} bytes/sec)".format(
+        stats.writer.rows, stats.writer.rows_per_sec, stats.writer.bytes_per_sec))
+    if cache is not None:
+        logger.info("Cache hits: {0}".format(stats.cache_hits))
 
 
 if __name__ == "__main__":
@@ -1,36 +1,170 @@
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import glob
+from concurrent.futures import (FIRST_COMPLETED, ProcessPoolExecutor,
+                                ThreadPoolExecutor, wait)
+from concurrent.futures.process import BrokenProcessPool
+import collections
+import contextlib
+import io
+import itertools
 import logging
+import multiprocessing
+import signal
 import sys
 import threading
+import time
 import traceback
 
 import spawningtool.parser
-import spawningtool.exception
+from replay_processing import model
+from replay_processing.cache import content_key
+from replay_processing.maps import MapTable
+from replay_processing.metrics import NULL_TIMER, RunMetrics, StageTimer
+from replay_processing.pools import bounded_results
 from replay_processing.sc2scan import is_korean_map, map_process, populate_build_data
+from replay_processing.walk import iter_replay_files
+from replay_processing.writer import CSVWriterStage
 from collections import Counter
 
-FIELD_NAMES = ['map',
-              'first_army_unit_supply',
-              'Game Length(seconds)',
-              'baseBuild',
-              'region',
-              'Winner',
-              'first_army_unit',
-              'first_army_unit_time',
-              'player',
-              'game_category',
-              'build',
-              'unix_timestamp',
-              'player_race',
-              'matchup',
-              'opponent_race',
-              'opponent',
-              'first_tech_path',
-              'Carriers count',
-              'Carrier timing',
-              'Carriers',
-              'replay_file']
+# CSV column name and SideRow attribute of every output column, in order
+COLUMNS = [('map', 'map'),
+           ('map_id', 'map_id'),
+           ('first_army_unit_supply', 'first_army_unit_supply'),
+           ('Game Length(seconds)', 'game_length'),
+           ('baseBuild', 'base_build'),
+           ('region', 'region'),
+           ('Winner', 'winner'),
+           ('first_army_unit', 'first_army_unit'),
+           ('first_army_unit_time', 'first_army_unit_time'),
+           ('player', 'player'),
+           ('game_category', 'game_category'),
+           ('build', 'build'),
+           ('unix_timestamp', 'unix_timestamp'),
+           ('player_race', 'player_race'),
+           ('matchup', 'matchup'),
+           ('opponent_race', 'opponent_race'),
+           ('opponent', 'opponent'),
+           ('first_tech_path', 'first_tech_path'),
+           ('Carriers count', 'carriers_count'),
+           ('Carrier timing', 'carrier_timing'),
+           ('Carriers', 'carriers'),
+           ('replay_file', 'replay_file')]
+
+FIELD_NAMES = [field for field, _ in COLUMNS]
+
+
+class SideRow(object):
+    """One player's side of a replay, one attribute per output column.
+
+    Values keep their native types (ints, floats, bools, None for unknown)
+    and only become strings in row_values. Indexing by CSV column name,
+    row['Game Length(seconds)'], works as it did for the old dict rows.
+    """
+
+    __slots__ = tuple(attr for _, attr in COLUMNS)
+    _attrs = dict(COLUMNS)
+
+    def __init__(self, *values):
+        for attr, value in itertools.zip_longest(self.__slots__, values):
+            setattr(self, attr, value)
+
+    def __getitem__(self, field):
+        return getattr(self, self._attrs[field])
+
+    def update(self, columns):
+        # columns is keyed by CSV column name, like populate_build_data's
+        for field, value in columns.items():
+            setattr(self, self._attrs[field], value)
+
+    def values(self):
+        return [getattr(self, attr) for attr in self.__slots__]
+
+    def _replace(self, **changes):
+        row = SideRow(*self.values())
+        for attr, value in changes.items():
+            setattr(row, attr, value)
+        return row
+
+    def __eq__(self, other):
+        if not isinstance(other, SideRow):
+            return NotImplemented
+        return self.values() == other.values()
+
+    def __repr__(self):
+        return 'SideRow(%s)' % ', '.join('%s=%r' % (attr, getattr(self, attr))
+                                         for attr in self.__slots__)
+
+    def __getstate__(self):
+        return self.values()
+
+    def __setstate__(self, state):
+        SideRow.__init__(self, *state)
+
+
+EXECUTORS = {
+    'thread': ThreadPoolExecutor,
+    'process': ProcessPoolExecutor,
+}
+
+# Everything a worker hands back to parse_replays. Only plain data goes in
+# here so results can cross a process boundary.
+ReplayResult = collections.namedtuple('ReplayResult', ['filename',
+                                                       'sides',
+                                                       'num_players',
+                                                       'error',
+                                                       'korean',
+                                                       'map_name',
+                                                       'matchup',
+                                                       'cached',
+                                                       'rejected',
+                                                       'failure',
+                                                       'seconds',
+                                                       'timings'],
+                                      defaults=(False, None, None, 0., None))
+
+# Why a replay was skipped without being an error (ReplayResult.rejected)
+REJECT_NOT_1V1 = 'not_1v1'
+REJECT_QUARANTINED = 'quarantined'
+
+# Errors counted by kind (ReplayResult.failure). A parse failure is the
+# replay parser giving up on it, a crash a worker process dying while it
+# was in flight. Errors in our own code aren't failures.
+FAILURE_TIMEOUT = 'timeout'
+FAILURE_PARSE = 'parse'
+FAILURE_CRASH = 'crash'
+
+# The failures that get a replay quarantined. Parse failures are cheap to
+# hit again and a parser upgrade may fix them, so they aren't.
+QUARANTINED_FAILURES = (FAILURE_TIMEOUT, FAILURE_CRASH)
+
+# Seconds past --timeout the parent waits for a worker's own timeout
+# before it kills the pool, and how often it checks
+TIMEOUT_GRACE = 2.
+TIMEOUT_POLL = .5
+
+
+class ReplayTimeout(BaseException):
+    # A BaseException so that broad except clauses inside sc2reader and
+    # spawningtool can't swallow it
+    pass
+
+
+@contextlib.contextmanager
+def replay_timeout(seconds):
+    # Signals can only interrupt the main thread, which is where process
+    # pool workers run. Anywhere else the timeout can't be enforced.
+    if not seconds or threading.current_thread() is not threading.main_thread():
+        yield
+        return
+
+    def expired(signum, frame):
+        raise ReplayTimeout()
+
+    previous = signal.signal(signal.SIGALRM, expired)
+    signal.setitimer(signal.ITIMER_REAL, seconds)
+    try:
+        yield
+    finally:
+        signal.setitimer(signal.ITIMER_REAL, 0)
+        signal.signal(signal.SIGALRM, previous)
 
 
 def classify_matchup(parsed):
@@ -42,158 +176,481 @@ def not_one_on_one(parsed_data):
     return parsed_data["game_type"] != "1v1" or len(parsed_data["players"]) != 2
 
 
-def extract_player_data(result, player, logger, debug=False):
+def extract_player_data(result, player, logger, debug=False, timer=NULL_TIMER):
     # TODO: what about other types of games?
     opponent = 2 if player == 1 else 1
+    players = result['players']
 
-    # Our main hash
-    data = {}
+    row = SideRow()
     # Map
     # fix map_process debug handling
-    data["map"] = map_process(result["map"], logger)
+    row.map = map_process(result["map"], logger)
 
     # Matchup
-    data["matchup"] = classify_matchup(result)
+    row.matchup = classify_matchup(result)
 
     # Player, opponent, and race
-    data['player'] = result['players'][player]['name']
-    data['opponent'] = result['players'][opponent]['name']
-    data['player_race'] = result['players'][player]['race']
-    data['opponent_race'] = result['players'][opponent]['race']
-
-    # Winner
-    # TODO: Why does this have to be string? Can we refactor this?
-    # Winner
-    if result['players'][player]['is_winner']:
-        data['Winner'] = "True"
-    elif result['players'][opponent]['is_winner']:
-        data['Winner'] = "False"
-    else:
-        data['Winner'] = 'unknown'
+    row.player = players[player]['name']
+    row.opponent = players[opponent]['name']
+    row.player_race = players[player]['race']
+    row.opponent_race = players[opponent]['race']
+
+    # Winner, None when neither side is marked as the winner
+    if players[player]['is_winner']:
+        row.winner = True
+    elif players[opponent]['is_winner']:
+        row.winner = False
 
     # Game Length(seconds)
-    data["Game Length(seconds)"] = str(result["frames"] / 16.)
+    row.game_length = result["frames"] / 16.
 
     # Region (eu, kr, na)
-    data["region"] = result["region"]
+    row.region = result["region"]
 
     # Category (ladder, custom, etc)
-    data['game_category'] = result['category']
+    row.game_category = result['category']
 
     # StarCraft version information
-    data['build'] = str(result['build'])
-    data['baseBuild'] = str(result['baseBuild'])
+    row.build = result['build']
+    row.base_build = result['baseBuild']
 
     # The UTC time (according to the client NOT the server) thaat the game
     # was ended as represented by the Unix OS
-    data['unix_timestamp'] = str(result['unix_timestamp'])
+    row.unix_timestamp = result['unix_timestamp']
 
     # Fix populate_build_data debug handling
-    data.update(populate_build_data(result['players'][player], logger))
+    with timer.stage('build_order'):
+        row.update(populate_build_data(players[player], logger))
 
-    return data
+    return row
 
 
-def dump(data, outfile):
-    # TODO: Fix this up
-    outfile.write(",".join([str(data[field]) for field in FIELD_NAMES]))
-    outfile.write("\n")
+# What an unknown value is written as, "unknown" for a winner and "None"
+# (rather than csv's empty field) for the rest
+_NULL_TEXT = ['unknown' if field == 'Winner' else 'None'
+              for field in FIELD_NAMES]
 
 
-def print_results(result, logger):
+def row_values(row):
+    # csv.writer turns ints, floats and bools into the same text str() of
+    # them gives, so only missing values need handling here
+    return [null if value is None else value
+            for value, null in zip(row.values(), _NULL_TEXT)]
+
+
+def print_results(result, logger, timer=NULL_TIMER):
     # print out a column of data
-    both_data = [extract_player_data(result, k, logger) for k in [1, 2]]
+    both_data = [extract_player_data(result, k, logger, timer=timer)
+                 for k in [1, 2]]
     return both_data
 
 
-def worker(filename, all_replays, logger):
-    # TODO: This can be set up better
-    data = {
-        "sides": []
-    }
+def worker(filename, all_replays, logger, cache=None, rebuild_cache=False,
+           timeout=None):
+    start = time.perf_counter()
+    timer = StageTimer()
+    result = cached_worker(filename, all_replays, logger, cache,
+                           rebuild_cache, timeout, timer)
+    return result._replace(seconds=time.perf_counter() - start,
+                           timings=timer.timings)
+
+
+def cached_worker(filename, all_replays, logger, cache, rebuild_cache,
+                  timeout, timer):
+    try:
+        with timer.stage('read'):
+            with open(filename, 'rb') as fh:
+                content = fh.read()
+    except OSError:
+        traceback.print_exc()
+        return ReplayResult(filename, [], 0, True, False, None, None)
+
+    if cache is None:
+        return parse_worker(filename, content, all_replays, logger, timeout,
+                            timer)
+
+    # all_replays decides which games are rejected, so it is part of the key
+    key = content_key(content, 'all' if all_replays else '1v1')
+    if not rebuild_cache:
+        with timer.stage('cache'):
+            cached = cache.get(key)
+        if cached is not None:
+            # The same replay may live under another path than when it was cached
+            sides = [side._replace(replay_file=filename)
+                     for side in cached.sides]
+            return cached._replace(filename=filename, sides=sides, cached=True)
+
+    result = parse_worker(filename, content, all_replays, logger, timeout,
+                          timer)
+    if result.error:
+        # Timeouts aren't a property of the replay alone, and parse
+        # failures and other errors may be fixed by an upgrade or code change
+        return result
+    try:
+        with timer.stage('cache'):
+            cache.put(key, result)
+    except OSError as e:
+        logger.warning("Unable to cache {0}: {1}".format(filename, e))
+    return result
+
+
+def parse_worker(filename, content, all_replays, logger, timeout=None,
+                 timer=NULL_TIMER):
+    # Both the header load and spawningtool read from the same bytes
+    def replay_file():
+        return io.BytesIO(content)
+
+    try:
+        with replay_timeout(timeout):
+            return extract_worker(filename, replay_file, all_replays, logger,
+                                  timer)
+    except model.ReplayParseError as e:
+        logger.warning("Unable to parse {0}: {1!r}".format(filename, e.exc))
+        return failed_result(filename, FAILURE_PARSE)
+    except ReplayTimeout:
+        logger.warning("Timed out after {0}s: {1}".format(timeout, filename))
+        return failed_result(filename, FAILURE_TIMEOUT)
+    except Exception:
+        logger.exception("Error processing {0}".format(filename))
+        return failed_result(filename, None)
+
+
+def failed_result(filename, failure):
+    return ReplayResult(filename, [], 0, True, False, None, None,
+                        failure=failure)
+
+
+def extract_worker(filename, replay_file, all_replays, logger, timer):
+    sides = []
     num_players = 0
-    error_replay = False
     korean = False
     map_name = None
     matchup = None
+    if not all_replays:
+        # A header-only load is enough to throw away non 1v1 games
+        with timer.stage('header'):
+            header = model.load_header(replay_file())
+        if header.game_type != "1v1" or header.num_players != 2:
+            logger.debug("Rejected {0}: {1}".format(filename, REJECT_NOT_1V1))
+            return ReplayResult(filename, sides, header.num_players, False,
+                                korean, map_name, matchup,
+                                rejected=REJECT_NOT_1V1)
+
+    # Run the spawning tool to parse our replay files
+    with timer.stage('parse'):
+        try:
+            parsed = spawningtool.parser.parse_replay(replay_file())
+        except Exception as e:
+            # Whatever escapes the parser is a replay it can't read
+            raise model.ReplayParseError(filename, e)
+    num_players = len(parsed["players"])
+    logger.debug(filename)
+    logger.debug("Number of players in match: {0}".format(num_players))
+
+    # We don't want any not 1v1 matches if all_replays flag is false
+    if not_one_on_one(parsed) and not all_replays:
+        return ReplayResult(filename, sides, num_players, False,
+                            korean, map_name, matchup,
+                            rejected=REJECT_NOT_1V1)
+
+    # Keep track of all the Korean maps (??)
+    korean = is_korean_map(parsed["map"])
+    map_name = parsed['map']
+
+    # Keep track of matchup stats(really don't need this anymore)
+    matchup = classify_matchup(parsed)
+    logger.debug("Matchup: {0}".format(matchup))
+
+    with timer.stage('extract'):
+        sides = print_results(parsed, logger, timer)
+    for side in sides:
+        side.replay_file = filename
+
+    return ReplayResult(filename, sides, num_players, False,
+                        korean, map_name, matchup)
+
+
+class ScanStats(object):
+    """Aggregate counters of a scan, cheap to keep for any number of replays.
+
+    Rejected replays are counted by reason in rejected, apart from errors.
+    Only the first max_error_samples error paths are kept. Worker timings
+    are collected in metrics, map names of good replays in maps, whose
+    unknown names are the ones missing from the map table. Their map IDs
+    are handed out here, in the one process that sees every replay, and
+    set on the sides' map_id. match_data is a list of every replay's data
+    only when keep_match_data is set.
+    """
+
+    def __init__(self, max_error_samples=100, keep_match_data=False):
+        self.max_error_samples = max_error_samples
+        self.count = 0
+        self.errors = 0
+        self.rejected = Counter()
+        self.error_replays = []
+        self.match_stats = Counter()
+        self.korean_replays = Counter()
+        self.failures = Counter()
+        self.metrics = RunMetrics()
+        self.cache_hits = 0
+        self.maps = MapTable.load()
+        self.writer = None
+        self.match_data = [] if keep_match_data else None
+
+    def add(self, result):
+        self.count += 1
+        if result.rejected != REJECT_QUARANTINED:
+            self.metrics.add_replay(result.filename, result.seconds,
+                                    result.timings)
+        if result.cached:
+            self.cache_hits += 1
+        if result.error:
+            self.errors += 1
+            if result.failure:
+                self.failures[result.failure] += 1
+            if len(self.error_replays) < self.max_error_samples:
+                self.error_replays.append(result.filename)
+            return
+        if result.rejected:
+            self.rejected[result.rejected] += 1
+            return
+
+        self.match_stats[result.matchup] += 1
+        map_id = self.maps.map_id(result.map_name)
+        for side in result.sides:
+            side.map_id = map_id
+        if result.korean:
+            self.korean_replays[result.map_name] += 1
+        if self.match_data is not None:
+            self.match_data.append({"sides": result.sides})
+
+    @property
+    def error_percent(self):
+        return self.errors / float(self.count) if self.count else 0.
+
+
+# Where process pool workers report (filename, start time) to the parent
+_start_times = None
+
+
+def _init_process_worker(start_times):
+    global _start_times
+    _start_times = start_times
+
+
+def _process_worker(filename, *args):
+    _start_times.put((filename, time.time()))
+    return worker(filename, *args)
+
+
+def _kill_workers(pool):
+    # ProcessPoolExecutor has no public way to stop a running call
+    for process in list(pool._processes.values()):
+        process.kill()
+
+
+def thread_results(filenames, num_workers, max_in_flight, worker_args):
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        yield from bounded_results(
+            lambda filename: pool.submit(worker, filename, *worker_args),
+            filenames, max_in_flight)
+
+
+def process_results(filenames, num_workers, max_in_flight, worker_args,
+                    timeout, logger):
+    """Results of worker(filename, *worker_args) in a process pool that
+    outlives its workers.
+
+    A worker that dies breaks the whole pool. Every replay a worker had
+    started then gets a crash failure, as any of them may have done it,
+    the ones still queued are run again by a fresh pool. A worker still
+    busy timeout seconds after it started a replay, its own timeout having
+    failed, is killed along with the pool. That replay gets a timeout
+    failure and the others in flight are run again.
+    """
+    # Puts go straight to the pipe, so a start is seen even when the
+    # worker dies right after it
+    start_times = multiprocessing.SimpleQueue()
+    started = {}
+
+    def new_pool():
+        return ProcessPoolExecutor(max_workers=num_workers,
+                                   initializer=_init_process_worker,
+                                   initargs=(start_times, ))
+
+    def drain_start_times():
+        while not start_times.empty():
+            filename, start = start_times.get()
+            started[filename] = start
+
+    retry = collections.deque()
+    in_flight = {}
+    pool = new_pool()
     try:
-        # Run the spawning tool to parse our replay files
-        parsed = spawningtool.parser.parse_replay(filename)
-        num_players = len(parsed["players"])
-        logger.debug(filename)
-        logger.debug("Number of players in match: {0}".format(num_players))
-
-        # We don't want any not 1v1 matches if all_replays flag is false
-        if not_one_on_one(parsed) and not all_replays:
-            error_replay = True
-            return data, num_players, error_replay, is_korean_map, map_name, matchup
-
-        # Keep track of all the Korean maps (??)
-        korean = is_korean_map(parsed["map"])
-        map_name = parsed['map']
-
-        # Keep track of matchup stats(really don't need this anymore)
-        matchup = classify_matchup(parsed)
-        logger.debug("Matchup: {0}".format(matchup))
-
-        for player_side in print_results(parsed, logger):
-            player_data = {}
-            player_data['replay_file'] = filename
-            player_data.update(player_side)
-            data["sides"].append(player_data)
-            # results.append(data)
-
-        return data, num_players, error_replay, korean, map_name, matchup
-    except (spawningtool.exception.ReadError, IndexError, KeyError, AttributeError) as e:
-        traceback.print_exc()
-        error_replay = True
-        return data, num_players, error_replay, korean, map_name, matchup
+        while True:
+            while len(in_flight) < max_in_flight:
+                filename = retry.popleft() if retry else next(filenames,
+                                                              None)
+                if filename is None:
+                    break
+                in_flight[pool.submit(_process_worker, filename,
+                                      *worker_args)] = filename
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight,
+                           timeout=TIMEOUT_POLL if timeout else None,
+                           return_when=FIRST_COMPLETED)
+            broken = any(isinstance(future.exception(), BrokenProcessPool)
+                         for future in done)
+            # Also keeps the pipe from filling up and blocking workers
+            drain_start_times()
+            expired = []
+            if timeout and not broken:
+                now = time.time()
+                expired = [future for future, filename in in_flight.items()
+                           if not future.done() and
+                           now - started.get(filename, now) >
+                           timeout + TIMEOUT_GRACE]
+                if expired:
+                    _kill_workers(pool)
+            if not broken and not expired:
+                for future in done:
+                    started.pop(in_flight.pop(future), None)
+                    yield future.result()
+                continue
+
+            # The pool is gone, whatever was in flight either finished
+            # before it went or is lost with it
+            wait(in_flight)
+            drain_start_times()
+            for future, filename in in_flight.items():
+                if future.exception() is None:
+                    yield future.result()
+                elif future in expired:
+                    logger.warning("Killed after {0}s: {1}".format(timeout,
+                                                                  filename))
+                    yield failed_result(filename, FAILURE_TIMEOUT)
+                elif broken and filename in started:
+                    logger.error("A worker died with {0} in flight".format(
+                        filename))
+                    yield failed_result(filename, FAILURE_CRASH)
+                else:
+                    retry.append(filename)
+            in_flight = {}
+            started.clear()
+            pool.shutdown()
+            pool = new_pool()
+    finally:
+        pool.shutdown(cancel_futures=True)
+
+
+def iter_replay_results(root_dir, num_threads,
+                        logger=logging.getLogger("replayParser"),
+                        max_replays=None, all_replays=False,
+                        executor='thread', cache=None, rebuild_cache=False,
+                        max_in_flight=None, timeout=None, quarantine=None,
+                        retry_quarantined=False):
+    # Run our replay parsing in a thread or process pool. Workers only parse,
+    # writing and the counters stay with the consumer of these results.
+    # Enough work is queued to keep every worker busy.
+    max_in_flight = max_in_flight or num_threads * 2
+
+    if timeout and executor != 'process':
+        # Only a separate process can be stopped when a replay hangs
+        raise ValueError("Replay timeouts need the process executor")
+
+    replay_files = iter_replay_files(root_dir)
+    if max_replays is not None:
+        # Stops the directory walk once enough replays were found
+        replay_files = itertools.islice(replay_files, max_replays)
+
+    skipped = []
+    if quarantine is not None and not retry_quarantined:
+        def unquarantined(filenames):
+            for filename in filenames:
+                if filename in quarantine:
+                    skipped.append(filename)
+                else:
+                    yield filename
+        replay_files = unquarantined(replay_files)
+
+    def quarantined():
+        while skipped:
+            yield ReplayResult(skipped.pop(), [], 0, False, False, None,
+                               None, rejected=REJECT_QUARANTINED)
+
+    worker_args = (all_replays, logger, cache, rebuild_cache, timeout)
+    if executor == 'process':
+        results = process_results(replay_files, num_threads, max_in_flight,
+                                  worker_args, timeout, logger)
+    else:
+        results = thread_results(replay_files, num_threads, max_in_flight,
+                                 worker_args)
+    for result in results:
+        yield from quarantined()
+        if (result.failure in QUARANTINED_FAILURES and
+                quarantine is not None):
+            quarantine.add(result.filename, result.failure, result.seconds)
+        yield result
+    yield from quarantined()
+
+    if cache is not None:
+        cache.prune(logger)
+
+
+def iter_replay_rows(root_dir, num_threads, stats=None, **kwargs):
+    """Lazily yield the side rows of every 1v1 replay under root_dir.
+
+    Takes the same keyword arguments as iter_replay_results. Pass a
+    ScanStats as stats to have it updated while rows are consumed.
+    """
+    if stats is None:
+        # It hands out the rows' map IDs
+        stats = ScanStats()
+    for result in iter_replay_results(root_dir, num_threads, **kwargs):
+        stats.add(result)
+        if not result.error and not result.rejected:
+            for side in result.sides:
+                yield side
 
 
 def parse_replays(root_dir, num_threads,
                   logger=logging.getLogger("replayParser"),
                   max_replays=None, all_replays=False,
-                  outfile=None):
-
-    outfile = outfile or sys.stdout
-    dump_lock = threading.Lock()
-    # Run our replay parsing in a thread pool executor with 5 workers.
-    match_data = []
-    count = 0
-    errors = 0
-    error_replays = []
-    match_stats = Counter()
-    korean_replays = []
-
-    outfile.write(','.join(FIELD_NAMES))
-    outfile.write('\n')
-
-    with ThreadPoolExecutor(max_workers=num_threads) as executor:
-        future_to_replay = {}
-        replay_files = glob.glob("{root_dir}/**/*.SC2Replay".format(root_dir=root_dir), recursive=True)
-        replay_files = replay_files[:max_replays] if max_replays is not None else replay_files
-        for filename in replay_files:
-            # mark each future with the replay filename
-            future_to_replay[executor.submit(worker, filename, all_replays, logger)] = filename
-
-        for future in as_completed(future_to_replay):
-            r_file = future_to_replay[future]
-            data, num_players, error, in_korean, map_name, matchup = future.result()
-            if error:
-                count += 1
-                errors = errors + 1
-                error_replays.append(r_file)
-                continue
-            else:
-                match_stats[matchup] += 1
-                count += 1
-                for item in data["sides"]:
-                    # TODO: Instead of this, should just do a full dump at the end and write a proper CSV file
-                    with dump_lock:
-                        dump(item, outfile)
-                # Take data from futures and add to proper
-                match_data.append(data)
-                if in_korean:
-                    korean_replays.append(map_name)
-
-        return match_data, count, errors, error_replays, match_stats, korean_replays
+                  outfile=None, executor='thread', cache=None,
+                  rebuild_cache=False, max_in_flight=None, stream=False,
+                  max_error_samples=100, writer=None, timeout=None,
+                  quarantine=None, retry_quarantined=False):
+
+    # In stream mode rows are dropped once written, otherwise every replay's
+    # data is also kept in stats.match_data
+    stats = ScanStats(max_error_samples, keep_match_data=not stream)
+    # Rows go to outfile as CSV unless another writer stage is given
+    if writer is None:
+        writer = CSVWriterStage(outfile or sys.stdout, FIELD_NAMES, row_values)
+    stats.writer = writer.start()
+
+    try:
+        for result in iter_replay_results(root_dir, num_threads,
+                                          logger=logger,
+                                          max_replays=max_replays,
+                                          all_replays=all_replays,
+                                          executor=executor,
+                                          cache=cache,
+                                          rebuild_cache=rebuild_cache,
+                                          max_in_flight=max_in_flight,
+                                          timeout=timeout,
+                                          quarantine=quarantine,
+                                          retry_quarantined=retry_quarantined):
+            stats.add(result)
+            if not result.error and not result.rejected:
+                stats.writer.put(result.sides)
+    finally:
+        stats.writer.close()
+        for seconds in stats.writer.write_seconds:
+            stats.metrics.add_stage('serialize', seconds)
+        for seconds in stats.writer.put_seconds:
+            stats.metrics.add_stage('queue_wait', seconds)
+
+    return stats
@@ -1,3 +1,7 @@
+import functools
+import logging
+
+from replay_processing.maps import default_table
 
 
 army_units = ['Marine',
@@ -66,98 +70,197 @@ tech_paths = ['Stargate',
               'RoachWarren']
 
 
+# Set versions of the lists above for the build order scan
+ARMY_UNITS = frozenset(army_units)
+TECH_PATHS = frozenset(tech_paths)
+TERRAN_MECH_UPGRADES = frozenset(terran_mech_upgrades)
+
+
+@functools.lru_cache(maxsize=4096)
 def time_to_seconds(time):
+    # Build order times repeat a lot across players, so parse each only once
     minutes, seconds = time.split(':')
-    return str(60 * int(minutes) + int(seconds))
+    return 60 * int(minutes) + int(seconds)
 
 
-def populate_build_data(player, logger):
-    data = {}
-    if logger and False:
-        for event in player['buildOrder']:
-            if not event['is_worker']:
-                logger.debug('debug: {} {} {}{}'.format(
-                             event['supply'],
-                             event['time'],
-                             event['name'],
-                             ' (Chronoboosted)' if event['is_chronoboosted'] else ''))
-
-    data.update(first_army_unit(player, logger))
-    data.update(carriers_count(player))
-    data.update(determine_tech_path(player, logger))
+FEATURES = []
 
-    return data
+# Bump whenever a feature's output changes for the same replay, cached
+# results are keyed by it
+FEATURES_VERSION = 1
 
 
-def carriers_count(player):
+def register_feature(cls):
+    """Add a BuildFeature to the columns populate_build_data produces."""
+    FEATURES.append(cls)
+    return cls
+
+
+class BuildFeature(object):
+    """Accumulates one group of columns during a single build order scan.
+
+    update() is only called with non-worker events whose name is in
+    event_names (every non-worker event if event_names is None) and returns
+    True once the feature needs no more events. result() returns the
+    columns.
+    """
+
+    event_names = None
+
+    def __init__(self, logger):
+        self.logger = logger
+
+    def update(self, event):
+        raise NotImplementedError
+
+    def result(self):
+        raise NotImplementedError
+
+
+@register_feature
+class FirstArmyUnit(BuildFeature):
+    event_names = ARMY_UNITS
+
+    def __init__(self, logger):
+        super(FirstArmyUnit, self).__init__(logger)
+        self.event = None
+
+    def update(self, event):
+        self.logger.debug("debug: First army unit found %s", event['name'])
+        self.event = event
+        return True
+
+    def result(self):
+        if self.event is None:
+            return {'first_army_unit': None,
+                    'first_army_unit_supply': None,
+                    'first_army_unit_time': None}
+        return {'first_army_unit': self.event['name'],
+                'first_army_unit_supply': self.event['supply'],
+                'first_army_unit_time': time_to_seconds(self.event['time'])}
+
+
+@register_feature
+class Carriers(BuildFeature):
+    event_names = frozenset(['Carrier'])
+
+    def __init__(self, logger):
+        super(Carriers, self).__init__(logger)
+        self.count = 0
+        self.timing = 0
+
+    def update(self, event):
+        if self.count == 0:
+            self.timing = time_to_seconds(event['time'])
+        self.count += 1
+        return False
+
+    def result(self):
+        return {'Carriers count': self.count,
+                'Carrier timing': self.timing,
+                'Carriers': self.count > 0}
+
+
+@register_feature
+class FirstTechPath(BuildFeature):
+    event_names = TECH_PATHS
+
+    def __init__(self, logger):
+        super(FirstTechPath, self).__init__(logger)
+        self.tech_path = None
+
+    def update(self, event):
+        self.logger.debug("debug: First tech path found %s", event['name'])
+        if event['name'] in TERRAN_MECH_UPGRADES:
+            self.tech_path = 'Mech'
+        else:
+            self.tech_path = event['name']
+        return True
+
+    def result(self):
+        return {'first_tech_path': self.tech_path}
+
+
+@functools.lru_cache(maxsize=None)
+def _dispatch_table(feature_classes):
+    # event name -> indexes of the features that want it, the indexes of
+    # features that want every event, and per feature the names no other
+    # feature wants
+    catch_all = tuple(i for i, cls in enumerate(feature_classes)
+                      if cls.event_names is None)
+    by_name = {}
+    for i, cls in enumerate(feature_classes):
+        for name in cls.event_names or ():
+            by_name.setdefault(name, set()).add(i)
+    owned = tuple(frozenset(name for name in cls.event_names or ()
+                            if len(by_name[name]) == 1)
+                  for cls in feature_classes)
+    return ({name: tuple(sorted(indexes.union(catch_all)))
+             for name, indexes in by_name.items()},
+            catch_all, owned)
+
+
+def scan_build_order(build_order, feature_classes, logger):
+    """Run feature_classes over build_order in one pass and merge results."""
+    feature_classes = tuple(feature_classes)
+    features = [cls(logger) for cls in feature_classes]
+    by_name, catch_all, owned = _dispatch_table(feature_classes)
+    # Names drop out of live once every feature wanting them is finished,
+    # so most events cost a single set lookup
+    live = set(by_name)
+    done = [False] * len(features)
+    active = len(features)
+    for event in build_order:
+        name = event['name']
+        if name not in live and not catch_all:
+            continue
+        if event['is_worker']:
+            continue
+        wanted = False
+        for i in by_name.get(name, catch_all):
+            if done[i]:
+                continue
+            if features[i].update(event):
+                done[i] = True
+                active -= 1
+                live.difference_update(owned[i])
+            else:
+                wanted = True
+        if not wanted:
+            if not active:
+                break
+            if not catch_all:
+                live.discard(name)
+
     data = {}
-    data['Carriers count'] = 0
-    data['Carrier timing'] = 0
-    data['Carriers'] = "False"
-    for event in player['buildOrder']:
-        if not event['is_worker']:
-            if event['name'] == 'Carrier':
-                data['Carriers'] = "True"
-                data['Carriers count'] += 1
-                if data['Carrier timing'] == 0:
-                    data['Carrier timing'] = time_to_seconds(event['time'])
-    data['Carriers count'] = str(data['Carriers count'])
+    for feature in features:
+        data.update(feature.result())
     return data
 
 
+def populate_build_data(player, logger):
+    return scan_build_order(player['buildOrder'], FEATURES, logger)
+
+
+def carriers_count(player):
+    return scan_build_order(player['buildOrder'], [Carriers],
+                            logging.getLogger("replayParser"))
+
+
 def first_army_unit(player, logger):
-    data = {}
-    data['first_army_unit'] = None
-    data['first_army_unit_supply'] = None
-    data['first_army_unit_time'] = None
-    for event in player['buildOrder']:
-        if not event['is_worker']:
-            if event['name'] in army_units:
-                logger.debug("debug: First army unit found", event['name'])
-                data['first_army_unit'] = event['name']
-                data['first_army_unit_supply'] = str(event['supply'])
-                data['first_army_unit_time'] = time_to_seconds(event['time'])
-                break
-    return data
+    return scan_build_order(player['buildOrder'], [FirstArmyUnit], logger)
 
 
 def map_process(map, logger):
-    map = unkorean_maps(map, logger)
-    splits = map.split(" ")
-    if "LE" in splits:
-        splits.remove("LE")
-    if "TE" in splits:
-        splits.remove("TE")
-    if "(Void)" in splits:
-        splits.remove("(Void)")
-
-    return " ".join(splits)
+    return default_table().canonical(map)
 
 
 # References
 # http://sc2.blizzard.cn/articles/1001/76078
 # http://tw.battle.net/sc2/zh/blog/20372511/2016-%E7%AC%AC-6-%E8%B3%BD%E5%AD%A3%E5%85%A8%E6%96%B0%E5%A4%A9%E6%A2%AF%E5%9C%B0%E5%9C%96-2016-11-17
+# The translations live in map_names.json
 def unkorean_maps(map, logger):
-    # TODO: Make a dict object with the translations
-    logger.debug("Map: {0}".format(map))
-    if u'回聲 - 天梯版' in map:
-        return 'Echo'
-    if u'密林濕地 - 天梯版' in map:
-        return 'Overgrowth'
-    if u'旋風之境 - 天梯版' in map:
-        return 'Whirlwind'
-    if u'紐科克管轄區 - 聯賽版' in map:
-        return 'Newkirk Precinct'
-    if u'新柯尔克辖区-锦标赛版' in map:
-        return 'Newkirk Precinct'
-    if u'殖民站 - 天梯版' in map:
-        return 'Habitation Station'
-    if u'瓦尼研究站' in map:
-        return 'Vaani Research Station'
-    if u'破曉黎明 - 天梯版' in map:
-        return 'Daybreak'
-    logger.debug("No match")
-    return map
+    return default_table().translate(map)
 
 
 def is_korean_map(map):
@@ -170,15 +273,4 @@ def is_korean_map(map):
 
 
 def determine_tech_path(player, logger):
-    data = {}
-    data['first_tech_path'] = None
-    for event in player['buildOrder']:
-        if not event['is_worker']:
-            if event['name'] in tech_paths:
-                logger.debug("debug: First tech path found", event['name'])
-                if event['name'] in terran_mech_upgrades:
-                    data['first_tech_path'] = 'Mech'
-                else:
-                    data['first_tech_path'] = event['name']
-                break
-    return data
+    return scan_build_order(player['buildOrder'], [FirstTechPath], logger)
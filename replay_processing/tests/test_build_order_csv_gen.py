@@ -0,0 +1,107 @@
+import io
+import os
+import shutil
+import sys
+import tempfile
+
+from replay_processing import build_order_csv_gen
+from replay_processing import buildstore
+from replay_processing.tests import base
+
+
+class BuildOrderCsvGenTestCase(base.TestCase):
+    def setUp(self):
+        super(BuildOrderCsvGenTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.replays = os.path.join(self.root, 'replays')
+        self.output = os.path.join(self.root, 'csv')
+        os.makedirs(self.replays)
+        os.makedirs(self.output)
+        self.generated = []
+
+        def gen_csv(replay_path, output_path):
+            self.generated.append(os.path.basename(replay_path))
+            if 'short' in replay_path:
+                return build_order_csv_gen.TOO_SHORT
+            with open(output_path, 'w') as fh:
+                fh.write('time team event_type event_name\n')
+            return build_order_csv_gen.GENERATED
+        self.patch(build_order_csv_gen, 'gen_csv', gen_csv)
+
+    def _write(self, name, content=b'replay'):
+        with open(os.path.join(self.replays, name), 'wb') as fh:
+            fh.write(content)
+
+    def _run(self, *args):
+        self.generated = []
+        out = io.StringIO()
+        self.patch(sys, 'argv', ['build-order-csv-gen', self.replays,
+                                 self.output, '-w', '1'] + list(args))
+        self.patch(sys, 'stdout', out)
+        build_order_csv_gen.main()
+        return out.getvalue().strip().splitlines()[-1]
+
+    def test_mtime_check(self):
+        self._write('abc.SC2Replay')
+        self._write('short.SC2Replay')
+        self.assertEqual('Generated 1, skipped 0, too short 1, '
+                         'non 2 player 0, failed 0', self._run())
+        self.assertTrue(os.path.exists(
+            os.path.join(self.output, 'a', 'abc.csv')))
+
+        # Rejected replays have no csv, their unchanged mtime is enough
+        self.assertEqual('Generated 0, skipped 2, too short 0, '
+                         'non 2 player 0, failed 0', self._run())
+        self.assertEqual([], self.generated)
+
+        os.utime(os.path.join(self.replays, 'short.SC2Replay'), (1, 1))
+        self.assertEqual('Generated 0, skipped 1, too short 1, '
+                         'non 2 player 0, failed 0', self._run())
+        self.assertEqual(['short.SC2Replay'], self.generated)
+
+        self._run('--force')
+        self.assertEqual(['abc.SC2Replay', 'short.SC2Replay'],
+                         sorted(self.generated))
+
+    def test_hash_check(self):
+        self._write('abc.SC2Replay')
+        self._write('short.SC2Replay')
+        self._run('--check', 'hash')
+        self.assertEqual('Generated 0, skipped 2, too short 0, '
+                         'non 2 player 0, failed 0',
+                         self._run('--check', 'hash'))
+
+        # Touched but identical replays are still skipped
+        os.utime(os.path.join(self.replays, 'abc.SC2Replay'), (1, 1))
+        self._write('short.SC2Replay', b'changed')
+        self._run('--check', 'hash')
+        self.assertEqual(['short.SC2Replay'], self.generated)
+
+    def test_failures_dont_stop_the_run(self):
+        def build_order_rows(path):
+            raise OSError('unreadable')
+        self.patch(build_order_csv_gen, 'check_replay', lambda path: None)
+        self.patch(build_order_csv_gen, 'build_order_rows', build_order_rows)
+        self._write('abc.SC2Replay')
+        self._write('def.SC2Replay')
+        self.assertEqual('Generated 0, skipped 0, too short 0, '
+                         'non 2 player 0, failed 2',
+                         self._run('--format', 'packed'))
+
+    def test_packed(self):
+        self.patch(build_order_csv_gen, 'check_replay', lambda path: None)
+        self.patch(build_order_csv_gen, 'build_order_rows',
+                   lambda path: iter([(30, 1, 'building', 'Gateway')]))
+        self._write('abc.SC2Replay')
+        self.assertEqual('Generated 1, skipped 0, too short 0, '
+                         'non 2 player 0, failed 0',
+                         self._run('--format', 'packed'))
+        self.assertEqual('Generated 0, skipped 1, too short 0, '
+                         'non 2 player 0, failed 0',
+                         self._run('--format', 'packed'))
+
+        with buildstore.BuildOrderStore(self.output) as store:
+            replay = os.path.join(self.replays, 'abc.SC2Replay')
+            self.assertEqual([(30, 1, 'building', 'Gateway')],
+                             store.rows(replay))
@@ -0,0 +1,112 @@
+import os
+import shutil
+import tempfile
+
+from replay_processing import build_order_clustering
+from replay_processing import buildstore
+from replay_processing.tests import base
+
+
+ROWS = [(30, 1, 'building', 'Gateway'),
+        (95, 2, 'army', 'Zergling'),
+        (120, 1, 'upgrade', 'WarpGateResearch'),
+        (140, 2, 'army', 'Zergling')]
+
+
+class BuildOrderStoreTestCase(base.TestCase):
+    def setUp(self):
+        super(BuildOrderStoreTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.path = os.path.join(self.root, 'store')
+
+    def test_roundtrip(self):
+        with buildstore.BuildOrderStore(self.path, mode='a') as store:
+            store.append('a.SC2Replay', ROWS, mtime=1.5)
+            store.append('b.SC2Replay', ROWS[:1])
+        self.assertTrue(buildstore.is_build_order_store(self.path))
+
+        with buildstore.BuildOrderStore(self.path) as store:
+            self.assertEqual(['a.SC2Replay', 'b.SC2Replay'], list(store))
+            self.assertEqual(ROWS, store.rows('a.SC2Replay'))
+            self.assertEqual(ROWS[:1], store.rows('b.SC2Replay'))
+            self.assertEqual(1.5, store.index['a.SC2Replay']['mtime'])
+            # Names are interned once
+            self.assertEqual(['building', 'Gateway', 'army', 'Zergling',
+                              'upgrade', 'WarpGateResearch'], store.names)
+
+    def test_append_again_and_partial_tail(self):
+        with buildstore.BuildOrderStore(self.path, mode='a') as store:
+            store.append('a.SC2Replay', ROWS)
+        # What a writer killed between the events and index lines leaves
+        with open(os.path.join(self.path, buildstore.EVENTS_FILE),
+                  'ab') as fh:
+            fh.write(b'\0' * 100)
+        with buildstore.BuildOrderStore(self.path, mode='a') as store:
+            store.append('a.SC2Replay', ROWS[2:])
+            store.append('b.SC2Replay', ROWS[:2])
+
+        with buildstore.BuildOrderStore(self.path) as store:
+            self.assertEqual(ROWS[2:], store.rows('a.SC2Replay'))
+            self.assertEqual(ROWS[:2], store.rows('b.SC2Replay'))
+            self.assertEqual(len(ROWS) + 4, len(store.events))
+
+    def test_corrupt_index_line(self):
+        with buildstore.BuildOrderStore(self.path, mode='a') as store:
+            store.append('a.SC2Replay', ROWS)
+            store.append('b.SC2Replay', ROWS[1:])
+            store.append('c.SC2Replay', ROWS[:1])
+        index_path = os.path.join(self.path, buildstore.INDEX_FILE)
+        with open(index_path) as fh:
+            lines = fh.readlines()
+        lines[1] = '{"replay": "b.SC2Re\x00\n'
+        with open(index_path, 'w') as fh:
+            fh.writelines(lines)
+
+        # Only b is lost, c and its events are kept by a writer
+        with buildstore.BuildOrderStore(self.path, mode='a') as store:
+            self.assertEqual(['a.SC2Replay', 'c.SC2Replay'], list(store))
+            store.append('d.SC2Replay', ROWS[2:])
+        with buildstore.BuildOrderStore(self.path) as store:
+            self.assertEqual(ROWS, store.rows('a.SC2Replay'))
+            self.assertEqual(ROWS[:1], store.rows('c.SC2Replay'))
+            self.assertEqual(ROWS[2:], store.rows('d.SC2Replay'))
+
+    def test_torn_last_lines(self):
+        with buildstore.BuildOrderStore(self.path, mode='a') as store:
+            store.append('a.SC2Replay', ROWS[:1])
+        # A writer killed half way through its name and index lines
+        for name, torn in ((buildstore.NAMES_FILE, '"Stal'),
+                           (buildstore.INDEX_FILE, '{"replay": "b.')):
+            with open(os.path.join(self.path, name), 'a') as fh:
+                fh.write(torn)
+
+        with buildstore.BuildOrderStore(self.path, mode='a') as store:
+            self.assertEqual(['building', 'Gateway'], store.names)
+            store.append('b.SC2Replay', ROWS[1:2])
+        with buildstore.BuildOrderStore(self.path) as store:
+            self.assertEqual(['a.SC2Replay', 'b.SC2Replay'], list(store))
+            self.assertEqual(ROWS[1:2], store.rows('b.SC2Replay'))
+
+    def test_clustering_reads_both_formats(self):
+        csv_dir = os.path.join(self.root, 'csv', 'a')
+        os.makedirs(csv_dir)
+        with open(os.path.join(csv_dir, 'a.csv'), 'w') as fh:
+            fh.write('# generated from replay file "a.SC2Replay"\n')
+            fh.write('time team event_type event_name\n')
+            for row in ROWS:
+                fh.write('%d %d %s %s\n' % row)
+        with buildstore.BuildOrderStore(self.path, mode='a') as store:
+            store.append('a.SC2Replay', ROWS)
+
+        def load(loader, path):
+            builds = build_order_clustering.PlayerBuilds()
+            loader(path, builds, 130)
+            return [(build.map_id, build.map_player, build.items)
+                    for _, build in builds.items()]
+
+        packed = load(build_order_clustering.load_packed_builds, self.path)
+        self.assertEqual(
+            load(build_order_clustering.load_csv_builds,
+                 os.path.join(self.root, 'csv')), packed)
+        self.assertEqual(2, len(packed[0][2]))
@@ -0,0 +1,60 @@
+import os
+import shutil
+import tempfile
+
+from replay_processing import cache
+from replay_processing import maps
+from replay_processing import sc2scan
+from replay_processing.tests import base
+
+
+class ReplayCacheTestCase(base.TestCase):
+    def setUp(self):
+        super(ReplayCacheTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_roundtrip(self):
+        c = cache.ReplayCache(self.path)
+        key = cache.content_key(b'replay')
+        self.assertIsNone(c.get(key))
+        c.put(key, {'sides': [1, 2]})
+        self.assertEqual({'sides': [1, 2]}, c.get(key))
+
+    def test_key_depends_on_salt(self):
+        self.assertNotEqual(cache.content_key(b'replay', 'all'),
+                            cache.content_key(b'replay', '1v1'))
+
+    def test_key_depends_on_features_and_map_table(self):
+        self.addCleanup(cache._version_salt.cache_clear)
+
+        def key():
+            cache._version_salt.cache_clear()
+            return cache.content_key(b'replay')
+
+        before = key()
+        self.patch(sc2scan, 'FEATURES_VERSION', sc2scan.FEATURES_VERSION + 1)
+        features_bumped = key()
+        self.assertNotEqual(before, features_bumped)
+
+        table = os.path.join(self.path, 'map_names.json')
+        with open(maps.DEFAULT_TABLE, 'rb') as src, open(table, 'wb') as dst:
+            dst.write(src.read() + b'\n')
+        self.patch(maps, 'DEFAULT_TABLE', table)
+        self.assertNotEqual(features_bumped, key())
+
+    def test_prune_evicts_least_recently_used(self):
+        c = cache.ReplayCache(self.path)
+        keys = [cache.content_key(str(i).encode()) for i in range(3)]
+        for i, key in enumerate(keys):
+            c.put(key, b'x' * 100)
+            os.utime(c._entry_path(key), (i, i))
+        # Reading the oldest entry makes it the most recently used
+        c.get(keys[0])
+
+        entry_size = os.path.getsize(c._entry_path(keys[0]))
+        c.max_bytes = entry_size * 2
+        self.assertEqual(1, c.prune())
+        self.assertIsNone(c.get(keys[1]))
+        self.assertIsNotNone(c.get(keys[0]))
+        self.assertIsNotNone(c.get(keys[2]))
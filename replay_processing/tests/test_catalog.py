@@ -0,0 +1,126 @@
+import os
+import shutil
+import tempfile
+import types
+
+import sc2reader
+
+from replay_processing import catalog
+from replay_processing import model
+from replay_processing.tests import base
+
+
+def _fake_facts(path, content):
+    # Replay files in these tests hold "matchup map seconds"
+    if content == b'corrupt':
+        raise model.ReplayParseError(path, ValueError())
+    matchup, map_name, seconds = content.decode('utf-8').split()
+    facts = {'map': map_name, 'map_name': map_name + ' LE',
+             'game_type': '1v1', 'num_players': 2, 'matchup': matchup,
+             'seconds': int(seconds), 'build': 1, 'base_build': 1,
+             'region': 'us', 'unix_timestamp': 0}
+    players = [catalog.CatalogPlayer(1, 'alice', 'Protoss', 'Win'),
+               catalog.CatalogPlayer(2, 'bob', 'Zerg', 'Loss')]
+    return facts, players
+
+
+class ReadReplayFactsTestCase(base.TestCase):
+    def test_sc2reader_replay(self):
+        loads = []
+
+        def load_replay(source, **kwargs):
+            loads.append((source.read(), kwargs))
+            # Only what sc2reader's Participant and Replay have at load
+            # level 2
+            players = [types.SimpleNamespace(pid=1, name='alice',
+                                             play_race='Zerg', result='Win'),
+                       types.SimpleNamespace(pid=2, name='bob',
+                                             play_race='Protoss',
+                                             result='Loss')]
+            return types.SimpleNamespace(
+                players=players, map_name='Echo LE', real_type='1v1',
+                real_length=sc2reader.utils.Length(seconds=754),
+                build=75689, base_build=75689, region='eu',
+                unix_timestamp=1560000000)
+        self.patch(sc2reader, 'load_replay', load_replay)
+
+        facts, players = catalog.read_replay_facts('a.SC2Replay', b'bytes')
+        self.assertEqual([(b'bytes', {'load_level': 2, 'engine': None})],
+                         loads)
+        self.assertEqual({'map': 'Echo', 'map_name': 'Echo LE',
+                          'game_type': '1v1', 'num_players': 2,
+                          'matchup': 'PvZ', 'seconds': 754, 'build': 75689,
+                          'base_build': 75689, 'region': 'eu',
+                          'unix_timestamp': 1560000000}, facts)
+        self.assertEqual([catalog.CatalogPlayer(1, 'alice', 'Zerg', 'Win'),
+                          catalog.CatalogPlayer(2, 'bob', 'Protoss', 'Loss')],
+                         players)
+
+    def test_unreadable_replay(self):
+        def load_replay(source, **kwargs):
+            raise sc2reader.exceptions.SC2ReaderError('truncated')
+        self.patch(sc2reader, 'load_replay', load_replay)
+        self.assertRaises(model.ReplayParseError, catalog.read_replay_facts,
+                          'a.SC2Replay', b'bytes')
+
+
+class ReplayCatalogTestCase(base.TestCase):
+    def setUp(self):
+        super(ReplayCatalogTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.parsed = []
+
+        def read(path, content):
+            self.parsed.append(os.path.basename(path))
+            return _fake_facts(path, content)
+        self.patch(catalog, 'read_replay_facts', read)
+        self.catalog = catalog.ReplayCatalog(
+            os.path.join(self.root, 'catalog.sqlite'))
+        self.addCleanup(self.catalog.close)
+
+    def _write(self, name, content):
+        path = os.path.join(self.root, 'replays', name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as fh:
+            fh.write(content)
+        return path
+
+    def test_incremental_update(self):
+        self._write('a.SC2Replay', b'PvZ Echo 700')
+        self._write('b.SC2Replay', b'TvZ Echo 300')
+        self._write('bad.SC2Replay', b'corrupt')
+        stats = self.catalog.update(os.path.join(self.root, 'replays'))
+        self.assertEqual(catalog.UpdateStats(0, 2, 0, 1, 0), stats)
+
+        self._write('c.SC2Replay', b'PvZ Echo 700')
+        os.unlink(os.path.join(self.root, 'replays', 'b.SC2Replay'))
+        stats = self.catalog.update(os.path.join(self.root, 'replays'))
+        self.assertEqual(catalog.UpdateStats(1, 0, 1, 1, 1), stats)
+        # c has a's content, so it was never parsed
+        self.assertEqual(['a.SC2Replay', 'b.SC2Replay', 'bad.SC2Replay',
+                          'bad.SC2Replay'], sorted(self.parsed))
+        self.assertEqual(2, len(self.catalog))
+
+    def test_query(self):
+        self._write('a.SC2Replay', b'PvZ Echo 700')
+        self._write('b.SC2Replay', b'PvZ Echo 300')
+        self._write('c.SC2Replay', b'PvZ Daybreak 900')
+        root = os.path.join(self.root, 'replays')
+        self.catalog.update(root)
+
+        entries = self.catalog.query(matchup='PvZ', map='Echo',
+                                     min_seconds=600)
+        self.assertEqual([os.path.join(root, 'a.SC2Replay')],
+                         [entry.path for entry in entries])
+        self.assertEqual(3, len(self.catalog.query(root, player='bob')))
+        self.assertEqual([], self.catalog.query(player='carol'))
+        self.assertEqual(['alice', 'bob'],
+                         [player.name for player in
+                          self.catalog.players(entries[0].path)])
+
+        replays = list(model.replays_from_catalog(self.catalog,
+                                                  profile='metadata',
+                                                  map='Daybreak'))
+        self.assertEqual(['c.SC2Replay'], [r.name for r in replays])
+        self.assertEqual('metadata', replays[0].profile)
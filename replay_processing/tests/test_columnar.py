@@ -0,0 +1,88 @@
+import math
+import shutil
+import tempfile
+
+from replay_processing import columnar
+from replay_processing.tests import base
+
+
+FIELDS = ['map', 'Game Length(seconds)', 'Winner', 'first_army_unit_supply',
+          'unix_timestamp']
+
+
+class ColumnarTestCase(base.TestCase):
+    def setUp(self):
+        super(ColumnarTestCase, self).setUp()
+        self.path = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.path)
+
+    def test_roundtrip(self):
+        stage = columnar.ColumnarWriterStage(self.path, FIELDS, flush_rows=2)
+        stage.start()
+        stage.put([{'map': 'Echo', 'Game Length(seconds)': '612.5',
+                    'Winner': 'True', 'first_army_unit_supply': '23',
+                    'unix_timestamp': '1500000000'},
+                   {'map': 'Overgrowth', 'Game Length(seconds)': 300.,
+                    'Winner': 'unknown', 'first_army_unit_supply': None,
+                    'unix_timestamp': 1500000001}])
+        stage.put([{'map': 'Echo', 'Game Length(seconds)': None,
+                    'Winner': False, 'first_army_unit_supply': 14,
+                    'unix_timestamp': 1500000002}])
+        stage.close()
+
+        table = columnar.ColumnarTable(self.path)
+        self.assertEqual(3, len(table))
+        self.assertEqual(['Echo', 'Overgrowth', 'Echo'],
+                         list(table.decode('map')))
+        self.assertEqual([0, 1, 0], list(table['map']))
+        self.assertEqual(0, table.code('map', 'Echo'))
+        self.assertEqual(columnar.NULL, table.code('map', 'Daybreak'))
+        lengths = table['Game Length(seconds)']
+        self.assertEqual([612.5, 300.], list(lengths[:2]))
+        self.assertTrue(math.isnan(lengths[2]))
+        self.assertEqual([1, -1, 0], list(table['Winner']))
+        self.assertEqual([23, -1, 14], list(table['first_army_unit_supply']))
+        self.assertEqual(1500000002, table['unix_timestamp'][2])
+
+    def test_empty(self):
+        columnar.ColumnarWriterStage(self.path, FIELDS).start().close()
+        table = columnar.ColumnarTable(self.path)
+        self.assertEqual(0, len(table))
+        self.assertEqual(0, len(table['map']))
+
+    def test_seeded_dictionary(self):
+        stage = columnar.ColumnarWriterStage(
+            self.path, FIELDS, dictionaries={'map': {'Echo': 0, 'Daybreak': 1}})
+        stage.start()
+        stage.put([{'map': 'Daybreak', 'Game Length(seconds)': 1.,
+                    'Winner': True, 'first_army_unit_supply': 1,
+                    'unix_timestamp': 1},
+                   {'map': 'Overgrowth', 'Game Length(seconds)': 1.,
+                    'Winner': True, 'first_army_unit_supply': 1,
+                    'unix_timestamp': 1}])
+        stage.close()
+        table = columnar.ColumnarTable(self.path)
+        self.assertEqual([1, 2], list(table['map']))
+        self.assertEqual(['Echo', 'Daybreak', 'Overgrowth'],
+                         table.dictionaries['map'])
+
+    def test_text_columns(self):
+        fields = ['map', 'player', 'replay_file']
+        stage = columnar.ColumnarWriterStage(self.path, fields, flush_rows=2)
+        stage.start()
+        stage.put([{'map': 'Echo', 'player': u'\uc1a1\ubcd1\uad6c',
+                    'replay_file': 'a.SC2Replay'},
+                   {'map': 'Echo', 'player': None, 'replay_file': ''}])
+        stage.put([{'map': 'Echo', 'player': 'Serral',
+                    'replay_file': 'c.SC2Replay'}])
+        stage.close()
+
+        table = columnar.ColumnarTable(self.path)
+        self.assertEqual([u'\uc1a1\ubcd1\uad6c', None, 'Serral'],
+                         list(table.decode('player')))
+        self.assertEqual(['a.SC2Replay', '', 'c.SC2Replay'],
+                         list(table.decode('replay_file')))
+        self.assertEqual(['c.SC2Replay'],
+                         list(table.decode('replay_file', [2])))
+        # Only the low cardinality column has a dictionary in the schema
+        self.assertEqual({'map'}, set(table.dictionaries))
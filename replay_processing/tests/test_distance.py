@@ -0,0 +1,207 @@
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+
+import numpy as np
+
+from replay_processing import build_order_clustering
+from replay_processing import distance
+from replay_processing.tests import base
+
+
+UNITS = [build_order_clustering.Unit(ev_type, name)
+         for ev_type, name in (('army', 'Zergling'), ('army', 'Stalker'),
+                               ('building', 'Gateway'), ('building', 'Pylon'),
+                               ('upgrade', 'WarpGateResearch'))]
+
+
+def random_builds(count, seed=0):
+    rand = random.Random(seed)
+    builds = build_order_clustering.PlayerBuilds()
+    for i in range(count):
+        build = builds.next_build('map%d.SC2Replay' % (i // 2), i % 2)
+        # Now and then an empty build, its affinities are all 0, and now
+        # and then one massing a few units
+        for ev_ndx in range(rand.choice((0, 3, 10, 25, 150))):
+            build.add_build_item(build_order_clustering.BuildItem(
+                ev_ndx, rand.randint(1, 2400), rand.choice(UNITS)))
+    return builds
+
+
+def events(*times):
+    unit = UNITS[0]
+    return [build_order_clustering.BuildItem(ev_ndx, time, unit)
+            for ev_ndx, time in enumerate(times)]
+
+
+class UnitEventsAffinityTestCase(base.TestCase):
+    def affinity(self, mine, others):
+        build = build_order_clustering.PlayerBuild(0, 'a.SC2Replay', 0)
+        return build.unit_events_affinity(events(*mine), events(*others))
+
+    def test_nearest_event(self):
+        # 2000 takes 1900, not the first untaken event at 100
+        self.assertEqual(.5, self.affinity([2000], [100, 1900]))
+
+    def test_taken_events_are_skipped(self):
+        # 1900 is taken by 1800, 2000 falls back to 100
+        self.assertAlmostEqual((1 + 600 / 1900) / 2,
+                               self.affinity([1800, 2000], [100, 1900]))
+
+    def test_tie_takes_earlier(self):
+        self.assertAlmostEqual((600 / 700 + 600 / 1300) / 2,
+                               self.affinity([1500, 3500], [800, 2200]))
+
+    def test_empty(self):
+        self.assertEqual(0, self.affinity([], []))
+        self.assertEqual(0, self.affinity([100], []))
+
+
+class AffinityMatrixTestCase(base.TestCase):
+    def scalar_matrix(self, builds, unit_popularity):
+        # What build_order_clustering computed pair by pair
+        n = len(builds)
+        matrix = np.empty((n, n))
+        for i in range(n):
+            for j in range(n):
+                low, high = min(i, j), max(i, j)
+                matrix[i, j] = builds.get_by_player_id(low).unit_type_ratios(
+                    builds.get_by_player_id(high), unit_popularity)
+        return matrix
+
+    def test_matches_scalar(self):
+        builds = random_builds(40)
+        unit_popularity = builds.unit_build_popularity_counts()
+        build_list = [builds.get_by_player_id(i) for i in range(len(builds))]
+        expected = self.scalar_matrix(builds, unit_popularity)
+        # Blocks smaller than the builds, and blocks that don't divide them
+        for block_size in (distance.BLOCK_SIZE, 7, 1):
+            matrix = distance.affinity_matrix(build_list, unit_popularity,
+                                              block_size=block_size)
+            # Stored as float32
+            np.testing.assert_allclose(matrix.square(), expected, rtol=0,
+                                       atol=1e-6)
+
+    def test_no_builds(self):
+        matrix = distance.affinity_matrix([], {})
+        self.assertEqual((0, 0), matrix.square().shape)
+
+
+    def test_jobs(self):
+        builds = random_builds(30)
+        unit_popularity = builds.unit_build_popularity_counts()
+        build_list = [builds.get_by_player_id(i) for i in range(len(builds))]
+        expected = distance.affinity_matrix(build_list, unit_popularity,
+                                            block_size=8)
+        progress = []
+        matrix = distance.affinity_matrix(
+            build_list, unit_popularity, block_size=8, jobs=2,
+            progress=lambda done, total: progress.append((done, total)))
+        np.testing.assert_array_equal(expected.square(), matrix.square())
+        # 4 blocks per side, 10 on or above the diagonal
+        self.assertEqual([(done, 10) for done in range(1, 11)], progress)
+
+
+class CondensedMatrixTestCase(base.TestCase):
+    def test_symmetric_lookup(self):
+        matrix = distance.CondensedMatrix(4)
+        values = np.arange(16, dtype=np.float32).reshape(4, 4)
+        matrix.set_block(0, 4, 0, values)
+        self.assertEqual(10, len(matrix.data))
+        for i in range(4):
+            for j in range(4):
+                self.assertEqual(values[min(i, j), max(i, j)], matrix[i, j])
+        self.assertEqual([5., 6., 7.], list(matrix.row(1)))
+
+    def test_memory_mapped(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        path = os.path.join(root, 'affinities.bin')
+        builds = random_builds(10)
+        build_list = [builds.get_by_player_id(i) for i in range(len(builds))]
+        unit_popularity = builds.unit_build_popularity_counts()
+        written = distance.affinity_matrix(build_list, unit_popularity,
+                                           block_size=3, path=path)
+        read = distance.CondensedMatrix.open(path)
+        self.assertEqual(10, len(read))
+        np.testing.assert_array_equal(written.square(), read.square())
+
+
+class ScalableClusteringTestCase(base.TestCase):
+    def test_center_affinities(self):
+        builds = random_builds(20)
+        unit_popularity = builds.unit_build_popularity_counts()
+        build_list = [builds.get_by_player_id(i) for i in range(len(builds))]
+        matrix = distance.affinity_matrix(build_list, unit_popularity)
+        members = [0, 3, 7, 12, 19]
+        affinities = distance.center_affinities(build_list, unit_popularity,
+                                                7, members)
+        np.testing.assert_allclose([matrix[i, 7] for i in members],
+                                   affinities, rtol=0, atol=1e-6)
+
+    def test_embeddings(self):
+        builds = random_builds(6)
+        build_list = [builds.get_by_player_id(i) for i in range(len(builds))]
+        encoded = distance.EncodedBuilds(
+            build_list, builds.unit_build_popularity_counts())
+        embeddings = encoded.embeddings().toarray()
+        self.assertEqual((6, 2 * len(encoded.units)), embeddings.shape)
+        for i, build in enumerate(build_list):
+            for unit_id, unit in enumerate(encoded.units):
+                events = build.events_by_unit.get(unit, [])
+                self.assertAlmostEqual(np.log1p(len(events)),
+                                       embeddings[i, 2 * unit_id], places=5)
+                first = min([ev.time for ev in events], default=0)
+                self.assertAlmostEqual(first / distance.TIME_SCALE,
+                                       embeddings[i, 2 * unit_id + 1],
+                                       places=5)
+
+    def test_algorithms_write_the_same_output(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        rand = random.Random(1)
+        for replay in range(15):
+            with open(os.path.join(root, '%d.csv' % replay), 'w') as fh:
+                fh.write('# generated from replay file "%d.SC2Replay"\n'
+                         % replay)
+                fh.write('time team event_type event_name\n')
+                for _ in range(20):
+                    unit = rand.choice(UNITS)
+                    fh.write('%d %d %s %s\n' % (rand.randint(1, 900),
+                                                 rand.randint(1, 2),
+                                                 unit.type, unit.name))
+
+        for algorithm in ('affinity-propagation', 'minibatch-kmeans'):
+            output_path = os.path.join(root, algorithm + '.json')
+            self.patch(sys, 'argv', ['build-order-clustering', root,
+                                     output_path, '--algorithm', algorithm,
+                                     '--clusters', '4'])
+            build_order_clustering.main()
+            with open(output_path) as fh:
+                output = json.load(fh)
+            keys = []
+            for label in output['labels'].values():
+                self.assertIn(label['center'], label['builds'])
+                for build in label['builds'].values():
+                    self.assertLessEqual(0, build['affinity'])
+                    self.assertLessEqual(build['affinity'], 1)
+                keys.extend(label['builds'])
+            self.assertEqual(30, len(set(keys)))
+
+    def test_no_builds_to_cluster(self):
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.patch(sys, 'argv', ['build-order-clustering', root,
+                                 os.path.join(root, 'out.json'),
+                                 '--algorithm', 'minibatch-kmeans'])
+        error = self.assertRaises(SystemExit, build_order_clustering.main)
+        self.assertIn('No build orders found', str(error))
+
+    def test_clusters_at_least_one(self):
+        self.patch(sys, 'stderr', open(os.devnull, 'w'))
+        self.addCleanup(sys.stderr.close)
+        self.assertRaises(SystemExit, build_order_clustering.parse_args,
+                          ['builds', 'out.json', '--clusters', '0'])
@@ -0,0 +1,40 @@
+import logging
+
+from replay_processing import maps
+from replay_processing import sc2scan
+from replay_processing.tests import base
+
+
+class MapTableTestCase(base.TestCase):
+    def setUp(self):
+        super(MapTableTestCase, self).setUp()
+        self.table = maps.MapTable.load()
+
+    def test_canonical(self):
+        self.assertEqual('Echo', self.table.canonical(u'回聲 - 天梯版'))
+        self.assertEqual('Newkirk Precinct',
+                         self.table.canonical(u'新柯尔克辖区-锦标赛版'))
+        self.assertEqual('Overgrowth', self.table.canonical('Overgrowth LE'))
+        self.assertEqual('Abyssal Reef',
+                         self.table.canonical('Abyssal Reef LE (Void)'))
+        self.assertEqual(set(), self.table.unknown)
+
+    def test_ids_are_stable_for_known_maps(self):
+        echo = self.table.map_id('Echo LE')
+        self.assertEqual(echo, self.table.map_id(u'回聲 - 天梯版'))
+        self.assertEqual(echo, maps.MapTable.load().map_id('Echo LE'))
+        new = self.table.map_id('Brand New Map LE')
+        self.assertEqual(len(self.table.ids) - 1, new)
+
+    def test_unknown_collected_once(self):
+        for _ in range(3):
+            self.table.canonical(u'未知地圖')
+            self.table.canonical('Brand New Map LE')
+        self.assertEqual({u'未知地圖', 'Brand New Map LE'}, self.table.unknown)
+
+    def test_map_process(self):
+        logger = logging.getLogger("replayParser.test")
+        self.assertEqual('Daybreak',
+                         sc2scan.map_process(u'破曉黎明 - 天梯版', logger))
+        self.assertEqual('Newkirk Precinct',
+                         sc2scan.map_process('Newkirk Precinct TE', logger))
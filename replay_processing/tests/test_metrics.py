@@ -0,0 +1,31 @@
+from replay_processing import metrics
+from replay_processing.tests import base
+
+
+class MetricsTestCase(base.TestCase):
+    def test_percentile(self):
+        values = list(range(1, 101))
+        self.assertEqual(50, metrics.percentile(values, 50))
+        self.assertEqual(99, metrics.percentile(values, 99))
+        self.assertEqual(1, metrics.percentile(values, 0))
+        self.assertEqual(0., metrics.percentile([], 50))
+
+    def test_run_metrics(self):
+        run = metrics.RunMetrics(slowest=2)
+        for i in range(5):
+            run.add_replay('r%d' % i, float(i), {'parse': i / 2.})
+
+        report = run.report()
+        self.assertEqual(5, report['replays'])
+        self.assertEqual(['r4', 'r3'],
+                         [entry['replay'] for entry in report['slowest']])
+        self.assertEqual(['total', 'parse'], list(report['stages']))
+        self.assertEqual(2., report['stages']['parse']['max'])
+        self.assertEqual(5, report['stages']['total']['count'])
+
+    def test_stage_timer_sums_repeats(self):
+        timer = metrics.StageTimer()
+        for _ in range(2):
+            with timer.stage('parse'):
+                pass
+        self.assertEqual(['parse'], list(timer.timings))
@@ -0,0 +1,177 @@
+import collections
+import json
+import os
+import shutil
+import tempfile
+
+from replay_processing import model
+from replay_processing.tests import base
+
+
+Event = collections.namedtuple('Event', ['name', 'unit'])
+Unit = collections.namedtuple('Unit', ['name', 'owner'])
+
+
+def _events():
+    return [
+        Event('UnitBornEvent', Unit('BeaconArmy', 'p1')),
+        Event('UnitBornEvent', Unit('Probe', 'p1')),
+        Event('UpgradeCompleteEvent', None),
+        Event('UnitDoneEvent', Unit('Pylon', 'p2')),
+        Event('UnitBornEvent', Unit('MineralField', None)),
+        Event('UnitDiedEvent', Unit('Probe', 'p1')),
+        Event('UnitBornEvent', Unit('Zealot', 'p2')),
+    ]
+
+
+class EventIndexTestCase(base.TestCase):
+    def test_by_type_keeps_event_order(self):
+        events = _events()
+        index = model.EventIndex(events)
+        self.assertEqual([events[0], events[1], events[3], events[4],
+                          events[6]],
+                         index.by_type(model.UNIT_CREATED_EVENT_TYPES))
+        self.assertEqual([events[3]],
+                         index.by_type(model.UNIT_CREATED_EVENT_TYPES,
+                                       ['UnitBornEvent']))
+        self.assertEqual([], index.by_type(['PlayerLeaveEvent']))
+
+    def test_matches_plain_event_lists(self):
+        events = _events()
+        index = model.EventIndex(events)
+        for include_npc in (False, True):
+            self.assertEqual(
+                list(model.unit_events(events, include_npc)),
+                list(model.unit_events(index, include_npc)))
+        self.assertEqual([events[1], events[3], events[6]],
+                         model.unit_events(index))
+
+    def test_unit_events_of(self):
+        events = _events()
+        index = model.EventIndex(events)
+        self.assertEqual([events[3], events[6]], index.unit_events_of('p2'))
+        self.assertEqual([events[4]], index.unit_events_of(None))
+        self.assertEqual([], index.unit_events_of('p3'))
+
+
+class ReplayTestCase(base.TestCase):
+    def test_unknown_profile(self):
+        self.assertRaises(ValueError, model.Replay, 'a.SC2Replay',
+                          profile='everything')
+
+    def test_profiles_load_less(self):
+        levels = [model.LOAD_PROFILES[name].load_level
+                  for name in ('metadata', 'tracker_only', 'full')]
+        self.assertEqual(sorted(levels), levels)
+
+
+class FakeReplay(object):
+    def __init__(self, num_events):
+        self.events = [Event('UnitBornEvent', None)] * num_events
+
+
+class ReplayPoolTestCase(base.TestCase):
+    def setUp(self):
+        super(ReplayPoolTestCase, self).setUp()
+        self.loads = []
+
+    def _loader(self, key, num_events=1):
+        def load():
+            self.loads.append(key)
+            return model.ParsedReplay(FakeReplay(num_events))
+        return load
+
+    def test_lru_eviction(self):
+        pool = model.ReplayPool(max_entries=2)
+        for key in ('a', 'b', 'a', 'c', 'b'):
+            pool.get(key, self._loader(key))
+        # b was least recently used when c came in
+        self.assertEqual(['a', 'b', 'c', 'b'], self.loads)
+        self.assertEqual({'entries': 2, 'events': 2, 'hits': 1, 'misses': 4,
+                          'evictions': 2}, pool.stats())
+
+    def test_event_cap(self):
+        pool = model.ReplayPool(max_entries=10, max_events=5)
+        pool.get('a', self._loader('a', 3))
+        pool.get('b', self._loader('b', 3))
+        self.assertEqual(1, len(pool))
+        # Too big for the cap on its own, still kept as the newest entry
+        pool.get('c', self._loader('c', 8))
+        self.assertEqual(1, len(pool))
+        self.assertEqual(8, pool.events)
+
+    def test_replay_handles_share_the_pool(self):
+        pool = model.ReplayPool()
+        replay = model.Replay('a.SC2Replay', profile='tracker_only',
+                              pool=pool)
+        pool.get(('a.SC2Replay', 'tracker_only'), self._loader('a', 2))
+        self.assertEqual(2, len(replay.events))
+        self.assertEqual(2, len(model.Replay('a.SC2Replay', 'tracker_only',
+                                             pool=pool).events))
+        self.assertEqual(['a'], self.loads)
+
+
+CLUSTERING = {
+    'labels': {
+        '0': {'builds': {'1@aaa': {'affinity': 0.0},
+                         '2@bbb': {'affinity': -3.5}},
+              'center': '1@aaa'},
+        '1': {'builds': {'2@ccc': {'affinity': -1.0},
+                         '1@ddd': {'affinity': 0.0},
+                         '1@eee': {'affinity': -7.25}},
+              'center': '1@ddd'},
+    }
+}
+
+
+class ClusteringDataTestCase(base.TestCase):
+    def setUp(self):
+        super(ClusteringDataTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        os.mkdir(os.path.join(self.root, 'clusterings'))
+        with open(os.path.join(self.root, 'clusterings', 'test.json'),
+                  'w') as fh:
+            json.dump(CLUSTERING, fh)
+        os.mkdir(os.path.join(self.root, 'cluster_tag_mappings'))
+        with open(os.path.join(self.root, 'cluster_tag_mappings',
+                               'test.json'), 'w') as fh:
+            json.dump({'0': 'opener'}, fh)
+        with open(os.path.join(self.root, 'cluster_tags.json'), 'w') as fh:
+            json.dump({'opener': {'description': 'Gateway opener'}}, fh)
+        self.data_dir = model.ClusteringDataDir(self.root)
+
+    def _check(self, clustering):
+        labels = clustering.labels
+        self.assertIs(labels, clustering.labels)
+        self.assertEqual('Gateway opener', labels['0'].description)
+        self.assertIsNone(labels['1'].description)
+        self.assertEqual({'0': 2, '1': 3},
+                         {name: len(label) for name, label in labels.items()})
+        self.assertIs(labels['1'].builds, labels['1'].builds)
+        self.assertEqual([('2', 'ccc', -1.0), ('1', 'ddd', 0.0),
+                          ('1', 'eee', -7.25)],
+                         [(b.map_player, b.map_id, b.affinity)
+                          for b in labels['1'].builds])
+        self.assertEqual('ddd', labels['1'].center.map_id)
+        self.assertEqual(model.BuildLabel('0', -3.5),
+                         clustering.label_of('2@bbb'))
+        self.assertIsNone(clustering.label_of('2@zzz'))
+
+    def test_json(self):
+        clustering = self.data_dir.clustering_data('test')
+        self.assertTrue(clustering.path.endswith('.json'))
+        self._check(clustering)
+
+    def test_compact(self):
+        self.data_dir.write_compact('test')
+        clustering = self.data_dir.clustering_data('test')
+        self.assertTrue(clustering.path.endswith('.npz'))
+        self._check(clustering)
+
+    def test_compact_raw_data(self):
+        self.data_dir.write_compact('test')
+        os.remove(os.path.join(self.root, 'clusterings', 'test.json'))
+        clustering = self.data_dir.clustering_data('test')
+        self.assertTrue(clustering.path.endswith('.npz'))
+        self.assertEqual(CLUSTERING, clustering.raw_data)
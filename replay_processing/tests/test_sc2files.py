@@ -0,0 +1,176 @@
+import logging
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+from replay_processing import model
+from replay_processing import sc2files
+from replay_processing.quarantine import Quarantine
+from replay_processing.tests import base
+
+
+def _result(filename, error=False, matchup='PvZ', map_name='Echo LE'):
+    side = sc2files.SideRow()
+    side.replay_file = filename
+    return sc2files.ReplayResult(filename, [side], 2, error, False, map_name,
+                                 matchup)
+
+
+def _misbehaving_worker(filename, *args):
+    # Stands in for sc2files.worker in forked pool processes
+    name = os.path.basename(filename)
+    if name.startswith('crash'):
+        os._exit(1)
+    if name.startswith('hang'):
+        time.sleep(60)
+    return _result(filename)
+
+
+class ScanStatsTestCase(base.TestCase):
+    def test_error_sample_is_capped(self):
+        stats = sc2files.ScanStats(max_error_samples=2)
+        for i in range(5):
+            stats.add(_result('bad%d' % i, error=True))
+        stats.add(_result('good'))
+
+        self.assertEqual(6, stats.count)
+        self.assertEqual(5, stats.errors)
+        self.assertEqual(['bad0', 'bad1'], stats.error_replays)
+        self.assertEqual({'PvZ': 1}, dict(stats.match_stats))
+        self.assertIsNone(stats.match_data)
+
+    def test_keep_match_data(self):
+        stats = sc2files.ScanStats(keep_match_data=True)
+        stats.add(_result('good'))
+        stats.add(_result('bad', error=True))
+        self.assertEqual([['good']],
+                         [[side.replay_file for side in data['sides']]
+                          for data in stats.match_data])
+
+    def test_map_ids(self):
+        stats = sc2files.ScanStats()
+        results = [_result('a', map_name='Echo LE'),
+                   _result('b', map_name='Brand New Map LE'),
+                   _result('c', map_name=u'回聲 - 天梯版')]
+        for result in results:
+            stats.add(result)
+        echo = stats.maps.ids['Echo']
+        self.assertEqual([echo, len(stats.maps.ids) - 1, echo],
+                         [result.sides[0].map_id for result in results])
+        self.assertEqual({'Brand New Map LE'}, stats.maps.unknown)
+
+    def test_rejected_are_not_errors(self):
+        stats = sc2files.ScanStats()
+        stats.add(_result('team_game')._replace(
+            rejected=sc2files.REJECT_NOT_1V1))
+        stats.add(_result('bad', error=True))
+
+        self.assertEqual(2, stats.count)
+        self.assertEqual(1, stats.errors)
+        self.assertEqual({sc2files.REJECT_NOT_1V1: 1}, dict(stats.rejected))
+        self.assertEqual({}, dict(stats.match_stats))
+
+
+class SideRowTestCase(base.TestCase):
+    def test_row_values(self):
+        row = sc2files.SideRow()
+        row.update({'map': 'Echo', 'Game Length(seconds)': 612.5,
+                    'Carriers count': 0, 'Carriers': False})
+        values = dict(zip(sc2files.FIELD_NAMES, sc2files.row_values(row)))
+        self.assertEqual('Echo', values['map'])
+        self.assertEqual(612.5, values['Game Length(seconds)'])
+        self.assertEqual('unknown', values['Winner'])
+        self.assertEqual('None', values['first_tech_path'])
+        self.assertIs(False, values['Carriers'])
+        self.assertEqual(612.5, row['Game Length(seconds)'])
+
+    def test_pickle_and_replace(self):
+        row = sc2files.SideRow('Echo', 2, 23)
+        copy = pickle.loads(pickle.dumps(row))
+        self.assertEqual(row, copy)
+        moved = copy._replace(replay_file='other.SC2Replay')
+        self.assertEqual('other.SC2Replay', moved.replay_file)
+        self.assertIsNone(row.replay_file)
+        self.assertEqual(23, moved.first_army_unit_supply)
+
+
+class ReplayFailureTestCase(base.TestCase):
+    def setUp(self):
+        super(ReplayFailureTestCase, self).setUp()
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.logger = logging.getLogger('replayParser.test')
+        self.quarantine = Quarantine(os.path.join(self.root, 'q.jsonl'))
+
+    def scan(self, names, num_threads=2, **kwargs):
+        for name in names:
+            with open(os.path.join(self.root, name + '.SC2Replay'), 'w'):
+                pass
+        self.patch(sc2files, 'worker', _misbehaving_worker)
+        results = sc2files.iter_replay_results(
+            self.root, num_threads, logger=self.logger, executor='process',
+            quarantine=self.quarantine, **kwargs)
+        return {os.path.basename(result.filename).split('.')[0]:
+                result.failure for result in results}
+
+    def test_dead_worker(self):
+        # One replay in flight at a time, so only the culprit is blamed
+        failures = self.scan(['a', 'crash', 'c'], max_in_flight=1)
+        self.assertEqual({'a': None, 'crash': sc2files.FAILURE_CRASH,
+                          'c': None}, failures)
+        self.assertIn(os.path.join(self.root, 'crash.SC2Replay'),
+                      self.quarantine)
+        self.assertEqual(1, len(self.quarantine))
+
+    def test_dead_worker_with_replays_queued(self):
+        # The replays queued behind the culprit never started, they are run
+        # again rather than blamed
+        failures = self.scan(['a', 'crash', 'c', 'd', 'e'], max_in_flight=4,
+                             num_threads=1)
+        self.assertEqual({'a': None, 'crash': sc2files.FAILURE_CRASH,
+                          'c': None, 'd': None, 'e': None}, failures)
+        self.assertEqual([os.path.join(self.root, 'crash.SC2Replay')],
+                         list(self.quarantine._paths))
+
+    def test_hung_worker_is_killed(self):
+        self.patch(sc2files, 'TIMEOUT_GRACE', 0)
+        self.patch(sc2files, 'TIMEOUT_POLL', .05)
+        start = time.time()
+        failures = self.scan(['a', 'b', 'hang', 'd'], timeout=.5)
+        self.assertLess(time.time() - start, 30)
+        self.assertEqual({'a': None, 'b': None,
+                          'hang': sc2files.FAILURE_TIMEOUT, 'd': None},
+                         failures)
+        self.assertEqual(1, len(self.quarantine))
+
+    def test_timeout_needs_processes(self):
+        self.assertRaises(ValueError, list, sc2files.iter_replay_results(
+            self.root, 2, executor='thread', timeout=1))
+
+    def test_parse_failures_are_not_quarantined(self):
+        results = [sc2files.failed_result('bad.SC2Replay',
+                                          sc2files.FAILURE_PARSE)]
+        self.patch(sc2files, 'thread_results', lambda *args: iter(results))
+        skipped = list(sc2files.iter_replay_results(
+            self.root, 2, quarantine=self.quarantine))
+        self.assertEqual(results, skipped)
+        self.assertEqual(0, len(self.quarantine))
+
+    def test_failure_kinds(self):
+        def fails_with(exc):
+            def extract_worker(filename, *args):
+                raise exc
+            self.patch(sc2files, 'extract_worker', extract_worker)
+            return sc2files.parse_worker('a.SC2Replay', b'', False,
+                                         self.logger)
+
+        parse_error = model.ReplayParseError('a.SC2Replay', ValueError())
+        result = fails_with(parse_error)
+        self.assertTrue(result.error)
+        self.assertEqual(sc2files.FAILURE_PARSE, result.failure)
+        # A bug of ours, it should parse again once fixed
+        result = fails_with(KeyError('first_army_unit'))
+        self.assertTrue(result.error)
+        self.assertIsNone(result.failure)
@@ -0,0 +1,81 @@
+import logging
+
+from replay_processing import sc2scan
+from replay_processing.benchmarks.synthetic import synthetic_results
+from replay_processing.tests import base
+
+
+def _reference_build_data(player):
+    # The three separate passes populate_build_data used to make
+    def seconds(time):
+        minutes, secs = time.split(':')
+        return 60 * int(minutes) + int(secs)
+
+    data = {'first_army_unit': None,
+            'first_army_unit_supply': None,
+            'first_army_unit_time': None,
+            'Carriers count': 0,
+            'Carrier timing': 0,
+            'Carriers': False,
+            'first_tech_path': None}
+    events = [ev for ev in player['buildOrder'] if not ev['is_worker']]
+    for event in events:
+        if event['name'] in sc2scan.army_units:
+            data['first_army_unit'] = event['name']
+            data['first_army_unit_supply'] = event['supply']
+            data['first_army_unit_time'] = seconds(event['time'])
+            break
+    for event in events:
+        if event['name'] == 'Carrier':
+            data['Carriers'] = True
+            data['Carriers count'] += 1
+            if data['Carrier timing'] == 0:
+                data['Carrier timing'] = seconds(event['time'])
+    for event in events:
+        if event['name'] in sc2scan.tech_paths:
+            if event['name'] in sc2scan.terran_mech_upgrades:
+                data['first_tech_path'] = 'Mech'
+            else:
+                data['first_tech_path'] = event['name']
+            break
+    return data
+
+
+class PopulateBuildDataTestCase(base.TestCase):
+    def setUp(self):
+        super(PopulateBuildDataTestCase, self).setUp()
+        self.logger = logging.getLogger("replayParser.test")
+
+    def test_matches_reference(self):
+        for result in synthetic_results(50, events_per_player=200):
+            for player in result['players'].values():
+                self.assertEqual(_reference_build_data(player),
+                                 sc2scan.populate_build_data(player,
+                                                             self.logger))
+
+    def test_empty_build_order(self):
+        data = sc2scan.populate_build_data({'buildOrder': []}, self.logger)
+        self.assertIsNone(data['first_army_unit'])
+        self.assertEqual(0, data['Carriers count'])
+        self.assertIsNone(data['first_tech_path'])
+
+    def test_catch_all_feature_sees_every_non_worker_event(self):
+        class Count(sc2scan.BuildFeature):
+            def __init__(self, logger):
+                super(Count, self).__init__(logger)
+                self.count = 0
+
+            def update(self, event):
+                self.count += 1
+                return False
+
+            def result(self):
+                return {'count': self.count}
+
+        player = synthetic_results(1)[0]['players'][1]
+        data = sc2scan.scan_build_order(player['buildOrder'],
+                                        [sc2scan.FirstArmyUnit, Count],
+                                        self.logger)
+        self.assertEqual(len([ev for ev in player['buildOrder']
+                              if not ev['is_worker']]), data['count'])
+        self.assertIsNotNone(data['first_army_unit'])
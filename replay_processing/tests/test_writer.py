@@ -0,0 +1,31 @@
+import csv
+import io
+
+from replay_processing import writer
+from replay_processing.tests import base
+
+
+class CSVWriterStageTestCase(base.TestCase):
+    def test_quotes_and_flushes_everything(self):
+        out = io.StringIO()
+        stage = writer.CSVWriterStage(out, ['map', 'player'],
+                                      lambda row: [row['map'], row['player']],
+                                      flush_bytes=16).start()
+        stage.put([{'map': 'Echo LE', 'player': 'a,b'}])
+        stage.put([{'map': 'Overgrowth', 'player': 'say "hi"'}] * 10)
+        stage.close()
+
+        rows = list(csv.reader(io.StringIO(out.getvalue())))
+        self.assertEqual(['map', 'player'], rows[0])
+        self.assertEqual(['Echo LE', 'a,b'], rows[1])
+        self.assertEqual(['Overgrowth', 'say "hi"'], rows[-1])
+        self.assertEqual(12, len(rows))
+        self.assertEqual(11, stage.rows)
+        self.assertEqual(len(out.getvalue().encode('utf-8')), stage.bytes)
+
+    def test_write_errors_surface_on_close(self):
+        stage = writer.CSVWriterStage(io.StringIO(), ['map'],
+                                      lambda row: row['missing'])
+        stage.start()
+        stage.put([{'map': 'Echo'}])
+        self.assertRaises(KeyError, stage.close)
@@ -0,0 +1,22 @@
+import os
+
+
+REPLAY_EXTENSION = '.SC2Replay'
+
+
+def iter_files(root_dir, extension):
+    """Lazily yield paths of files under root_dir ending in extension.
+
+    Directories are listed one at a time as the walk reaches them, so the
+    first paths are available right away and the full tree is never held in
+    memory. Hidden files and directories are skipped, as glob does.
+    """
+    for dirpath, dirnames, filenames in os.walk(root_dir):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith('.'))
+        for filename in sorted(filenames):
+            if filename.endswith(extension) and not filename.startswith('.'):
+                yield os.path.join(dirpath, filename)
+
+
+def iter_replay_files(root_dir):
+    return iter_files(root_dir, REPLAY_EXTENSION)
@@ -0,0 +1,132 @@
+import array
+import csv
+import io
+import queue
+import threading
+import time
+
+
+class WriterStage(object):
+    """Writes row batches handed over through a queue on its own thread.
+
+    Producers call put() with lists of rows and close() once they are done.
+    Subclasses implement write_batch() and flush(); flush() is called at
+    least every flush_interval seconds so output keeps appearing on slow
+    scans, and finish() once after the last flush. An exception raised
+    while writing is re-raised from close(). The time spent writing each
+    batch and waiting to hand each one over is kept in write_seconds and
+    put_seconds.
+    """
+
+    def __init__(self, max_batches=256, flush_interval=1.0):
+        self.flush_interval = flush_interval
+        self.rows = 0
+        self.bytes = 0
+        self.elapsed = 0.
+        self.write_seconds = array.array('d')
+        self.put_seconds = array.array('d')
+        self._queue = queue.Queue(maxsize=max_batches)
+        self._thread = threading.Thread(target=self._run,
+                                        name=type(self).__name__)
+        self._thread.daemon = True
+        self._error = None
+        self._start = None
+
+    def start(self):
+        self._start = time.perf_counter()
+        self._thread.start()
+        return self
+
+    def put(self, rows):
+        if self._error is not None:
+            raise self._error
+        start = time.perf_counter()
+        self._queue.put(rows)
+        self.put_seconds.append(time.perf_counter() - start)
+
+    def close(self):
+        self._queue.put(None)
+        self._thread.join()
+        self.elapsed = time.perf_counter() - self._start
+        if self._error is not None:
+            raise self._error
+
+    @property
+    def rows_per_sec(self):
+        return self.rows / self.elapsed if self.elapsed else 0.
+
+    @property
+    def bytes_per_sec(self):
+        return self.bytes / self.elapsed if self.elapsed else 0.
+
+    def _run(self):
+        last_flush = time.perf_counter()
+        while True:
+            try:
+                rows = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                rows = ()
+            if rows is None:
+                break
+            if self._error is not None:
+                # Keep draining so producers never block on a dead writer
+                continue
+            try:
+                if rows:
+                    start = time.perf_counter()
+                    self.write_batch(rows)
+                    self.rows += len(rows)
+                    self.write_seconds.append(time.perf_counter() - start)
+                now = time.perf_counter()
+                if now - last_flush >= self.flush_interval:
+                    self.flush()
+                    last_flush = now
+            except Exception as e:
+                self._error = e
+        if self._error is None:
+            try:
+                self.flush()
+                self.finish()
+            except Exception as e:
+                self._error = e
+
+    def write_batch(self, rows):
+        raise NotImplementedError
+
+    def flush(self):
+        raise NotImplementedError
+
+    def finish(self):
+        pass
+
+
+class CSVWriterStage(WriterStage):
+    """Serializes rows with csv.writer into blocks of about flush_bytes.
+
+    to_values turns a row into the list of values written for field_names.
+    """
+
+    def __init__(self, outfile, field_names, to_values,
+                 flush_bytes=1024 * 1024, **kwargs):
+        super(CSVWriterStage, self).__init__(**kwargs)
+        self.outfile = outfile
+        self.field_names = field_names
+        self.to_values = to_values
+        self.flush_bytes = flush_bytes
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer, lineterminator='\n')
+        self._writer.writerow(field_names)
+
+    def write_batch(self, rows):
+        self._writer.writerows(self.to_values(row) for row in rows)
+        if self._buffer.tell() >= self.flush_bytes:
+            self.flush()
+
+    def flush(self):
+        block = self._buffer.getvalue()
+        if block:
+            self.outfile.write(block)
+            self.bytes += len(block.encode('utf-8'))
+            self._buffer.seek(0)
+            self._buffer.truncate()
+        self.outfile.flush()